@@ -0,0 +1,120 @@
+# Benchmark for extractors.azure_form_recognizer.format_result on a synthetic
+# large AnalyzeResult. The indexed lookup is compared against the previous linear
+# scan over every table and cell (DocTable.in_range).
+#
+# to run: python -m benchmarks.format_result
+
+import time
+from typing import Callable
+
+import azure.ai.formrecognizer as fr
+
+import extractors.azure_form_recognizer as extractor
+
+PAGES = 300
+TABLES_PER_PAGE = 2
+ROWS = 10
+COLUMNS = 5
+PARAGRAPHS_PER_PAGE = 20
+
+
+def build_result(
+    pages: int = PAGES,
+    tables_per_page: int = TABLES_PER_PAGE,
+    rows: int = ROWS,
+    columns: int = COLUMNS,
+    paragraphs_per_page: int = PARAGRAPHS_PER_PAGE,
+) -> fr.AnalyzeResult:
+    """Build a synthetic AnalyzeResult with text paragraphs and tables on each page.
+
+    :param pages: Number of pages.
+    :param tables_per_page: Number of tables on each page.
+    :param rows: Number of rows in each table.
+    :param columns: Number of columns in each table.
+    :param paragraphs_per_page: Number of text paragraphs on each page.
+    """
+    paragraphs = []
+    tables = []
+
+    for page in range(1, pages + 1):
+        for p in range(paragraphs_per_page):
+            paragraphs.append(
+                fr.DocumentParagraph(
+                    content=f"page {page} paragraph {p}",
+                    bounding_regions=[
+                        fr.BoundingRegion(
+                            page_number=page, polygon=[fr.Point(x=0.5, y=p + 0.5)]
+                        )
+                    ],
+                )
+            )
+
+        for t in range(tables_per_page):
+            cells = []
+            for row in range(rows):
+                for col in range(columns):
+                    region = fr.BoundingRegion(
+                        page_number=page,
+                        polygon=[fr.Point(x=t * 100 + col + 1, y=row + 1)],
+                    )
+                    content = f"cell{page}_{t}_{row}_{col}"
+                    cells.append(
+                        fr.DocumentTableCell(
+                            row_index=row,
+                            column_index=col,
+                            content=content,
+                            bounding_regions=[region],
+                        )
+                    )
+                    paragraphs.append(
+                        fr.DocumentParagraph(content=content, bounding_regions=[region])
+                    )
+            tables.append(
+                fr.DocumentTable(row_count=rows, column_count=columns, cells=cells)
+            )
+
+    return fr.AnalyzeResult(paragraphs=paragraphs, tables=tables)
+
+
+def linear_format_result(fr_result: fr.AnalyzeResult) -> str:
+    """format_result as it was before tables were indexed."""
+    content = []
+    tables = extractor.get_tables(fr_result)
+
+    for paragraph in fr_result.paragraphs or []:
+        tbl = next(
+            (t for t in tables if t.in_range(paragraph.bounding_regions)),
+            None,
+        )
+        if tbl:
+            if not tbl.displayed:
+                content.append(tbl.format())
+                tbl.displayed = True
+        else:
+            content.append(paragraph.content)
+
+    return "\n\n".join(content)
+
+
+def timeit(func: Callable[[], str]) -> tuple[float, str]:
+    start = time.perf_counter()
+    result = func()
+    return time.perf_counter() - start, result
+
+
+def main():
+    fr_result = build_result()
+    print(f"{len(fr_result.paragraphs)} paragraphs, {len(fr_result.tables)} tables")
+
+    indexed_secs, indexed = timeit(
+        lambda: extractor.format_result(fr_result, discard_roles=[])
+    )
+    linear_secs, linear = timeit(lambda: linear_format_result(fr_result))
+
+    assert indexed == linear, "indexed output differs from linear scan"
+    print(f"linear scan: {linear_secs:.3f}s")
+    print(f"indexed:     {indexed_secs:.3f}s ({linear_secs / indexed_secs:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+# Microbenchmark for table cells and markdown rendering in
+# extractors.azure_form_recognizer, against the previous pydantic cells and
+# tabulate rendering.
+#
+# to run: python -m benchmarks.format_table
+
+import time
+from typing import Callable
+
+from pydantic import BaseModel
+from tabulate import tabulate
+
+from extractors.azure_form_recognizer import DocTable, DocTableCell
+
+TABLES = 1000
+ROWS = 20
+COLUMNS = 6
+
+
+class PydanticTableCell(BaseModel):
+    page_number: int
+    row_index: int
+    column_index: int
+    text: str
+    x: float
+    y: float
+
+
+def build_cells(cls: Callable[..., object]) -> list[list]:
+    return [
+        [
+            cls(
+                page_number=1,
+                row_index=row,
+                column_index=col,
+                text=f"item {row}" if col == 0 else f"${row * col},000",
+                x=col,
+                y=row,
+            )
+            for row in range(ROWS)
+            for col in range(COLUMNS)
+        ]
+        for _ in range(TABLES)
+    ]
+
+
+def tabulate_format(cells: list) -> str:
+    """DocTable.format as it was before the markdown writer."""
+    cells.sort(key=lambda x: x.row_index)
+    cur_row = 0
+    buckets = [[]]
+
+    for cell in cells:
+        if cell.row_index != cur_row:
+            buckets.append([])
+            cur_row += 1
+        buckets[cur_row].append(cell.text)
+
+    header = buckets.pop(0)
+    return tabulate(buckets, headers=header, tablefmt="github")
+
+
+def timeit(name: str, func: Callable[[], object]) -> tuple[float, object]:
+    start = time.perf_counter()
+    result = func()
+    secs = time.perf_counter() - start
+    print(f"{name:<20} {secs:.3f}s")
+    return secs, result
+
+
+def main():
+    print(f"{TABLES} tables of {ROWS} x {COLUMNS} cells")
+
+    pydantic_secs, pydantic_cells = timeit(
+        "pydantic cells", lambda: build_cells(PydanticTableCell)
+    )
+    slots_secs, slots_cells = timeit("slotted cells", lambda: build_cells(DocTableCell))
+    print(f"{'':<20} {pydantic_secs / slots_secs:.1f}x")
+
+    tabulate_secs, expected = timeit(
+        "tabulate", lambda: [tabulate_format(cells) for cells in pydantic_cells]
+    )
+    writer_secs, actual = timeit(
+        "markdown writer",
+        lambda: [DocTable(cells=cells).format() for cells in slots_cells],
+    )
+    print(f"{'':<20} {tabulate_secs / writer_secs:.1f}x")
+
+    assert expected == actual, "markdown writer output differs from tabulate"
+
+
+if __name__ == "__main__":
+    main()
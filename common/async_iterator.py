@@ -0,0 +1,16 @@
+from typing import AsyncIterable, AsyncIterator, Iterable, TypeVar
+
+T = TypeVar("T")
+
+
+async def to_async_iterator(items: Iterable[T] | AsyncIterable[T]) -> AsyncIterator[T]:
+    """Iterate over sync or async items asynchronously.
+
+    :param items: The items, an iterable or an async iterable.
+    """
+    if isinstance(items, AsyncIterable):
+        async for item in items:
+            yield item
+    else:
+        for item in items:
+            yield item
@@ -0,0 +1,94 @@
+import hashlib
+import os
+import tempfile
+
+
+class DiskCache:
+    """Size-bounded key/value cache on local disk with LRU eviction.
+
+    Each entry is one file named after the SHA-256 of its key. Reads refresh the
+    file's modification time, and the least recently used files are removed once
+    the total size goes over `max_bytes`.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        """
+        :param directory: Folder for the cache files, created if missing.
+        :param max_bytes: Maximum total size of the cache files.
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key: str) -> str:
+        """Return the path of the file for a key.
+
+        :param key: Cache key.
+        """
+        name = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, name)
+
+    def get(self, key: str) -> bytes | None:
+        """Return the cached value for a key, or None on a miss.
+
+        :param key: Cache key.
+        """
+        path = self.path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+            return data
+        except FileNotFoundError:
+            return None
+
+    def set(self, key: str, data: bytes):
+        """Store a value and evict least recently used entries over the budget.
+
+        :param key: Cache key.
+        :param data: Value to store.
+        """
+        if len(data) > self.max_bytes:
+            return
+
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, self.path(key))
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+        self.evict()
+
+    def delete(self, key: str):
+        """Remove an entry if it exists.
+
+        :param key: Cache key.
+        """
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    def evict(self):
+        """Remove least recently used entries until the cache fits its budget."""
+        entries = []
+        total = 0
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.is_file() and not entry.name.endswith(".tmp"):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+                    total += stat.st_size
+
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
@@ -0,0 +1,223 @@
+import hashlib
+import os
+import threading
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import IO, Iterator
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None  # type: ignore
+    import msvcrt
+
+# Vectors are appended as float32 rows to one file that is memory-mapped for
+# reads, so a hit is a view into the page cache rather than a parsed list. The
+# index file maps the SHA-256 of each text to its row; it is written after the
+# row, so a crash can at worst leave an unindexed row that the next write reuses.
+# Writers hold an exclusive lock on the lock file (flock, or msvcrt.locking on
+# Windows) and first read the index lines other writers appended, so processes
+# and instances can share a directory.
+
+VECTORS_FILE = "vectors.f32"
+INDEX_FILE = "index.txt"
+LOCK_FILE = "lock"
+
+
+def lock_file(f: IO[bytes]):
+    """Take the exclusive lock of an open file, waiting for other holders."""
+    if fcntl is not None:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        return
+    f.seek(0)
+    while True:
+        try:
+            # locks the first byte, retries for 10 seconds before raising
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            return
+        except OSError:
+            continue
+
+
+def unlock_file(f: IO[bytes]):
+    """Release the lock taken by `lock_file`."""
+    if fcntl is not None:
+        fcntl.flock(f, fcntl.LOCK_UN)
+        return
+    f.seek(0)
+    msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def text_key(text: str) -> str:
+    """Return the content hash of a text."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """Append-only embedding store keyed by content hash, one per model.
+
+    The first line of the index holds the dimensions of the vectors, every other
+    line is "<sha256> <row>". Safe to use from several threads and processes;
+    reads see the rows of other writers from their next write on. Use
+    `get_embedding_cache` to share one instance per directory in a process.
+    """
+
+    def __init__(self, directory: str):
+        """
+        :param directory: Folder for the cache files, created if missing.
+        """
+        self.directory = directory
+        self.vectors_path = os.path.join(directory, VECTORS_FILE)
+        self.index_path = os.path.join(directory, INDEX_FILE)
+        self.lock_path = os.path.join(directory, LOCK_FILE)
+        self.index: dict[str, int] = {}
+        self.offset = 0
+        self.dimensions: int | None = None
+        self.array: np.ndarray | None = None
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        with self.lock, self.file_lock():
+            self.load()
+
+    @contextmanager
+    def file_lock(self) -> Iterator[None]:
+        """Hold the exclusive lock of the directory, across processes."""
+        with open(self.lock_path, "ab") as f:
+            lock_file(f)
+            try:
+                yield
+            finally:
+                unlock_file(f)
+
+    def load(self):
+        """Read the index lines appended since the last load and map the vectors.
+
+        Call with the file lock held: an incomplete last line can only be left
+        by a crashed writer, and is truncated.
+        """
+        try:
+            with open(self.index_path, "rb") as f:
+                f.seek(self.offset)
+                data = f.read()
+        except FileNotFoundError:
+            return
+
+        end = data.rfind(b"\n") + 1
+        if end < len(data):
+            with open(self.index_path, "r+b") as f:
+                f.truncate(self.offset + end)
+        if not end:
+            return
+
+        lines = data[:end].decode("utf-8").splitlines()
+        self.offset += end
+        if self.dimensions is None:
+            self.dimensions = int(lines.pop(0))
+        index = dict(self.index)
+        for line in lines:
+            key, row = line.split(" ")
+            index[key] = int(row)
+        self.index = index
+        self.remap()
+
+    def remap(self):
+        """Map the indexed rows of the vectors file."""
+        rows = max(self.index.values(), default=-1) + 1
+        if rows == 0 or self.dimensions is None:
+            self.array = None
+            return
+        self.array = np.memmap(
+            self.vectors_path,
+            dtype=np.float32,
+            mode="r",
+            shape=(rows, self.dimensions),
+        )
+
+    def get(self, text: str) -> np.ndarray | None:
+        """Return the cached vector of a text, a read-only view, or None.
+
+        :param text: The embedded text.
+        """
+        return self.get_many([text])[0]
+
+    def get_many(self, texts: list[str]) -> list[np.ndarray | None]:
+        """Return the cached vector of each text, None for misses.
+
+        :param texts: The embedded texts.
+        """
+        with self.lock:
+            array = self.array
+            index = self.index
+        if array is None:
+            return [None] * len(texts)
+
+        results: list[np.ndarray | None] = []
+        for text in texts:
+            row = index.get(text_key(text))
+            results.append(array[row] if row is not None else None)
+        return results
+
+    def put_many(self, texts: list[str], vectors: np.ndarray):
+        """Store the vectors of texts that are not cached yet.
+
+        :param texts: The embedded texts.
+        :param vectors: One row per text.
+        """
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if len(texts) != len(vectors):
+            raise ValueError(f"Got {len(vectors)} vectors for {len(texts)} texts")
+        if not len(texts):
+            return
+
+        with self.lock, self.file_lock():
+            self.load()
+            dimensions = vectors.shape[1]
+            if self.dimensions is None:
+                header = f"{dimensions}\n".encode("utf-8")
+                with open(self.index_path, "ab") as f:
+                    f.write(header)
+                self.dimensions = dimensions
+                self.offset += len(header)
+            elif dimensions != self.dimensions:
+                raise ValueError(
+                    f"Expected vectors of {self.dimensions} dimensions, got"
+                    f" {dimensions}"
+                )
+
+            new: dict[str, int] = {}
+            rows = []
+            next_row = max(self.index.values(), default=-1) + 1
+            for text, vector in zip(texts, vectors):
+                key = text_key(text)
+                if key in self.index or key in new:
+                    continue
+                new[key] = next_row + len(rows)
+                rows.append(vector)
+            if not rows:
+                return
+
+            mode = "r+b" if os.path.exists(self.vectors_path) else "wb"
+            with open(self.vectors_path, mode) as f:
+                f.seek(next_row * dimensions * 4)
+                f.write(np.stack(rows).tobytes())
+            lines = "".join(f"{key} {row}\n" for key, row in new.items())
+            with open(self.index_path, "ab") as f:
+                f.write(lines.encode("utf-8"))
+
+            self.offset += len(lines.encode("utf-8"))
+            self.index = {**self.index, **new}
+            self.remap()
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+
+@lru_cache
+def get_embedding_cache(directory: str) -> EmbeddingCache:
+    """Get the embedding cache of a folder, one per process.
+
+    :param directory: Folder for the cache files.
+    """
+    return EmbeddingCache(directory)
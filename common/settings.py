@@ -1,3 +1,4 @@
+from pydantic import BaseModel
 from pydantic_settings import BaseSettings
 
 
@@ -6,6 +7,8 @@ class FormRecognizerSettings(BaseSettings):
 
     azure_form_recognizer_endpoint: str
     azure_form_recognizer_key: str
+    azure_form_recognizer_cache_dir: str | None = None
+    azure_form_recognizer_cache_max_bytes: int = 1024 * 1024 * 1024
 
     class Config:
         env_file = ".env"
@@ -16,12 +19,32 @@ class AzureBlobStorageSettings(BaseSettings):
     """Settings for Azure Blob Storage."""
 
     azure_storage_connection_string: str
+    azure_storage_cache_dir: str | None = None
+    azure_storage_cache_max_bytes: int = 1024 * 1024 * 1024
+    azure_storage_cache_max_age_secs: int = 0
 
     class Config:
         env_file = ".env"
         extra = "ignore"
 
 
+class AzureOpenAIDeployment(BaseModel):
+    """One deployment of the Azure OpenAI router.
+
+    Fields left out take their value from AzureOpenAISettings.
+    """
+
+    openai_azure_endpoint: str
+    azure_openai_api_key: str
+    deployment_model: str
+    openai_api_version: str | None = None
+    openai_embedding_model: str | None = None
+    openai_tokens_per_minute: int | None = None
+    openai_requests_per_minute: int | None = None
+    openai_embedding_tokens_per_minute: int | None = None
+    openai_embedding_requests_per_minute: int | None = None
+
+
 class AzureOpenAISettings(BaseSettings):
     """Settings for Azure OpenAI service."""
 
@@ -34,6 +57,26 @@ class AzureOpenAISettings(BaseSettings):
     request_timeout: int = 30
     max_retry_time_secs: int = 32
     max_token_count: int | None = None
+    openai_max_connections: int = 100
+    openai_max_keepalive_connections: int = 20
+    openai_http2: bool = False
+    openai_embedding_max_items: int = 16
+    openai_embedding_max_tokens: int = 8191
+    openai_embedding_max_concurrency: int = 4
+    openai_max_tokens: int | None = None
+    openai_tokens_per_minute: int = 0
+    openai_requests_per_minute: int = 0
+    openai_embedding_tokens_per_minute: int = 0
+    openai_embedding_requests_per_minute: int = 0
+    openai_image_requests_per_minute: int = 0
+    openai_completion_cache_path: str | None = None
+    openai_completion_cache_max_entries: int = 1024
+    openai_completion_cache_max_bytes: int = 1024 * 1024 * 1024
+    openai_completion_cache_ttl_secs: int = 0
+    openai_embedding_cache_dir: str | None = None
+    openai_deployments: list[AzureOpenAIDeployment] = []
+    openai_router_max_failures: int = 3
+    openai_router_cooldown_secs: int = 30
 
     class Config:
         env_file = ".env"
@@ -0,0 +1,47 @@
+import asyncio
+from typing import Awaitable, Callable, Hashable, TypeVar
+
+from pydantic import BaseModel
+
+T = TypeVar("T")
+
+
+class FlightStats(BaseModel):
+    """Counters of a SingleFlight."""
+
+    calls: int = 0
+    coalesced: int = 0
+
+
+class SingleFlight:
+    """Deduplicate concurrent calls with the same key.
+
+    The first caller of a key starts the call; callers arriving while it is in
+    flight await the same result, or exception, instead of starting their own.
+    The call runs in its own task, so a cancelled caller does not cancel it for
+    the others.
+    """
+
+    def __init__(self):
+        self.flights: dict[Hashable, asyncio.Task] = {}
+        self.stats = FlightStats()
+
+    async def run(self, key: Hashable, call: Callable[[], Awaitable[T]]) -> T:
+        """Return the result of `call`, shared with concurrent calls of `key`.
+
+        :param key: Identity of the call.
+        :param call: Starts the call, invoked only if none is in flight.
+        """
+        self.stats.calls += 1
+        task = self.flights.get(key)
+        if task is not None and task.get_loop() is asyncio.get_running_loop():
+            self.stats.coalesced += 1
+        else:
+            task = asyncio.ensure_future(call())
+            self.flights[key] = task
+            task.add_done_callback(lambda _: self.forget(key, task))
+        return await asyncio.shield(task)
+
+    def forget(self, key: Hashable, task: asyncio.Task):
+        if self.flights.get(key) is task:
+            del self.flights[key]
@@ -0,0 +1,172 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+
+from pydantic import BaseModel
+
+
+class CacheStats(BaseModel):
+    """Hit and miss counters of a cache."""
+
+    memory_hits: int = 0
+    disk_hits: int = 0
+    misses: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0
+
+
+class SQLiteCache:
+    """Two-tier key/value cache: an in-memory LRU in front of a SQLite table.
+
+    Entries older than `ttl_seconds` are misses and are removed. The memory tier
+    holds up to `max_entries` entries; the SQLite tier drops the least recently
+    read entries once their total size goes over `max_bytes`. With no `path` the
+    cache is memory only. Safe to use from several threads.
+    """
+
+    def __init__(
+        self,
+        path: str | None,
+        max_entries: int = 1024,
+        max_bytes: int = 1024 * 1024 * 1024,
+        ttl_seconds: int = 0,
+    ):
+        """
+        :param path: SQLite database file, created with its folder if missing.
+        :param max_entries: Maximum number of entries in memory.
+        :param max_bytes: Maximum total size of the values on disk.
+        :param ttl_seconds: Lifetime of an entry, 0 for no expiry.
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.stats = CacheStats()
+        self.memory: OrderedDict[str, tuple[bytes, float]] = OrderedDict()
+        self.lock = threading.Lock()
+        self.db: sqlite3.Connection | None = None
+
+        if path is not None:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value BLOB,"
+                " size INTEGER, created REAL, accessed REAL)"
+            )
+            self.db.execute(
+                "CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)"
+            )
+            self.db.commit()
+
+    def expired(self, created: float, now: float) -> bool:
+        return self.ttl_seconds > 0 and now - created > self.ttl_seconds
+
+    def get(self, key: str) -> bytes | None:
+        """Return the cached value for a key, or None on a miss.
+
+        :param key: Cache key.
+        """
+        now = time.time()
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is not None and not self.expired(entry[1], now):
+                self.memory.move_to_end(key)
+                self.stats.memory_hits += 1
+                return entry[0]
+            self.memory.pop(key, None)
+
+            if self.db is not None:
+                row = self.db.execute(
+                    "SELECT value, created FROM entries WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and not self.expired(row[1], now):
+                    self.db.execute(
+                        "UPDATE entries SET accessed = ? WHERE key = ?", (now, key)
+                    )
+                    self.db.commit()
+                    self.remember(key, row[0], row[1])
+                    self.stats.disk_hits += 1
+                    return row[0]
+                if row is not None:
+                    self.db.execute("DELETE FROM entries WHERE key = ?", (key,))
+                    self.db.commit()
+
+            self.stats.misses += 1
+            return None
+
+    def set(self, key: str, value: bytes):
+        """Store a value in both tiers and evict entries over the budgets.
+
+        :param key: Cache key.
+        :param value: Value to store.
+        """
+        now = time.time()
+        with self.lock:
+            self.remember(key, value, now)
+
+            if self.db is not None and len(value) <= self.max_bytes:
+                self.db.execute(
+                    "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)",
+                    (key, value, len(value), now, now),
+                )
+                self.evict(now)
+                self.db.commit()
+
+    def remember(self, key: str, value: bytes, created: float):
+        self.memory[key] = (value, created)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+
+    def evict(self, now: float):
+        """Remove expired entries, then least recently read ones over max_bytes."""
+        assert self.db is not None
+        if self.ttl_seconds > 0:
+            self.db.execute(
+                "DELETE FROM entries WHERE created < ?", (now - self.ttl_seconds,)
+            )
+
+        (total,) = self.db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM entries"
+        ).fetchone()
+        if total <= self.max_bytes:
+            return
+
+        rows = self.db.execute("SELECT key, size FROM entries ORDER BY accessed")
+        keys = []
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            keys.append((key,))
+            total -= size
+        self.db.executemany("DELETE FROM entries WHERE key = ?", keys)
+
+    def close(self):
+        """Close the database."""
+        with self.lock:
+            if self.db is not None:
+                self.db.close()
+                self.db = None
+
+
+@lru_cache
+def get_sqlite_cache(
+    path: str,
+    max_entries: int = 1024,
+    max_bytes: int = 1024 * 1024 * 1024,
+    ttl_seconds: int = 0,
+) -> SQLiteCache:
+    """Get the cache of a SQLite file, one per process.
+
+    :param path: SQLite database file, created if missing.
+    :param max_entries: Maximum number of entries in memory.
+    :param max_bytes: Maximum total size of the values on disk.
+    :param ttl_seconds: Lifetime of an entry, 0 for no expiry.
+    """
+    return SQLiteCache(path, max_entries, max_bytes, ttl_seconds)
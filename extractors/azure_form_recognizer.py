@@ -1,11 +1,21 @@
-from typing import Literal
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from typing import AsyncIterable, AsyncIterator, Iterable, Iterator, Literal
 
 import azure.ai.formrecognizer as fr
 from pydantic import BaseModel
-from tabulate import tabulate
 
+import services.storage.azure_blob_storage as blob_storage
+from common.async_iterator import to_async_iterator
 from common.settings import Settings
-from services.ai.azure_form_recognizer import analyze
+from extractors.markdown_table import format_table
+from services.ai.azure_form_recognizer import (
+    Document,
+    analyze,
+    blob_key,
+    get_client,
+)
 
 # Extract textual content from a document
 # Tables will be added in place in the page and formatted in markdown format
@@ -20,7 +30,10 @@ class ParagraphRole(BaseModel):
     role: Literal["pageHeader", "pageFooter", "pageNumber"]
 
 
-class DocTableCell(BaseModel):
+# Table cells are created once per cell of every table in the document, so they
+# are slotted dataclasses rather than pydantic models.
+@dataclass(slots=True)
+class DocTableCell:
     page_number: int
     row_index: int
     column_index: int
@@ -29,8 +42,9 @@ class DocTableCell(BaseModel):
     y: float
 
 
-class DocTable(BaseModel):
-    cells: list[DocTableCell]
+@dataclass(slots=True)
+class DocTable:
+    cells: list[DocTableCell] = field(default_factory=list)
     displayed: bool = False
 
     def in_range(self, input: list[fr.BoundingRegion] | None) -> bool:
@@ -59,7 +73,31 @@ class DocTable(BaseModel):
             buckets[cur_row].append(cell.text)
 
         header = buckets.pop(0)
-        return tabulate(buckets, headers=header, tablefmt="github")
+        return format_table(header, buckets)
+
+
+class ExtractResult(BaseModel):
+    document: str
+    content: str | None = None
+    error: str | None = None
+
+
+class DocBlock(BaseModel):
+    content: str
+    table: bool = False
+
+
+class DocPage(BaseModel):
+    page_number: int | None
+    blocks: list[DocBlock] = []
+
+    @property
+    def content(self) -> str:
+        return "\n\n".join(block.content for block in self.blocks)
+
+
+# page number -> (x, y) of the cell anchor point -> table
+TableIndex = dict[int, dict[tuple[float, float], DocTable]]
 
 
 def get_tables(fr_result: fr.AnalyzeResult) -> list[DocTable]:
@@ -86,42 +124,216 @@ def get_tables(fr_result: fr.AnalyzeResult) -> list[DocTable]:
     return tables
 
 
-def format_result(
+def index_tables(tables: list[DocTable]) -> TableIndex:
+    """Index tables by page and cell anchor point.
+
+    A cell is filed under the page of the first cell of its table, and the first
+    table wins on duplicated anchors; this matches `DocTable.in_range`.
+
+    :param tables: List of tables.
+    :return: page number -> (x, y) -> table.
+    """
+    index: TableIndex = {}
+
+    for tbl in tables:
+        if not tbl.cells:
+            continue
+
+        anchors = index.setdefault(tbl.cells[0].page_number, {})
+        for cell in tbl.cells:
+            anchors.setdefault((cell.x, cell.y), tbl)
+
+    return index
+
+
+def lookup_table(
+    index: TableIndex, input: list[fr.BoundingRegion] | None
+) -> DocTable | None:
+    """Find the table that a bounding region belongs to.
+
+    :param index: Table index from `index_tables`.
+    :param input: Bounding regions of a paragraph.
+    :return: The table, or None if the region is not in a table.
+    """
+    if not input or not input[0].polygon:
+        return None
+
+    anchors = index.get(input[0].page_number)
+    if not anchors:
+        return None
+
+    point = input[0].polygon[0]
+    return anchors.get((point.x, point.y))
+
+
+def format_pages(
     fr_result: fr.AnalyzeResult, discard_roles: list[ParagraphRole]
-) -> str:
-    content = []
-    tables = get_tables(fr_result)
+) -> Iterator[DocPage]:
+    """Format the analyze result one page at a time.
 
-    def in_table(paragraph: fr.DocumentParagraph) -> DocTable | None:
-        return next(
-            (tbl for tbl in tables if tbl.in_range(paragraph.bounding_regions)), None
-        )
+    Paragraphs without bounding regions stay on the page of the paragraph before
+    them. Pages with no content left after discarding roles are skipped.
 
+    :param fr_result: Form Recognizer result.
+    :param discard_roles: List of roles to discard.
+    :return: Iterator of formatted pages, in reading order.
+    """
+    index = index_tables(get_tables(fr_result))
     drop_roles = [role.role for role in discard_roles]
+    page = DocPage(page_number=None)
 
     if fr_result.paragraphs:
         for paragraph in filter(
             lambda x: x.role not in drop_roles, fr_result.paragraphs
         ):
-            tbl = in_table(paragraph)
+            if (
+                paragraph.bounding_regions
+                and paragraph.bounding_regions[0].page_number != page.page_number
+            ):
+                if page.blocks:
+                    yield page
+                page = DocPage(page_number=paragraph.bounding_regions[0].page_number)
+
+            tbl = lookup_table(index, paragraph.bounding_regions)
             if tbl:
                 if not tbl.displayed:
-                    content.append(tbl.format())
+                    page.blocks.append(DocBlock(content=tbl.format(), table=True))
                     tbl.displayed = True
             else:
-                content.append(paragraph.content)
+                page.blocks.append(DocBlock(content=paragraph.content))
 
-    return "\n\n".join(content)
+    if page.blocks:
+        yield page
+
+
+def format_result(
+    fr_result: fr.AnalyzeResult, discard_roles: list[ParagraphRole]
+) -> str:
+    return "\n\n".join(page.content for page in format_pages(fr_result, discard_roles))
 
 
 async def extract(
-    settings: Settings, sas_url: str, discard_roles: list[ParagraphRole] = []
+    settings: Settings,
+    sas_url: Document,
+    discard_roles: list[ParagraphRole] = [],
+    cache_key: str | None = None,
 ) -> str:
     """Extract textual content from a document.
 
     :param settings: Settings object
-    :param sas_url: SAS URL of the document
+    :param sas_url: SAS URL of the document, or its content as bytes, a file
+        path (Path, or str of an existing file) or an async byte stream
     :param discard_roles: List of roles to discard
+    :param cache_key: Content hash or blob ETag of the document, to reuse a
+        cached analyze result
     """
-    fr_result = await analyze(settings, sas_url)
+    fr_result = await analyze(settings, sas_url, cache_key=cache_key)
     return format_result(fr_result, discard_roles)
+
+
+async def extract_pages(
+    settings: Settings,
+    sas_url: Document,
+    discard_roles: list[ParagraphRole] = [],
+    cache_key: str | None = None,
+) -> AsyncIterator[DocPage]:
+    """Extract textual content from a document, one page at a time.
+
+    Each page is yielded as soon as it is formatted, so consumers can start work
+    before the whole document is formatted.
+
+    :param settings: Settings object
+    :param sas_url: SAS URL of the document, or its content as bytes, a file
+        path (Path, or str of an existing file) or an async byte stream
+    :param discard_roles: List of roles to discard
+    :param cache_key: Content hash or blob ETag of the document, to reuse a
+        cached analyze result
+    """
+    fr_result = await analyze(settings, sas_url, cache_key=cache_key)
+    for page in format_pages(fr_result, discard_roles):
+        yield page
+
+
+async def extract_batch(
+    settings: Settings,
+    documents: Iterable[str] | AsyncIterable[str],
+    discard_roles: list[ParagraphRole] = [],
+    container_name: str | None = None,
+    concurrency: int = 4,
+) -> AsyncIterator[ExtractResult]:
+    """Extract textual content from many documents concurrently.
+
+    At most `concurrency` documents are in flight, and documents are only pulled
+    from `documents` when a slot frees up and the consumer keeps up. Results are
+    yielded in completion order; a failed document yields a result with `error`
+    set instead of aborting the batch. One Form Recognizer client, and one blob
+    storage session, is shared by all documents. With the analyze cache
+    configured, blobs are cached by their ETag.
+
+    :param settings: Settings object
+    :param documents: SAS URLs, or blob names when `container_name` is given
+    :param discard_roles: List of roles to discard
+    :param container_name: Container of the blobs, to create their SAS URLs
+    :param concurrency: Maximum number of documents analyzed at the same time
+    """
+    source = to_async_iterator(documents)
+    cached = bool(settings.azure_form_recognizer_cache_dir)
+    storage = None
+    if container_name is not None:
+        storage = blob_storage.BlobStorage(settings)
+    source_lock = asyncio.Lock()
+    results: asyncio.Queue[ExtractResult | Exception | None] = asyncio.Queue(
+        maxsize=concurrency
+    )
+
+    async def next_document() -> str | None:
+        async with source_lock:
+            return await anext(source, None)
+
+    async def extract_one(client, document: str) -> ExtractResult:
+        try:
+            sas_url = document
+            cache_key = None
+            if storage is not None and container_name is not None:
+                sas_url = await storage.create_sas_url(
+                    container_name=container_name, blob_name=document
+                )
+                if cached:
+                    etag = await storage.get_blob_etag(container_name, document)
+                    cache_key = blob_key(container_name, document, etag)
+            fr_result = await analyze(
+                settings, sas_url, cache_key=cache_key, client=client
+            )
+            return ExtractResult(
+                document=document, content=format_result(fr_result, discard_roles)
+            )
+        except Exception as e:
+            logging.exception("Failed to extract %s", document)
+            return ExtractResult(document=document, error=str(e))
+
+    async def worker(client):
+        try:
+            while (document := await next_document()) is not None:
+                await results.put(await extract_one(client, document))
+        except Exception as e:
+            await results.put(e)
+        await results.put(None)
+
+    async with get_client(settings) as client:
+        workers = [asyncio.create_task(worker(client)) for _ in range(concurrency)]
+        try:
+            running = len(workers)
+            while running:
+                result = await results.get()
+                if result is None:
+                    running -= 1
+                elif isinstance(result, Exception):
+                    raise result
+                else:
+                    yield result
+        finally:
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            if storage is not None:
+                await storage.close()
@@ -0,0 +1,139 @@
+from dataclasses import dataclass
+from typing import Iterable, Iterator
+
+from pydantic import BaseModel
+
+from extractors.azure_form_recognizer import DocPage
+from services.ai.token_count import get_encoding
+
+# Split extracted pages into chunks for embedding.
+# Paragraphs and tables are packed in reading order into chunks of up to
+# max_tokens tokens. A table is never split, a table larger than max_tokens is a
+# chunk of its own. A paragraph larger than max_tokens is split on token
+# boundaries that are also character boundaries, a token can end inside a
+# multi-byte UTF-8 character. Every block is encoded once; the token count of a
+# chunk is the sum of its blocks plus the separators between them.
+
+SEPARATOR = "\n\n"
+
+
+class Chunk(BaseModel):
+    content: str
+    page_numbers: list[int]
+    token_count: int
+
+
+@dataclass(slots=True)
+class _Piece:
+    content: str
+    page_number: int | None
+    token_count: int
+
+
+def _to_chunk(pieces: list[_Piece], token_count: int) -> Chunk:
+    return Chunk(
+        content=SEPARATOR.join(piece.content for piece in pieces),
+        page_numbers=sorted(
+            {piece.page_number for piece in pieces if piece.page_number is not None}
+        ),
+        token_count=token_count,
+    )
+
+
+def chunk_pages(
+    pages: Iterable[DocPage],
+    max_tokens: int,
+    overlap_tokens: int = 0,
+    encoding_name: str = "cl100k_base",
+) -> Iterator[Chunk]:
+    """Pack the paragraphs and tables of pages into token-budgeted chunks.
+
+    :param pages: Pages from `format_pages` or `extract_pages`.
+    :param max_tokens: Maximum number of tokens in a chunk.
+    :param overlap_tokens: Maximum number of tokens of whole blocks at the end of
+        a chunk that are repeated at the start of the next one.
+    :param encoding_name: The name of the tiktoken encoding to count with.
+    :return: Iterator of chunks, in reading order.
+    """
+    encoding = get_encoding(encoding_name)
+    separator_tokens = len(encoding.encode(SEPARATOR))
+
+    current: list[_Piece] = []
+    current_tokens = 0
+
+    def pieces_of(page_number: int | None, content: str, table: bool):
+        tokens = encoding.encode(content)
+        if table or len(tokens) <= max_tokens:
+            yield _Piece(
+                content=content, page_number=page_number, token_count=len(tokens)
+            )
+            return
+
+        token_bytes = encoding.decode_tokens_bytes(tokens)
+        data = b"".join(token_bytes)
+        offsets = [0]
+        for token in token_bytes:
+            offsets.append(offsets[-1] + len(token))
+
+        def on_boundary(i: int) -> bool:
+            # the token starts a character unless its first byte continues one
+            return i == len(tokens) or data[offsets[i]] & 0xC0 != 0x80
+
+        start = 0
+        while start < len(tokens):
+            end = min(start + max_tokens, len(tokens))
+            while end > start and not on_boundary(end):
+                end -= 1
+            if end == start:
+                # a character longer than max_tokens, keep it whole
+                end = start + max_tokens
+                while not on_boundary(end):
+                    end += 1
+            yield _Piece(
+                content=data[offsets[start] : offsets[end]].decode("utf-8"),
+                page_number=page_number,
+                token_count=end - start,
+            )
+            start = end
+
+    def overlap(pieces: list[_Piece]) -> list[_Piece]:
+        tail: list[_Piece] = []
+        tokens = 0
+        for piece in reversed(pieces):
+            tokens += piece.token_count + (separator_tokens if tail else 0)
+            if tokens > overlap_tokens:
+                break
+            tail.append(piece)
+        tail.reverse()
+        return tail
+
+    for page in pages:
+        for block in page.blocks:
+            for piece in pieces_of(page.page_number, block.content, block.table):
+                if (
+                    current
+                    and current_tokens + separator_tokens + piece.token_count
+                    > max_tokens
+                ):
+                    yield _to_chunk(current, current_tokens)
+                    current = overlap(current)
+                    current_tokens = sum(p.token_count for p in current)
+                    current_tokens += separator_tokens * max(len(current) - 1, 0)
+
+                    # drop overlap that leaves no room for the next piece
+                    while (
+                        current
+                        and current_tokens + separator_tokens + piece.token_count
+                        > max_tokens
+                    ):
+                        dropped = current.pop(0)
+                        current_tokens -= dropped.token_count
+                        current_tokens -= separator_tokens if current else 0
+
+                if current:
+                    current_tokens += separator_tokens
+                current.append(piece)
+                current_tokens += piece.token_count
+
+    if current:
+        yield _to_chunk(current, current_tokens)
@@ -0,0 +1,86 @@
+import re
+
+from tabulate import tabulate
+
+# Renders a table in GitHub markdown exactly like
+# tabulate(rows, headers=header, tablefmt="github"), without tabulate's per cell
+# type inference and alignment passes. It only handles tables where every
+# column is plainly text; anything else (numeric columns, multiline or
+# non-ASCII cells, ...) goes through tabulate.
+
+_NON_NUMERIC = re.compile(r"[^0-9+\-.,\s]")
+
+
+def _is_text(value: str) -> bool:
+    """Return True if tabulate would certainly type the value as a string."""
+    if value in ("True", "False") or not _NON_NUMERIC.search(value):
+        return False
+
+    try:
+        float(value)
+        return False
+    except ValueError:
+        return True
+
+
+def _is_plain(value: str) -> bool:
+    return value.isascii() and value.isprintable()
+
+
+def format_fast(header: list[str], rows: list[list[str]]) -> str | None:
+    """Format a table, None if it needs tabulate to format it.
+
+    :param header: Header row.
+    :param rows: Data rows.
+    """
+    if not rows:
+        return None
+
+    ncols = len(header)
+    widths = [len(h) + 2 for h in header]
+    is_text = [False] * ncols
+
+    if not all(_is_plain(h) for h in header):
+        return None
+
+    grid = [[""] * ncols for _ in rows]
+    for r, row in enumerate(rows):
+        if len(row) > ncols:
+            return None
+
+        line = grid[r]
+        for c, value in enumerate(row):
+            if not _is_plain(value):
+                return None
+            if not is_text[c] and _is_text(value):
+                is_text[c] = True
+
+            value = value.strip()
+            line[c] = value
+            if len(value) > widths[c]:
+                widths[c] = len(value)
+
+    if not all(is_text):
+        return None
+
+    lines = [
+        "| " + " | ".join(h.ljust(w) for h, w in zip(header, widths)) + " |",
+        "|" + "|".join("-" * (w + 2) for w in widths) + "|",
+    ]
+    for line in grid:
+        lines.append("| " + " | ".join(v.ljust(w) for v, w in zip(line, widths)) + " |")
+
+    return "\n".join(lines)
+
+
+def format_table(header: list[str], rows: list[list[str]]) -> str:
+    """Format a table in GitHub markdown.
+
+    :param header: Header row.
+    :param rows: Data rows.
+    :return: Markdown table, same as tabulate's "github" format.
+    """
+    result = format_fast(header, rows)
+    if result is None:
+        result = tabulate(rows, headers=header, tablefmt="github")
+    return result
@@ -9,7 +9,8 @@ import services.ai.azure_openai as azure_openai
 import services.storage.azure_blob_storage as blob_storage
 from common.settings import Settings
 from extractors.azure_form_recognizer import ParagraphRole, extract
-from services.ai.token_count import num_tokens_from_string
+from services.ai.azure_form_recognizer import blob_key
+from summarizers.map_reduce import map_reduce
 
 DISCARD_ROLES = [
     ParagraphRole(role="pageHeader"),
@@ -61,10 +62,15 @@ async def fetch_sas_url(settings: Settings):
 
 async def get_textual_data(settings: Settings) -> str:
     sas_token = await fetch_sas_url(settings)
+    # the analyze result is cached until the blob changes
+    etag = await blob_storage.get_blob_etag(
+        settings=settings, container_name=CONTAINER_NAME, blob_name=BLOB_NAME
+    )
     return await extract(
         settings=settings,
         sas_url=sas_token,
         discard_roles=DISCARD_ROLES,
+        cache_key=blob_key(CONTAINER_NAME, BLOB_NAME, etag),
     )
 
 
@@ -79,11 +85,26 @@ async def save_textual_data(settings: Settings, data: str):
 
 
 async def summarize(settings: Settings, data: str) -> Result | None:
+    # condense documents that are too long for one prompt by summarizing their
+    # sections, and the summaries of those, concurrently
+    document = data
+    if settings.max_token_count is not None:
+        try:
+            document = await map_reduce(
+                settings=settings, document=data, max_tokens=settings.max_token_count
+            )
+        except RuntimeError as e:
+            logging.error(e)
+            document = None
+        if document is None:
+            logging.error("Failed to summarize the sections of the document")
+            return None
+
     response = await azure_openai.get_completion(
         settings=settings,
         messages=[
             ChatCompletionSystemMessageParam(
-                role="system", content=PROMPT.replace("{{document}}", data)
+                role="system", content=PROMPT.replace("{{document}}", document)
             )
         ],
         temperature=0,
@@ -111,7 +132,13 @@ async def summarize(settings: Settings, data: str) -> Result | None:
 
 async def main():
     settings = Settings.model_validate({})
+    try:
+        await run(settings)
+    finally:
+        await blob_storage.close_storages()
 
+
+async def run(settings: Settings):
     # get textual data from PDF with form recognizer. if it is already extracted, skip
     # this step and get it from blob storage
     if not await blob_storage.is_blob_exists(
@@ -122,18 +149,12 @@ async def main():
         await save_textual_data(settings=settings, data=data)
     else:
         data = await blob_storage.download_blob_as_str(
-            settings=settings, container_name=CONTAINER_NAME, blob_name=RESULT_BLOB_NAME
+            settings=settings,
+            container_name=CONTAINER_NAME,
+            blob_name=RESULT_BLOB_NAME,
+            max_concurrency=4,
         )
 
-    if (
-        settings.max_token_count is not None
-        and num_tokens_from_string(string=data) > settings.max_token_count
-    ):
-        logging.error(
-            "Document is too long. Max token count: %s", settings.max_token_count
-        )
-        return
-
     # get ChatGPT to summarize the document
     response = await summarize(settings=settings, data=data)
     if response is None:
@@ -141,6 +162,10 @@ async def main():
     else:
         print(json.dumps(response.model_dump(), indent=4))
 
+    cache = azure_openai.get_session(settings).completion_cache
+    if cache is not None:
+        logging.info("Completion cache: %s", cache.stats)
+
 
 if __name__ == "__main__":
     import asyncio
@@ -1,25 +1,296 @@
+import asyncio
+import gzip
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Any, AsyncIterable
+
 import azure.ai.formrecognizer as fr
 import azure.ai.formrecognizer.aio as fr_aio
 from azure.core.credentials import AzureKeyCredential
 
+from common.disk_cache import DiskCache
 from common.settings import Settings
 
+# A document is given as a SAS URL, its content, a local file path or an async
+# stream of its content. Only URLs are fetched by the service, everything else
+# is uploaded with the request. A str that names an existing local file is a
+# file path.
+Document = str | bytes | Path | AsyncIterable[bytes]
+
+
+def to_document(document: Document) -> Document:
+    """Return a str that names an existing local file as a Path.
+
+    :param document: The document.
+    """
+    if (
+        isinstance(document, str)
+        and not document.startswith(("http://", "https://"))
+        and os.path.isfile(document)
+    ):
+        return Path(document)
+    return document
+
+
+def document_key(data: bytes) -> str:
+    """Return a cache key for a document from its content.
+
+    :param data: Document content.
+    """
+    return hashlib.sha256(data).hexdigest()
+
+
+def file_key(path: Path) -> str:
+    """Return a cache key for a local document from its content.
+
+    :param path: Path of the document.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def blob_key(container_name: str, blob_name: str, etag: str) -> str:
+    """Return a cache key for a version of a blob.
+
+    :param container_name: Name of the container.
+    :param blob_name: Name of the blob.
+    :param etag: ETag of the blob.
+    """
+    return f"{container_name}/{blob_name}@{etag}"
+
+
+def get_cache(settings: Settings) -> DiskCache | None:
+    """Get the analyze result cache, None if it is not configured.
+
+    :param settings: Settings object.
+    """
+    if not settings.azure_form_recognizer_cache_dir:
+        return None
+
+    return DiskCache(
+        directory=settings.azure_form_recognizer_cache_dir,
+        max_bytes=settings.azure_form_recognizer_cache_max_bytes,
+    )
+
+
+def get_client(settings: Settings) -> fr_aio.DocumentAnalysisClient:
+    """Get Form Recognizer client.
+
+    :param settings: Settings object.
+    """
+    return fr_aio.DocumentAnalysisClient(
+        endpoint=settings.azure_form_recognizer_endpoint,
+        credential=AzureKeyCredential(settings.azure_form_recognizer_key),
+    )
+
+
+def serialize(fr_result: fr.AnalyzeResult) -> bytes:
+    return gzip.compress(json.dumps(fr_result.to_dict()).encode("utf-8"))
+
+
+def deserialize(data: bytes) -> fr.AnalyzeResult:
+    return fr.AnalyzeResult.from_dict(json.loads(gzip.decompress(data)))
+
+
+async def begin_analyze(
+    client: fr_aio.DocumentAnalysisClient,
+    document: Document,
+    model: str,
+    pages: str | None = None,
+) -> fr.AnalyzeResult:
+    document = to_document(document)
+    if isinstance(document, str):
+        poller = await client.begin_analyze_document_from_url(
+            model_id=model, document_url=document, pages=pages
+        )
+    elif isinstance(document, Path):
+        # the open file is streamed in blocks, it is not read into memory
+        with open(document, "rb") as f:
+            poller = await client.begin_analyze_document(
+                model_id=model, document=f, pages=pages
+            )
+    else:
+        poller = await client.begin_analyze_document(
+            model_id=model, document=document, pages=pages  # type: ignore
+        )
+    return await poller.result()
+
+
+def shift(obj: Any, offset: int, page_offset: int):
+    """Shift span offsets and page numbers of a shard result in place.
+
+    :param obj: Form Recognizer model, or list or dict of models.
+    :param offset: Offset added to every span.
+    :param page_offset: Offset added to every page number.
+    """
+    if isinstance(obj, (list, dict)):
+        for item in obj.values() if isinstance(obj, dict) else obj:
+            shift(item, offset, page_offset)
+        return
+
+    if isinstance(obj, fr.DocumentSpan):
+        obj.offset += offset
+        return
+
+    if isinstance(obj, (fr.BoundingRegion, fr.DocumentPage)):
+        obj.page_number += page_offset
+
+    if hasattr(obj, "__dict__"):
+        for k, v in obj.__dict__.items():
+            if not k.startswith("_"):
+                shift(v, offset, page_offset)
+
+
+def merge_results(shards: list[tuple[int, fr.AnalyzeResult]]) -> fr.AnalyzeResult:
+    """Merge the results of page range shards into one result.
+
+    Shards are merged in page order, so paragraphs stay in reading order. Spans
+    are moved to the merged content, and page numbers are made absolute if the
+    service numbered a shard from 1.
+
+    :param shards: (first page of the range, result) of each shard.
+    :return: Merged result.
+    """
+    merged = fr.AnalyzeResult(
+        content="",
+        languages=[],
+        pages=[],
+        paragraphs=[],
+        tables=[],
+        key_value_pairs=[],
+        styles=[],
+        documents=[],
+    )
+
+    for start, shard in sorted(shards, key=lambda x: x[0]):
+        if not shard.pages:
+            continue
+
+        merged.api_version = shard.api_version
+        merged.model_id = shard.model_id
+
+        if merged.content:
+            merged.content += "\n"
+        first_page = min(page.page_number for page in shard.pages)
+        shift(
+            shard,
+            offset=len(merged.content),
+            page_offset=max(start - first_page, 0),
+        )
+        merged.content += shard.content
+
+        for name in [
+            "languages",
+            "pages",
+            "paragraphs",
+            "tables",
+            "key_value_pairs",
+            "styles",
+            "documents",
+        ]:
+            getattr(merged, name).extend(getattr(shard, name) or [])
+
+    return merged
+
+
+async def analyze_document(
+    client: fr_aio.DocumentAnalysisClient,
+    sas_url: Document,
+    model: str,
+    page_count: int | None = None,
+    pages_per_shard: int | None = None,
+    max_concurrency: int = 4,
+) -> fr.AnalyzeResult:
+    if not page_count or not pages_per_shard or page_count <= pages_per_shard:
+        return await begin_analyze(client, sas_url, model)
+
+    if isinstance(sas_url, AsyncIterable):
+        # every shard uploads the document, a stream can only be read once
+        sas_url = b"".join([chunk async for chunk in sas_url])
+
+    # each shard of a bytes or file document uploads all of it
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def analyze_shard(start: int) -> fr.AnalyzeResult:
+        async with semaphore:
+            return await begin_analyze(
+                client,
+                sas_url,
+                model,
+                pages=f"{start}-{min(start + pages_per_shard - 1, page_count)}",
+            )
+
+    starts = range(1, page_count + 1, pages_per_shard)
+    shards = await asyncio.gather(*[analyze_shard(start) for start in starts])
+    return merge_results(list(zip(starts, shards)))
+
 
 async def analyze(
-    settings: Settings, sas_url: str, model="prebuilt-layout"
+    settings: Settings,
+    sas_url: Document,
+    model="prebuilt-layout",
+    cache_key: str | None = None,
+    client: fr_aio.DocumentAnalysisClient | None = None,
+    page_count: int | None = None,
+    pages_per_shard: int | None = None,
+    max_concurrency: int = 4,
 ) -> fr.AnalyzeResult:
     """Analyze a document.
 
+    When `page_count` and `pages_per_shard` are given, the document is analyzed
+    as concurrent page range jobs that are merged back into one result. At most
+    `max_concurrency` jobs run at a time.
+
+    When `azure_form_recognizer_cache_dir` is set, the result is read from and
+    written to the local cache, keyed by `cache_key` and model. The key of bytes
+    and file documents defaults to the hash of their content; URLs and streams
+    are only cached with an explicit `cache_key`.
+
     :param settings: Settings object.
-    :param sas_url: SAS URL to the document.
+    :param sas_url: SAS URL to the document, or the document itself as bytes, a
+        file path (Path, or str of an existing file) or an async byte stream.
     :model: form recognizer model.
+    :param cache_key: Content hash (see `document_key`) or blob version (see
+        `blob_key`) of the document, derived from the content of bytes and file
+        documents if not given.
+    :param client: Client to reuse across calls. A new client is opened and
+        closed for this call if not given.
+    :param page_count: Number of pages in the document.
+    :param pages_per_shard: Number of pages in each page range job.
+    :param max_concurrency: Maximum number of page range jobs at the same time.
     """
-    credential = AzureKeyCredential(settings.azure_form_recognizer_key)
+    sas_url = to_document(sas_url)
+    cache = get_cache(settings)
+    if cache and cache_key is None:
+        if isinstance(sas_url, bytes):
+            cache_key = document_key(sas_url)
+        elif isinstance(sas_url, Path):
+            cache_key = await asyncio.to_thread(file_key, sas_url)
+    if not cache_key:
+        cache = None
+    key = f"{model}/{cache_key}"
 
-    async with fr_aio.DocumentAnalysisClient(
-        endpoint=settings.azure_form_recognizer_endpoint, credential=credential
-    ) as client:
-        poller = await client.begin_analyze_document_from_url(
-            model_id=model, document_url=sas_url
+    if cache:
+        data = await asyncio.to_thread(cache.get, key)
+        if data is not None:
+            return deserialize(data)
+
+    if client is None:
+        async with get_client(settings) as client:
+            fr_result = await analyze_document(
+                client, sas_url, model, page_count, pages_per_shard, max_concurrency
+            )
+    else:
+        fr_result = await analyze_document(
+            client, sas_url, model, page_count, pages_per_shard, max_concurrency
         )
-        return await poller.result()
+
+    if cache:
+        await asyncio.to_thread(cache.set, key, serialize(fr_result))
+
+    return fr_result
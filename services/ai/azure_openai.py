@@ -1,96 +1,1032 @@
 import asyncio
+import base64
+import hashlib
+import importlib.util
+import json
 import logging
-from typing import Any, Awaitable, Callable, TypeVar
+import os
+import statistics
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Awaitable, Callable, TypeVar
 
+import httpx
+import numpy as np
 from openai import (
+    APIConnectionError,
     APIError,
+    APIStatusError,
     APITimeoutError,
     AsyncAzureOpenAI,
     AzureOpenAI,
     RateLimitError,
 )
-from openai.types import CreateEmbeddingResponse, ImagesResponse
-from openai.types.chat import ChatCompletion, ChatCompletionMessageParam
+from openai.types import (
+    CompletionUsage,
+    CreateEmbeddingResponse,
+    Embedding,
+    ImagesResponse,
+)
+from openai.types.chat import (
+    ChatCompletion,
+    ChatCompletionChunk,
+    ChatCompletionMessage,
+    ChatCompletionMessageParam,
+)
+from openai.types.chat.chat_completion import Choice
+from openai.types.create_embedding_response import Usage
 
+from common.embedding_cache import EmbeddingCache, get_embedding_cache
 from common.settings import AzureOpenAISettings
+from common.single_flight import SingleFlight
+from common.sqlite_cache import SQLiteCache, get_sqlite_cache
+from services.ai.rate_limiter import RateLimiter, get_rate_limiter
+from services.ai.token_count import num_tokens_from_messages, num_tokens_from_string
 
 T = TypeVar("T")
 
 
+class EmbeddingError(RuntimeError):
+    """Embeddings could not be retrieved."""
+
+
+def retry_after(err: RateLimitError) -> float | None:
+    """Seconds to wait that the service asked for in a 429 response."""
+    headers = err.response.headers
+    for name, scale in (("retry-after-ms", 1000), ("retry-after", 1)):
+        try:
+            return float(headers[name]) / scale
+        except (KeyError, ValueError):
+            continue
+    return None
+
+
+def retryable(err: APIError) -> bool:
+    """Whether a call may succeed if retried: throttled, timed out, connection
+    or server errors. Other errors, like a prompt over the context length or
+    one caught by the content filter, fail again."""
+    if isinstance(err, APIConnectionError):
+        return True
+    return isinstance(err, APIStatusError) and (
+        err.status_code == 429 or err.status_code >= 500
+    )
+
+
+def backoff(err: APIError, retry_time: int, max_retry_time: int) -> float | None:
+    """Log a failed call and return the seconds to wait before retrying it.
+
+    :param err: The error of the call.
+    :param retry_time: The doubled backoff of this attempt.
+    :param max_retry_time: Give up once the backoff exceeds this many seconds.
+    :return: The wait, or None to give up with an empty response.
+    :raises RateLimitError: When throttled calls exceed max_retry_time.
+    :raises APIError: When the error is not `retryable`.
+    """
+    if not retryable(err):
+        logging.error(f"OpenAI APIError {err}. Not retrying.")
+        raise err
+
+    if isinstance(err, RateLimitError):
+        wait = retry_after(err) or retry_time
+        logging.warning(f"Rate limit exceeded. Retrying in {wait} seconds...")
+
+        if retry_time > max_retry_time:
+            raise err
+        return wait
+
+    if isinstance(err, APITimeoutError):
+        logging.warning(f"Timeout error. Retrying in {retry_time} seconds...")
+
+        if retry_time > max_retry_time:
+            logging.warning(
+                f"Timeout exceeded max_retry_time of {max_retry_time}. Returning an"
+                " empty response"
+            )
+            return None
+        return retry_time
+
+    logging.warning(f"OpenAI APIError {err}. Retrying in {retry_time} seconds...")
+
+    if retry_time > max_retry_time:
+        return None
+    return retry_time
+
+
+def usage_tokens(response: Any, charged: int) -> int:
+    """Tokens used by a response, the charge when it reports no usage."""
+    usage = getattr(response, "usage", None)
+    return usage.total_tokens if usage else charged
+
+
 async def rate_limit(
-    callable: Callable[..., Awaitable[T]], params: dict[str, Any], max_retry_time: int
+    callable: Callable[..., Awaitable[T]],
+    params: dict[str, Any],
+    max_retry_time: int,
+    limiter: RateLimiter | None = None,
+    tokens: int = 0,
 ) -> T | None:
+    """Call the API, waiting for quota and retrying throttled or failed calls.
+
+    :param callable: The API method to call.
+    :param params: The keyword arguments of the call.
+    :param max_retry_time: Give up once the backoff exceeds this many seconds.
+    :param limiter: The limiter of the deployment, charged `tokens` up front and
+        settled with the usage of the response. Failed calls are refunded.
+    :param tokens: Estimated tokens of the request, prompt plus max_tokens.
+    :return: The response, None once retries of `retryable` errors run out.
+    :raises APIError: Errors that are not `retryable`, right away.
+    """
     retry_time = 1
-    while retry_time > 0:
+    while True:
+        charged = await limiter.acquire(tokens) if limiter else 0
+        used = 0
         try:
             response = await callable(**params)
+            used = usage_tokens(response, charged)
             return response
-        except RateLimitError as rle:
+        except APIError as err:
             retry_time = retry_time * 2
-            logging.warning(f"Rate limit exceeded. Retrying in {retry_time} seconds...")
-            logging.warning(str(response["usage"]))  # type: ignore
+            wait = backoff(err, retry_time, max_retry_time)
+            if wait is None:
+                return None
+        finally:
+            if limiter:
+                limiter.settle(charged, used)
+        await asyncio.sleep(wait)
 
-            if retry_time > max_retry_time:
-                raise rle
-            await asyncio.sleep(retry_time)
-        except APITimeoutError:
-            retry_time = retry_time * 2
-            logging.warning(f"Timeout error. Retrying in {retry_time} seconds...")
 
-            if retry_time > max_retry_time:
-                logging.warning(
-                    f"Timeout exceeded max_retry_time of {max_retry_time}. Returning an"
-                    " empty response"
-                )
-                return None
-            await asyncio.sleep(retry_time)
+def rate_limit_blocking(
+    callable: Callable[..., T],
+    params: dict[str, Any],
+    max_retry_time: int,
+    limiter: RateLimiter | None = None,
+    tokens: int = 0,
+) -> T | None:
+    """Call the sync API like `rate_limit`, blocking the thread while waiting.
+
+    :param callable: The API method to call.
+    :param params: The keyword arguments of the call.
+    :param max_retry_time: Give up once the backoff exceeds this many seconds.
+    :param limiter: The limiter of the deployment, shared with async callers.
+    :param tokens: Estimated tokens of the request, prompt plus max_tokens.
+    """
+    retry_time = 1
+    while True:
+        charged = limiter.acquire_blocking(tokens) if limiter else 0
+        used = 0
+        try:
+            response = callable(**params)
+            used = usage_tokens(response, charged)
+            return response
         except APIError as err:
             retry_time = retry_time * 2
+            wait = backoff(err, retry_time, max_retry_time)
+            if wait is None:
+                return None
+        finally:
+            if limiter:
+                limiter.settle(charged, used)
+        time.sleep(wait)
 
-            logging.warning(
-                f"OpenAI APIError {err}. Retrying in {retry_time} seconds..."
+
+def completion_key(endpoint: str | None, params: dict[str, Any]) -> str:
+    """Return a stable hash of a completion request.
+
+    :param endpoint: The Azure OpenAI endpoint, None for a key that holds on
+        every endpoint.
+    :param params: The parameters of the request, deployment and messages included.
+    """
+    data = json.dumps([endpoint, params], sort_keys=True, default=str)
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def embedding_response(model: str, vector: np.ndarray) -> CreateEmbeddingResponse:
+    """Wrap a cached vector in the response type of the embeddings API."""
+    return CreateEmbeddingResponse(
+        data=[Embedding(embedding=vector.tolist(), index=0, object="embedding")],
+        model=model,
+        object="list",
+        usage=Usage(prompt_tokens=0, total_tokens=0),
+    )
+
+
+def batch_by_tokens(
+    token_counts: list[int], max_items: int, max_tokens: int
+) -> list[tuple[int, int]]:
+    """Pack consecutive inputs into batches under item and token limits.
+
+    An input over `max_tokens` on its own is a batch of its own.
+
+    :param token_counts: Number of tokens of each input.
+    :param max_items: Maximum number of inputs in a batch.
+    :param max_tokens: Maximum number of tokens in a batch.
+    :return: (start, end) index range of each batch, in input order.
+    """
+    batches = []
+    start = 0
+    tokens = 0
+
+    for i, count in enumerate(token_counts):
+        if i > start and (i - start >= max_items or tokens + count > max_tokens):
+            batches.append((start, i))
+            start = i
+            tokens = 0
+        tokens += count
+
+    if start < len(token_counts):
+        batches.append((start, len(token_counts)))
+
+    return batches
+
+
+class OpenAISession:
+    """Azure OpenAI session that owns pooled async and sync clients.
+
+    Every request made through a session shares one httpx connection pool, sized
+    by `openai_max_connections` and `openai_max_keepalive_connections`, so a fan
+    out of requests reuses a small set of keep-alive (or HTTP/2, with
+    `openai_http2`, which needs the `h2` package) connections. The async client
+    is bound to the event loop it was first used in; used from another loop, it
+    is replaced and the old one is closed.
+
+    Completions and embeddings wait for the TPM/RPM quotas of their deployment
+    (`openai_tokens_per_minute`, `openai_requests_per_minute` and their
+    `openai_embedding_` counterparts), images for `openai_image_requests_per_minute`,
+    in limiters shared by the whole process and its sync callers.
+
+    With `openai_completion_cache_path` set, completions with temperature 0 are
+    cached in memory and in that SQLite file, see `completion_cache.stats`. With
+    `openai_embedding_cache_dir` set, embeddings are cached by content hash in an
+    `EmbeddingCache` per embedding model. Both caches are shared by the sessions
+    of the process that use the same files.
+
+    Concurrent calls of `get_completion` with temperature 0 and of
+    `get_embedding` with identical requests share one in flight request, see
+    `flights.stats`.
+    """
+
+    def __init__(self, settings: AzureOpenAISettings, routed_model: str | None = None):
+        """
+        :param settings: The settings to use for the API.
+        :param routed_model: The `deployment_model` of the router the session is
+            a deployment of; its completions are cached under that name, for any
+            endpoint, so that every deployment of the router hits them.
+        """
+        if settings.openai_http2 and importlib.util.find_spec("h2") is None:
+            raise RuntimeError(
+                "openai_http2 requires the h2 package, install it with"
+                " `pip install httpx[http2]` or set OPENAI_HTTP2=false"
+            )
+
+        self.settings = settings
+        self.routed_model = routed_model
+        self.limits = httpx.Limits(
+            max_connections=settings.openai_max_connections,
+            max_keepalive_connections=settings.openai_max_keepalive_connections,
+        )
+        self._client: AzureOpenAI | None = None
+        self._aclient: AsyncAzureOpenAI | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._closing: set[asyncio.Task] = set()
+        self.limiter = get_rate_limiter(
+            settings.openai_azure_endpoint,
+            settings.deployment_model,
+            tokens_per_minute=settings.openai_tokens_per_minute,
+            requests_per_minute=settings.openai_requests_per_minute,
+        )
+        self.embedding_limiter = get_rate_limiter(
+            settings.openai_azure_endpoint,
+            settings.openai_embedding_model,
+            tokens_per_minute=settings.openai_embedding_tokens_per_minute,
+            requests_per_minute=settings.openai_embedding_requests_per_minute,
+        )
+        self.image_limiter = get_rate_limiter(
+            settings.openai_azure_endpoint,
+            settings.openai_dalle_model,
+            requests_per_minute=settings.openai_image_requests_per_minute,
+        )
+        self.flights = SingleFlight()
+        self.completion_cache: SQLiteCache | None = None
+        if settings.openai_completion_cache_path is not None:
+            self.completion_cache = get_sqlite_cache(
+                settings.openai_completion_cache_path,
+                max_entries=settings.openai_completion_cache_max_entries,
+                max_bytes=settings.openai_completion_cache_max_bytes,
+                ttl_seconds=settings.openai_completion_cache_ttl_secs,
+            )
+        self.embedding_cache: EmbeddingCache | None = None
+        if settings.openai_embedding_cache_dir is not None:
+            self.embedding_cache = get_embedding_cache(
+                os.path.join(
+                    settings.openai_embedding_cache_dir,
+                    settings.openai_embedding_model,
+                )
+            )
+
+    @property
+    def client(self) -> AzureOpenAI:
+        """Synchronous client."""
+        if self._client is None:
+            self._client = AzureOpenAI(
+                api_key=self.settings.azure_openai_api_key,
+                azure_endpoint=self.settings.openai_azure_endpoint,
+                api_version=self.settings.openai_api_version,
+                http_client=httpx.Client(
+                    limits=self.limits,
+                    http2=self.settings.openai_http2,
+                    timeout=self.settings.request_timeout,
+                ),
+            )
+        return self._client
+
+    @property
+    def aclient(self) -> AsyncAzureOpenAI:
+        """Async client of the running event loop."""
+        loop = asyncio.get_running_loop()
+        if self._aclient is None or self._loop is not loop:
+            if self._aclient is not None:
+                self.discard(self._aclient, self._loop)
+            self._aclient = AsyncAzureOpenAI(
+                api_key=self.settings.azure_openai_api_key,
+                azure_endpoint=self.settings.openai_azure_endpoint,
+                api_version=self.settings.openai_api_version,
+                http_client=httpx.AsyncClient(
+                    limits=self.limits,
+                    http2=self.settings.openai_http2,
+                    timeout=self.settings.request_timeout,
+                ),
+            )
+            self._loop = loop
+        return self._aclient
+
+    def discard(
+        self, aclient: AsyncAzureOpenAI, loop: asyncio.AbstractEventLoop | None
+    ):
+        """Close the async client of another event loop without waiting.
+
+        The client is closed in its own loop if that loop still runs in another
+        thread, else in the running loop. Errors are logged, the connections of
+        a closed loop can't be shut down cleanly.
+        """
+
+        async def close():
+            try:
+                await aclient.close()
+            except Exception as e:
+                logging.debug(f"Failed to close the async client of a stale loop: {e}")
+
+        if loop is not None and loop.is_running() and not loop.is_closed():
+            asyncio.run_coroutine_threadsafe(close(), loop)
+            return
+        task = asyncio.get_running_loop().create_task(close())
+        self._closing.add(task)
+        task.add_done_callback(self._closing.discard)
+
+    async def close(self):
+        """Close the clients and their connections."""
+        if self._aclient is not None:
+            await self._aclient.close()
+            self._aclient = None
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+
+    async def __aenter__(self) -> "OpenAISession":
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    def cache_key(self, params: dict[str, Any]) -> str:
+        """Return the completion cache key of the parameters of a request.
+
+        :param params: The parameters from `completion_params`.
+        """
+        if self.routed_model is None:
+            return completion_key(self.settings.openai_azure_endpoint, params)
+        return completion_key(None, {**params, "model": self.routed_model})
+
+    def completion_params(
+        self,
+        messages: list[ChatCompletionMessageParam],
+        temperature: float,
+        max_tokens: int | None,
+    ) -> dict[str, Any]:
+        """Return the parameters of a completion request, which are its cache key."""
+        max_tokens = max_tokens or self.settings.openai_max_tokens
+        params: dict[str, Any] = {
+            "model": self.settings.deployment_model,
+            "temperature": temperature,
+            "messages": messages,
+        }
+        if max_tokens:
+            params["max_tokens"] = max_tokens
+        return params
+
+    def stream_completion(
+        self,
+        messages: list[ChatCompletionMessageParam],
+        temperature: float = 0.0,
+        max_tokens: int | None = None,
+    ) -> "CompletionStream":
+        """Stream a completion from the OpenAI API.
+
+        async for delta in session.stream_completion(messages):
+            ...
+
+        :param messages: The messages to use for the completion.
+        :param temperature: The temperature to use for the completion.
+        :param max_tokens: Maximum number of tokens to generate, defaults to
+            `openai_max_tokens`.
+        """
+        return CompletionStream(
+            self, self.completion_params(messages, temperature, max_tokens)
+        )
+
+    async def get_completion(
+        self,
+        messages: list[ChatCompletionMessageParam],
+        temperature: float = 0.0,
+        max_tokens: int | None = None,
+    ) -> ChatCompletion | None:
+        """Get a completion from the OpenAI API.
+
+        :param messages: The messages to use for the completion.
+        :param temperature: The temperature to use for the completion.
+        :param max_tokens: Maximum number of tokens to generate, defaults to
+            `openai_max_tokens`.
+        """
+        params = self.completion_params(messages, temperature, max_tokens)
+
+        # only deterministic completions are worth sharing and replaying
+        if temperature != 0:
+            return await self.request_completion(params)
+
+        key = self.cache_key(params)
+        return await self.flights.run(
+            ("completion", key), lambda: self.request_completion(params, key)
+        )
+
+    async def request_completion(
+        self, params: dict[str, Any], key: str | None = None
+    ) -> ChatCompletion | None:
+        """Request a completion, through the completion cache if it has a key.
+
+        :param params: The parameters from `completion_params`.
+        :param key: The `cache_key` of the parameters, None not to cache.
+        """
+        logging.info("begin completion")
+        cache = self.completion_cache if key is not None else None
+        if cache is not None:
+            data = await asyncio.to_thread(cache.get, key)
+            if data is not None:
+                logging.info("completed completion from cache")
+                return ChatCompletion.model_validate_json(data)
+
+        response = await rate_limit(
+            callable=self.aclient.chat.completions.create,
+            params={**params, "timeout": self.settings.request_timeout},
+            max_retry_time=self.settings.max_retry_time_secs,
+            limiter=self.limiter,
+            tokens=(
+                num_tokens_from_messages(params["messages"])
+                + params.get("max_tokens", 0)
+            ),
+        )
+        if cache is not None and response is not None:
+            data = response.model_dump_json().encode("utf-8")
+            await asyncio.to_thread(cache.set, key, data)
+        logging.info("completed completion")
+        return response
+
+    async def get_embedding(self, text: str) -> CreateEmbeddingResponse | None:
+        """Get an embedding from the OpenAI API.
+
+        :param text: The text to use for the embedding.
+        """
+        # replace newlines, which can negatively affect performance.
+        text = text.replace("\n", " ")
+
+        return await self.flights.run(
+            ("embedding", text), lambda: self.request_embedding(text)
+        )
+
+    async def request_embedding(self, text: str) -> CreateEmbeddingResponse | None:
+        """Request an embedding, through the embedding cache if there is one.
+
+        :param text: The text to embed, newlines already replaced.
+        """
+        logging.info("begin get_embedding")
+
+        cache = self.embedding_cache
+        if cache is not None:
+            vector = await asyncio.to_thread(cache.get, text)
+            if vector is not None:
+                logging.info("completed get_embedding from cache")
+                return embedding_response(self.settings.openai_embedding_model, vector)
+
+        result = await rate_limit(
+            callable=self.aclient.embeddings.create,
+            params={"input": text, "model": self.settings.openai_embedding_model},
+            max_retry_time=self.settings.max_retry_time_secs,
+            limiter=self.embedding_limiter,
+            tokens=num_tokens_from_string(text),
+        )
+        if result is None:
+            logging.warning("get_embedding returned an empty response")
+            return None
+        if cache is not None:
+            vectors = np.array([result.data[0].embedding], dtype=np.float32)
+            await asyncio.to_thread(cache.put_many, [text], vectors)
+        logging.info("completed get_embedding")
+        return result
+
+    async def get_embeddings(
+        self, texts: list[str], as_array: bool = False
+    ) -> list[list[float]] | np.ndarray:
+        """Get embeddings of many texts with batched, concurrent requests.
+
+        Texts are packed into list-input requests under
+        `openai_embedding_max_items` and `openai_embedding_max_tokens`, and up to
+        `openai_embedding_max_concurrency` requests are in flight at a time. With
+        `openai_embedding_cache_dir` set, only texts missing from the cache are
+        sent.
+
+        :param texts: The texts to embed.
+        :param as_array: Return a contiguous float32 array of shape
+            (len(texts), dimensions) instead of lists. The vectors are then
+            decoded straight from the base64 response.
+        :return: One vector per text, in input order.
+        """
+        logging.info("begin get_embeddings")
+
+        # replace newlines, which can negatively affect performance.
+        inputs = [text.replace("\n", " ") for text in texts]
+
+        cache = self.embedding_cache
+        if cache is None:
+            result = await self.request_embeddings(inputs, as_array=as_array)
+            logging.info("completed get_embeddings")
+            return result
+
+        cached = await asyncio.to_thread(cache.get_many, inputs)
+        missing = list(dict.fromkeys(t for t, v in zip(inputs, cached) if v is None))
+        if missing:
+            vectors = await self.request_embeddings(missing, as_array=True)
+            await asyncio.to_thread(cache.put_many, missing, vectors)  # type: ignore
+            rows = dict(zip(missing, vectors))
+            cached = [rows[t] if v is None else v for t, v in zip(inputs, cached)]
+        logging.info(
+            f"completed get_embeddings, {len(inputs) - len(missing)} from cache"
+        )
+
+        array = np.stack(cached) if cached else np.empty((0, 0), dtype=np.float32)
+        return array if as_array else array.tolist()
+
+    async def request_embeddings(
+        self, inputs: list[str], as_array: bool = False
+    ) -> list[list[float]] | np.ndarray:
+        """Request embeddings of texts in token-budgeted batches.
+
+        :param inputs: The texts to embed, newlines already replaced.
+        :param as_array: Return a float32 array instead of lists.
+        :return: One vector per text, in input order.
+        """
+        token_counts = [num_tokens_from_string(text) for text in inputs]
+        batches = batch_by_tokens(
+            token_counts,
+            max_items=self.settings.openai_embedding_max_items,
+            max_tokens=self.settings.openai_embedding_max_tokens,
+        )
+        semaphore = asyncio.Semaphore(self.settings.openai_embedding_max_concurrency)
+        vectors: list[list[float]] = [[] for _ in inputs]
+        array: np.ndarray | None = None
+
+        async def embed(start: int, end: int):
+            nonlocal array
+            params: dict[str, Any] = {
+                "input": inputs[start:end],
+                "model": self.settings.openai_embedding_model,
+            }
+            if as_array:
+                params["encoding_format"] = "base64"
+
+            async with semaphore:
+                response = await rate_limit(
+                    callable=self.aclient.embeddings.create,
+                    params=params,
+                    max_retry_time=self.settings.max_retry_time_secs,
+                    limiter=self.embedding_limiter,
+                    tokens=sum(token_counts[start:end]),
+                )
+            if response is None:
+                raise EmbeddingError(
+                    f"Failed to get embeddings of inputs {start}-{end}"
+                )
+
+            for item in response.data:
+                if as_array:
+                    row = np.frombuffer(
+                        base64.b64decode(item.embedding), dtype=np.float32  # type: ignore
+                    )
+                    if array is None:
+                        array = np.empty((len(inputs), len(row)), dtype=np.float32)
+                    array[start + item.index] = row
+                else:
+                    vectors[start + item.index] = item.embedding
+
+        await asyncio.gather(*[embed(start, end) for start, end in batches])
+
+        if as_array:
+            return array if array is not None else np.empty((0, 0), dtype=np.float32)
+        return vectors
+
+    async def create_image(self, text: str) -> ImagesResponse | None:
+        """Create an image from a prompt.
+
+        :param text: The prompt of the image.
+        """
+        logging.info("begin create_image")
+        result = await rate_limit(
+            callable=self.aclient.images.generate,
+            params={"model": self.settings.openai_dalle_model, "prompt": text, "n": 1},
+            max_retry_time=self.settings.max_retry_time_secs,
+            limiter=self.image_limiter,
+        )
+        logging.info("completed create_image")
+        return result
+
+
+class CompletionStream:
+    """Text deltas of a streamed completion, in arrival order.
+
+    The request goes through `rate_limit` like `get_completion`, so it is
+    retried until the response starts; errors after that are raised to the
+    reader. `output_tokens` counts the tokens received so far, and once the
+    stream is exhausted `completion` holds the assembled ChatCompletion, or None
+    if the request failed. The rate limiter is settled with the actual usage
+    and, with temperature 0, the completion is cached; a cache hit is replayed
+    as a single delta.
+    """
+
+    def __init__(self, session: OpenAISession, params: dict[str, Any]):
+        """
+        :param session: The session to request the completion with.
+        :param params: The parameters from `OpenAISession.completion_params`.
+        """
+        self.session = session
+        self.params = params
+        self.prompt_tokens = num_tokens_from_messages(params["messages"])
+        self.output_tokens = 0
+        self.completion: ChatCompletion | None = None
+
+    def __aiter__(self) -> AsyncIterator[str]:
+        return self.deltas()
+
+    async def deltas(self) -> AsyncIterator[str]:
+        session = self.session
+        logging.info("begin stream_completion")
+
+        cache = session.completion_cache if self.params["temperature"] == 0 else None
+        if cache is not None:
+            key = session.cache_key(self.params)
+            data = await asyncio.to_thread(cache.get, key)
+            if data is not None:
+                self.completion = ChatCompletion.model_validate_json(data)
+                if self.completion.usage is not None:
+                    self.output_tokens = self.completion.usage.completion_tokens
+                logging.info("completed stream_completion from cache")
+                if self.completion.choices:
+                    yield self.completion.choices[0].message.content or ""
+                return
+
+        charged = self.prompt_tokens + self.params.get("max_tokens", 0)
+        stream = await rate_limit(
+            callable=session.aclient.chat.completions.create,
+            params={
+                **self.params,
+                "stream": True,
+                "timeout": session.settings.request_timeout,
+            },
+            max_retry_time=session.settings.max_retry_time_secs,
+            limiter=session.limiter,
+            tokens=charged,
+        )
+        if stream is None:
+            return
+
+        first: ChatCompletionChunk | None = None
+        contents: dict[int, list[str]] = {}
+        finish_reasons: dict[int, str] = {}
+        try:
+            async for chunk in stream:
+                first = first or chunk
+                for choice in chunk.choices:
+                    if choice.finish_reason is not None:
+                        finish_reasons[choice.index] = choice.finish_reason
+                    delta = choice.delta.content
+                    if not delta:
+                        continue
+                    contents.setdefault(choice.index, []).append(delta)
+                    self.output_tokens += num_tokens_from_string(delta)
+                    if choice.index == 0:
+                        yield delta
+        finally:
+            await stream.close()
+            session.limiter.settle(charged, self.prompt_tokens + self.output_tokens)
+
+        if first is None:
+            return
+        self.completion = ChatCompletion(
+            id=first.id,
+            created=first.created,
+            model=first.model,
+            object="chat.completion",
+            choices=[
+                Choice(
+                    index=index,
+                    finish_reason=finish_reasons.get(index, "stop"),  # type: ignore
+                    message=ChatCompletionMessage(
+                        role="assistant", content="".join(contents.get(index, []))
+                    ),
+                )
+                for index in sorted(contents.keys() | finish_reasons.keys())
+            ],
+            usage=CompletionUsage(
+                prompt_tokens=self.prompt_tokens,
+                completion_tokens=self.output_tokens,
+                total_tokens=self.prompt_tokens + self.output_tokens,
+            ),
+        )
+        if cache is not None:
+            data = self.completion.model_dump_json().encode("utf-8")
+            await asyncio.to_thread(cache.set, key, data)
+        logging.info("completed stream_completion")
+
+
+@dataclass(slots=True)
+class RoutedEndpoint:
+    """A deployment of a router and what the router observed of it."""
+
+    session: OpenAISession
+    latencies: deque[float] = field(default_factory=lambda: deque(maxlen=50))
+    in_flight: int = 0
+    failures: int = 0
+    ejected_until: float = 0.0
+
+    @property
+    def p50(self) -> float:
+        """Median latency of recent successful calls, 0 before the first one."""
+        return statistics.median(self.latencies) if self.latencies else 0.0
+
+    def quota(self, limiter: RateLimiter) -> float:
+        """Fraction of the TPM/RPM quota of a limiter left, the lower of the two.
+
+        :param limiter: The limiter of the session the call goes to.
+        """
+        buckets = [b for b in (limiter.tokens, limiter.requests) if b is not None]
+        return min((max(b.level, 0) / b.capacity for b in buckets), default=1.0)
+
+    def score(self, limiter: RateLimiter) -> float:
+        """Lower is better: expected latency, scaled by load and spent quota.
+
+        :param limiter: The limiter of the session the call goes to.
+        """
+        return (
+            (self.p50 + 0.001) * (1 + self.in_flight) / max(self.quota(limiter), 0.01)
+        )
+
+
+class OpenAIRouter:
+    """Spread requests over several deployments of `openai_deployments`.
+
+    Each request goes to the available deployment with the best score, from
+    its observed median latency, its requests in flight and its remaining quota.
+    Deployments fail fast instead of backing off: a throttled deployment is
+    skipped until its retry-after has passed and the request moves on to the
+    next one, and a deployment that fails `openai_router_max_failures` times in a
+    row is ejected for `openai_router_cooldown_secs`. Only when every deployment
+    failed does the router back off, up to `max_retry_time_secs`.
+
+    The deployments share the completion and embedding caches: a completion
+    cached by one deployment is a hit on the others.
+    """
+
+    def __init__(self, settings: AzureOpenAISettings):
+        """
+        :param settings: The settings to use for the API, with deployments.
+        """
+        self.settings = settings
+        self.endpoints = [
+            RoutedEndpoint(
+                OpenAISession(
+                    settings.model_copy(
+                        update={
+                            **deployment.model_dump(exclude_none=True),
+                            "max_retry_time_secs": 0,
+                        }
+                    ),
+                    routed_model=settings.deployment_model,
+                )
             )
+            for deployment in settings.openai_deployments
+        ]
+
+    def ranked(
+        self, limiter: Callable[[OpenAISession], RateLimiter] = lambda s: s.limiter
+    ) -> list[RoutedEndpoint]:
+        """Available endpoints, best first; the next to return if all are out.
 
-            if retry_time > max_retry_time:
+        :param limiter: The limiter of a session the call waits for, completions
+            by default.
+        """
+        now = time.monotonic()
+        available = [e for e in self.endpoints if e.ejected_until <= now]
+        if not available:
+            return [min(self.endpoints, key=lambda e: e.ejected_until)]
+        return sorted(available, key=lambda e: e.score(limiter(e.session)))
+
+    async def route(
+        self,
+        call: Callable[[OpenAISession], Awaitable[T | None]],
+        limiter: Callable[[OpenAISession], RateLimiter] = lambda s: s.limiter,
+    ) -> T | None:
+        """Make a call on the best endpoint, failing over to the others.
+
+        Errors that are not `retryable` fail the call right away and leave the
+        endpoint as it was: the same request would fail on every deployment.
+
+        :param call: Makes the request on a session, None if it failed.
+        :param limiter: The limiter of a session the call waits for, to rank the
+            endpoints by the quota it has left.
+        """
+        retry_time = 1
+        while True:
+            for endpoint in self.ranked(limiter):
+                endpoint_name = endpoint.session.settings.openai_azure_endpoint
+                started = time.monotonic()
+                endpoint.in_flight += 1
+                try:
+                    result = await call(endpoint.session)
+                except RateLimitError as err:
+                    wait = retry_after(err) or 1
+                    endpoint.ejected_until = time.monotonic() + wait
+                    logging.warning(f"{endpoint_name} throttled for {wait} seconds")
+                    continue
+                except EmbeddingError:
+                    result = None
+                finally:
+                    endpoint.in_flight -= 1
+
+                if result is None:
+                    endpoint.failures += 1
+                    if endpoint.failures >= self.settings.openai_router_max_failures:
+                        cooldown = self.settings.openai_router_cooldown_secs
+                        endpoint.ejected_until = time.monotonic() + cooldown
+                        logging.warning(
+                            f"{endpoint_name} ejected for {cooldown} seconds"
+                        )
+                    continue
+
+                endpoint.failures = 0
+                endpoint.latencies.append(time.monotonic() - started)
+                return result
+
+            retry_time = retry_time * 2
+            if retry_time > self.settings.max_retry_time_secs:
                 return None
+            logging.warning(
+                f"All deployments failed. Retrying in {retry_time} seconds..."
+            )
             await asyncio.sleep(retry_time)
 
+    async def get_completion(
+        self,
+        messages: list[ChatCompletionMessageParam],
+        temperature: float = 0.0,
+        max_tokens: int | None = None,
+    ) -> ChatCompletion | None:
+        """Get a completion from the best deployment.
+
+        :param messages: The messages to use for the completion.
+        :param temperature: The temperature to use for the completion.
+        :param max_tokens: Maximum number of tokens to generate.
+        """
+        return await self.route(
+            lambda session: session.get_completion(messages, temperature, max_tokens)
+        )
+
+    async def get_embeddings(
+        self, texts: list[str], as_array: bool = False
+    ) -> list[list[float]] | np.ndarray:
+        """Get embeddings of many texts from the best deployment.
+
+        :param texts: The texts to embed.
+        :param as_array: Return a contiguous float32 array instead of lists.
+        :return: One vector per text, in input order.
+        """
+        result = await self.route(
+            lambda session: session.get_embeddings(texts, as_array=as_array),
+            limiter=lambda session: session.embedding_limiter,
+        )
+        if result is None:
+            raise EmbeddingError(f"Failed to get embeddings of {len(texts)} inputs")
+        return result
+
+    async def close(self):
+        """Close the sessions of the deployments."""
+        for endpoint in self.endpoints:
+            await endpoint.session.close()
+
+
+_sessions: dict[str, OpenAISession] = {}
+_routers: dict[str, OpenAIRouter] = {}
+
+
+def get_session(settings: AzureOpenAISettings) -> OpenAISession:
+    """Get the shared session of the settings, one per process.
+
+    Sessions are keyed by the whole settings, so callers that differ in any
+    field, deployment or quota included, get sessions of their own.
+
+    :param settings: The settings to use for the API.
+    """
+    key = settings.model_dump_json()
+    session = _sessions.get(key)
+    if session is None:
+        session = _sessions[key] = OpenAISession(settings)
+    return session
+
+
+def get_router(settings: AzureOpenAISettings) -> OpenAIRouter | None:
+    """Get the shared router of the settings, None without deployments.
+
+    Routers are keyed by the whole settings, like sessions.
+
+    :param settings: The settings to use for the API.
+    """
+    if not settings.openai_deployments:
+        return None
+
+    key = settings.model_dump_json()
+    router = _routers.get(key)
+    if router is None:
+        router = _routers[key] = OpenAIRouter(settings)
+    return router
+
 
 async def get_completion(
     settings: AzureOpenAISettings,
     messages: list[ChatCompletionMessageParam],
     temperature: float = 0.0,
+    max_tokens: int | None = None,
 ) -> ChatCompletion | None:
     """Get a completion from the OpenAI API.
 
+    With `openai_deployments` set, the completion comes from the router.
+
     :param settings: The settings to use for the API.
     :param messages: The messages to use for the completion.
     :param temperature: The temperature to use for the completion.
+    :param max_tokens: Maximum number of tokens to generate.
+    :return: The completion, None if it failed.
     """
-    logging.info("begin completion")
+    session = get_router(settings) or get_session(settings)
+    try:
+        return await session.get_completion(messages, temperature, max_tokens)
+    except APIError as err:
+        # not retryable, like a prompt over the context length
+        logging.error(f"Failed to get a completion: {err}")
+        return None
 
-    async with AsyncAzureOpenAI(
-        api_key=settings.azure_openai_api_key,
-        azure_endpoint=settings.openai_azure_endpoint,
-        api_version=settings.openai_api_version,
-    ) as aclient:
-        response = await rate_limit(
-            callable=aclient.chat.completions.create,
-            params={
-                "model": settings.deployment_model,
-                "temperature": temperature,
-                "timeout": settings.request_timeout,
-                "messages": messages,
-            },
-            max_retry_time=settings.max_retry_time_secs,
-        )
-    logging.info("completed completion")
-    return response
 
+def stream_completion(
+    settings: AzureOpenAISettings,
+    messages: list[ChatCompletionMessageParam],
+    temperature: float = 0.0,
+    max_tokens: int | None = None,
+) -> CompletionStream:
+    """Stream a completion from the OpenAI API.
+
+    :param settings: The settings to use for the API.
+    :param messages: The messages to use for the completion.
+    :param temperature: The temperature to use for the completion.
+    :param max_tokens: Maximum number of tokens to generate.
+    """
+    return get_session(settings).stream_completion(
+        messages, temperature, max_tokens=max_tokens
+    )
 
-def get_embedding(settings: AzureOpenAISettings, text: str) -> CreateEmbeddingResponse:
+
+def get_embedding(
+    settings: AzureOpenAISettings, text: str
+) -> CreateEmbeddingResponse | None:
     """Get an embedding from the OpenAI API.
 
+    Blocks until the response arrives, waiting for the quota shared with async
+    callers; use `OpenAISession.get_embedding` from async code.
+
     :param settings: The settings to use for the API.
     :param text: The text to use for the embedding.
     """
@@ -99,27 +1035,64 @@ def get_embedding(settings: AzureOpenAISettings, text: str) -> CreateEmbeddingRe
     # replace newlines, which can negatively affect performance.
     text = text.replace("\n", " ")
 
-    client = AzureOpenAI(
-        api_key=settings.azure_openai_api_key,
-        azure_endpoint=settings.openai_azure_endpoint,
-        api_version=settings.openai_api_version,
-    )
+    session = get_session(settings)
+    cache = session.embedding_cache
+    if cache is not None:
+        vector = cache.get(text)
+        if vector is not None:
+            logging.info("completed get_embedding from cache")
+            return embedding_response(settings.openai_embedding_model, vector)
 
-    result = client.embeddings.create(input=text, model=settings.openai_embedding_model)
+    result = rate_limit_blocking(
+        callable=session.client.embeddings.create,
+        params={"input": text, "model": settings.openai_embedding_model},
+        max_retry_time=settings.max_retry_time_secs,
+        limiter=session.embedding_limiter,
+        tokens=num_tokens_from_string(text),
+    )
+    if result is None:
+        logging.warning("get_embedding returned an empty response")
+        return None
+    if cache is not None:
+        cache.put_many([text], np.array([result.data[0].embedding], dtype=np.float32))
     logging.info("completed get_embedding")
     return result
 
 
-def create_image(settings: AzureOpenAISettings, text: str) -> ImagesResponse:
+async def get_embeddings(
+    settings: AzureOpenAISettings, texts: list[str], as_array: bool = False
+) -> list[list[float]] | np.ndarray:
+    """Get embeddings of many texts with batched, concurrent requests.
+
+    With `openai_deployments` set, the embeddings come from the router.
+
+    :param settings: The settings to use for the API.
+    :param texts: The texts to embed.
+    :param as_array: Return a contiguous float32 array instead of lists.
+    :return: One vector per text, in input order.
+    """
+    session = get_router(settings) or get_session(settings)
+    return await session.get_embeddings(texts, as_array=as_array)
+
+
+def create_image(settings: AzureOpenAISettings, text: str) -> ImagesResponse | None:
+    """Create an image from a prompt, retrying throttled or failed calls.
+
+    Blocks until the response arrives; use `OpenAISession.create_image` from
+    async code.
+
+    :param settings: The settings to use for the API.
+    :param text: The prompt of the image.
+    """
     logging.info("begin create_image")
 
-    client = AzureOpenAI(
-        api_key=settings.azure_openai_api_key,
-        azure_endpoint=settings.openai_azure_endpoint,
-        api_version=settings.openai_api_version,
+    session = get_session(settings)
+    result = rate_limit_blocking(
+        callable=session.client.images.generate,
+        params={"model": settings.openai_dalle_model, "prompt": text, "n": 1},
+        max_retry_time=settings.max_retry_time_secs,
+        limiter=session.image_limiter,
     )
-
-    result = client.images.generate(model=settings.openai_dalle_model, prompt=text, n=1)
     logging.info("completed create_image")
     return result
 
@@ -144,33 +1117,20 @@ def create_image(settings: AzureOpenAISettings, text: str) -> ImagesResponse:
 #     return response.data[0].embedding
 
 
-# def generate_image(settings: AzureOpenAISettings, text: str):
-#     import os
-
-#     import requests
-
-#     response = create_image(settings=settings, text=text)
-#     image_dir = os.path.join(os.curdir, ".images")
-
-#     # If the directory doesn't exist, create it
-#     if not os.path.isdir(image_dir):
-#         os.mkdir(image_dir)
-
-#     # Initialize the image path (note the filetype should be png)
-#     image_path = os.path.join(image_dir, "generated_image.png")
+# async def generate_image(settings: AzureOpenAISettings, text: str):
+#     from services.ai.image_generation import generate_images
 
-#     # Retrieve the generated image
-#     image_url = response.data[0].url
-#     generated_image = requests.get(image_url).content  # type: ignore
-#     with open(image_path, "wb") as image_file:
-#         image_file.write(generated_image)
+#     async for image in generate_images(
+#         settings=settings, prompts=[text], directory=".images"  # type: ignore
+#     ):
+#         print(image.location or image.error)
 
 
 # async def main():
 #     settings = AzureOpenAISettings.model_validate({})
 #     print(await love_poem(settings=settings))
 #     print(generate_embedding(settings=settings, text="hello world"))
-#     generate_image(
+#     await generate_image(
 #         settings=settings,
 #         text="Baby Yoda is the cutest thing in the galaxy.",
 #     )
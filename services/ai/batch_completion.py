@@ -0,0 +1,210 @@
+import argparse
+import asyncio
+import json
+import logging
+import time
+from typing import Any, Iterator
+
+from pydantic import BaseModel
+
+import services.ai.azure_openai as azure_openai
+from common.settings import AzureOpenAISettings
+
+# Run the prompts of a JSONL file through get_completion as an offline job.
+# Every input line is {"id": ..., "messages": [...]} with optional "temperature"
+# and "max_tokens"; a line without an id is identified by its line number.
+# Results are appended to the output JSONL as they complete, each line is
+# {"id": ..., "completion": {...} | null, "error": ... | null}. The ids of
+# successful items are appended to a checkpoint file after their result, so a
+# rerun skips them and retries the rest. A line that is not a JSON object is a
+# failed item. An item whose result was written just
+# before a crash can appear twice in the output; the last line of an id wins.
+
+
+class BatchStats(BaseModel):
+    """Progress of a batch."""
+
+    total: int = 0
+    skipped: int = 0
+    completed: int = 0
+    failed: int = 0
+    tokens: int = 0
+    elapsed: float = 0.0
+
+    @property
+    def items_per_second(self) -> float:
+        done = self.completed + self.failed
+        return done / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def tokens_per_second(self) -> float:
+        return self.tokens / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self) -> str:
+        done = self.skipped + self.completed + self.failed
+        return (
+            f"{done}/{self.total} done ({self.skipped} skipped, {self.failed}"
+            f" failed), {self.items_per_second:.1f} items/s,"
+            f" {self.tokens_per_second:.0f} tokens/s"
+        )
+
+
+def read_lines(path: str) -> list[str]:
+    """Read the complete lines of a file, truncating a line cut short by a crash.
+
+    :param path: Path of the file, missing is empty.
+    """
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return []
+
+    end = data.rfind(b"\n") + 1
+    if end < len(data):
+        with open(path, "r+b") as f:
+            f.truncate(end)
+    return data[:end].decode("utf-8").splitlines()
+
+
+def count_items(path: str) -> int:
+    """Count the non-empty lines of an input JSONL file, without parsing them.
+
+    :param path: Path of the input file.
+    """
+    with open(path, "rb") as f:
+        return sum(1 for line in f if line.strip())
+
+
+def read_items(path: str) -> Iterator[tuple[str, dict[str, Any] | None]]:
+    """Yield (id, item) for the non-empty lines of an input JSONL file.
+
+    A line that is not a JSON object is logged and yielded with a None item,
+    identified by its line number.
+
+    :param path: Path of the input file.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        for number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            try:
+                item = json.loads(line)
+            except json.JSONDecodeError as e:
+                logging.error(f"Line {number} is not valid JSON: {e}")
+                yield str(number), None
+                continue
+            if not isinstance(item, dict):
+                logging.error(f"Line {number} is not a JSON object")
+                yield str(number), None
+                continue
+            yield str(item.get("id", number)), item
+
+
+async def run_batch(
+    settings: AzureOpenAISettings,
+    input_path: str,
+    output_path: str,
+    checkpoint_path: str | None = None,
+    concurrency: int = 8,
+    progress_interval: float = 10.0,
+) -> BatchStats:
+    """Run the prompts of a JSONL file, resuming from the checkpoint.
+
+    :param settings: The settings to use for the API.
+    :param input_path: Path of the input JSONL file.
+    :param output_path: Path of the output JSONL file, appended to.
+    :param checkpoint_path: Path of the checkpoint file, defaults to the output
+        path with a ".checkpoint" suffix.
+    :param concurrency: Maximum number of requests in flight.
+    :param progress_interval: Seconds between progress log lines.
+    :return: The stats of the run.
+    """
+    checkpoint_path = checkpoint_path or f"{output_path}.checkpoint"
+    finished = set(read_lines(checkpoint_path))
+    read_lines(output_path)
+
+    stats = BatchStats(total=count_items(input_path))
+    items = read_items(input_path)
+    started = time.monotonic()
+
+    with (
+        open(output_path, "a", encoding="utf-8") as output,
+        open(checkpoint_path, "a", encoding="utf-8") as checkpoint,
+    ):
+
+        def record(id: str, completion: Any, error: str | None):
+            result = {"id": id, "completion": completion, "error": error}
+            output.write(json.dumps(result) + "\n")
+            output.flush()
+            if error is None:
+                checkpoint.write(id + "\n")
+                checkpoint.flush()
+
+        async def worker():
+            for id, item in items:
+                if id in finished:
+                    stats.skipped += 1
+                    continue
+
+                if item is None:
+                    stats.failed += 1
+                    record(id, None, "Invalid JSON line")
+                    continue
+
+                try:
+                    response = await azure_openai.get_completion(
+                        settings=settings,
+                        messages=item["messages"],
+                        temperature=item.get("temperature", 0.0),
+                        max_tokens=item.get("max_tokens"),
+                    )
+                except Exception as e:
+                    logging.error(f"Item {id} failed: {e}")
+                    response = None
+
+                if response is None:
+                    stats.failed += 1
+                    record(id, None, "Failed to get a completion")
+                    continue
+
+                stats.completed += 1
+                if response.usage is not None:
+                    stats.tokens += response.usage.total_tokens
+                record(id, response.model_dump(), None)
+
+        async def report():
+            while True:
+                await asyncio.sleep(progress_interval)
+                stats.elapsed = time.monotonic() - started
+                logging.info(f"Batch progress: {stats}")
+
+        reporter = asyncio.create_task(report())
+        try:
+            await asyncio.gather(*[worker() for _ in range(concurrency)])
+        finally:
+            reporter.cancel()
+
+    stats.elapsed = time.monotonic() - started
+    logging.info(f"Batch completed: {stats}")
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a JSONL file of prompts.")
+    parser.add_argument("input", help="input JSONL file")
+    parser.add_argument("output", help="output JSONL file, appended to")
+    parser.add_argument("--checkpoint", help="checkpoint file")
+    parser.add_argument("--concurrency", type=int, default=8)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(
+        run_batch(
+            settings=AzureOpenAISettings.model_validate({}),
+            input_path=args.input,
+            output_path=args.output,
+            checkpoint_path=args.checkpoint,
+            concurrency=args.concurrency,
+        )
+    )
@@ -0,0 +1,179 @@
+import asyncio
+import contextlib
+import logging
+import os
+from typing import AsyncIterable, AsyncIterator, Iterable
+
+import aiohttp
+from pydantic import BaseModel
+
+import services.ai.azure_openai as azure_openai
+import services.storage.azure_blob_storage as blob_storage
+from common.async_iterator import to_async_iterator
+from common.settings import Settings
+
+
+class GeneratedImage(BaseModel):
+    index: int
+    prompt: str
+    url: str | None = None
+    revised_prompt: str | None = None
+    location: str | None = None
+    size: int = 0
+    error: str | None = None
+
+
+async def download_to_file(
+    response: aiohttp.ClientResponse, path: str, chunk_size: int
+) -> int:
+    """Stream a response body to a file, replaced only once complete.
+
+    The partial download is removed if reading or writing fails.
+
+    :param response: The response to read.
+    :param path: Path of the file.
+    :param chunk_size: Size of the chunks read and written.
+    :return: Number of bytes written.
+    """
+    tmp_path = f"{path}.tmp"
+    size = 0
+    f = await asyncio.to_thread(open, tmp_path, "wb")
+    try:
+        try:
+            async for chunk in response.content.iter_chunked(chunk_size):
+                await asyncio.to_thread(f.write, chunk)
+                size += len(chunk)
+        finally:
+            f.close()
+        await asyncio.to_thread(os.replace, tmp_path, path)
+    except BaseException:
+        # also on cancellation, so don't hand the cleanup to a thread
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(tmp_path)
+        raise
+    return size
+
+
+async def generate_images(
+    settings: Settings,
+    prompts: Iterable[str] | AsyncIterable[str],
+    directory: str | None = None,
+    container_name: str | None = None,
+    prefix: str = "",
+    concurrency: int = 4,
+    download_concurrency: int = 8,
+    chunk_size: int = 64 * 1024,
+) -> AsyncIterator[GeneratedImage]:
+    """Generate images from many prompts concurrently and download them.
+
+    At most `concurrency` generation requests are in flight. As soon as an image
+    URL arrives its download starts, streaming the image to `directory` or to
+    the blob container `container_name` without holding it in memory, while
+    generation moves on to the next prompt. Images are named
+    "<prefix><index>.png" after the position of their prompt, and yielded in
+    completion order; a failed image yields a result with `error` set instead of
+    aborting the batch. With no destination the URLs are yielded as they are.
+
+    :param settings: Settings object
+    :param prompts: The prompts of the images
+    :param directory: Folder to download the images to, created if missing
+    :param container_name: Container to upload the images to
+    :param prefix: Prefix of the file or blob names
+    :param concurrency: Maximum number of generation requests at the same time
+    :param download_concurrency: Maximum number of downloads at the same time
+    :param chunk_size: Size of the chunks streamed to the destination
+    """
+    source = to_async_iterator(prompts)
+    session = azure_openai.get_session(settings)
+    storage = None
+    if container_name is not None:
+        storage = blob_storage.BlobStorage(settings)
+    if directory is not None:
+        os.makedirs(directory, exist_ok=True)
+
+    source_lock = asyncio.Lock()
+    download_slots = asyncio.Semaphore(download_concurrency)
+    downloads: set[asyncio.Task] = set()
+    results: asyncio.Queue[GeneratedImage | Exception | None] = asyncio.Queue(
+        maxsize=concurrency
+    )
+    count = 0
+
+    async def next_prompt() -> tuple[int, str] | None:
+        nonlocal count
+        async with source_lock:
+            prompt = await anext(source, None)
+            if prompt is None:
+                return None
+            count += 1
+            return count - 1, prompt
+
+    async def download(http: aiohttp.ClientSession, image: GeneratedImage):
+        name = f"{prefix}{image.index:05d}.png"
+        try:
+            async with download_slots, http.get(image.url) as response:
+                response.raise_for_status()
+                if storage is not None and container_name is not None:
+                    image.size = await storage.upload_blob_from_stream(
+                        container_name=container_name,
+                        blob_name=name,
+                        data=response.content.iter_chunked(chunk_size),
+                        overwrite=True,
+                    )
+                    image.location = name
+                elif directory is not None:
+                    path = os.path.join(directory, name)
+                    image.size = await download_to_file(response, path, chunk_size)
+                    image.location = path
+        except Exception as e:
+            logging.exception("Failed to download image %s", image.index)
+            image.error = str(e)
+        await results.put(image)
+
+    async def generate(index: int, prompt: str) -> GeneratedImage:
+        image = GeneratedImage(index=index, prompt=prompt)
+        try:
+            response = await session.create_image(prompt)
+            if response is None or not response.data:
+                image.error = "Failed to generate the image"
+            else:
+                image.url = response.data[0].url
+                image.revised_prompt = response.data[0].revised_prompt
+        except Exception as e:
+            logging.exception("Failed to generate image %s", index)
+            image.error = str(e)
+        return image
+
+    async def worker(http: aiohttp.ClientSession):
+        while (item := await next_prompt()) is not None:
+            image = await generate(*item)
+            if image.error is None and (storage is not None or directory is not None):
+                task = asyncio.create_task(download(http, image))
+                downloads.add(task)
+                task.add_done_callback(downloads.discard)
+            else:
+                await results.put(image)
+
+    async def produce(http: aiohttp.ClientSession):
+        try:
+            await asyncio.gather(*[worker(http) for _ in range(concurrency)])
+            while downloads:
+                await asyncio.gather(*downloads)
+        except Exception as e:
+            await results.put(e)
+        await results.put(None)
+
+    async with aiohttp.ClientSession() as http:
+        producer = asyncio.create_task(produce(http))
+        try:
+            while (result := await results.get()) is not None:
+                if isinstance(result, Exception):
+                    raise result
+                yield result
+        finally:
+            producer.cancel()
+            for task in list(downloads):
+                task.cancel()
+            await asyncio.gather(producer, *downloads, return_exceptions=True)
+            if storage is not None:
+                await storage.close()
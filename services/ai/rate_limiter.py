@@ -0,0 +1,168 @@
+import asyncio
+import threading
+import time
+
+# Client-side token buckets for the tokens-per-minute (TPM) and
+# requests-per-minute (RPM) quotas of an Azure OpenAI deployment.
+# A request is charged its estimated tokens before it is sent and the estimate is
+# settled against the actual usage once the response arrives, so concurrent tasks
+# wait for quota locally instead of running into 429 responses.
+
+
+class TokenBucket:
+    """Bucket of `capacity` units that refills at `capacity` units per minute."""
+
+    def __init__(self, capacity: int):
+        """
+        :param capacity: Units available per minute.
+        """
+        self.capacity = float(capacity)
+        self.per_second = capacity / 60
+        self.level = float(capacity)
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        self.level = min(
+            self.capacity, self.level + (now - self.updated) * self.per_second
+        )
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until `amount` units are available, 0 if they are now."""
+        self.refill(time.monotonic())
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.per_second
+
+    def take(self, amount: float):
+        self.level -= min(amount, self.capacity)
+
+    def put(self, amount: float):
+        """Return units to the bucket, a negative amount takes them (debt)."""
+        self.refill(time.monotonic())
+        self.level = min(self.capacity, self.level + amount)
+
+
+class RateLimiter:
+    """Token-bucket limiter of one deployment, shared by every task using it.
+
+    Waiters are served in arrival order: the first one holds the lock while it
+    waits for quota, so a large request is not starved by smaller ones. Blocking
+    callers in threads, see `acquire_blocking`, draw from the same buckets.
+    """
+
+    def __init__(self, tokens_per_minute: int = 0, requests_per_minute: int = 0):
+        """
+        :param tokens_per_minute: TPM quota of the deployment, 0 for no limit.
+        :param requests_per_minute: RPM quota of the deployment, 0 for no limit.
+        """
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.requests = (
+            TokenBucket(requests_per_minute) if requests_per_minute else None
+        )
+        self._lock: asyncio.Lock | None = None
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self.blocking_lock = threading.Lock()
+        self.guard = threading.Lock()
+
+    @property
+    def lock(self) -> asyncio.Lock:
+        """Lock of the running event loop."""
+        loop = asyncio.get_running_loop()
+        if self._lock is None or self._loop is not loop:
+            self._lock = asyncio.Lock()
+            self._loop = loop
+        return self._lock
+
+    def cap(self, tokens: int) -> int:
+        """The charge of a request, at most a full token bucket."""
+        if self.tokens is None:
+            return tokens
+        return min(tokens, int(self.tokens.capacity))
+
+    def buckets(self, tokens: int) -> list[tuple[TokenBucket, int]]:
+        return [
+            (bucket, amount)
+            for bucket, amount in ((self.tokens, tokens), (self.requests, 1))
+            if bucket is not None
+        ]
+
+    def try_take(self, buckets: list[tuple[TokenBucket, int]]) -> float:
+        """Charge the buckets if all of them have quota, else return the wait."""
+        with self.guard:
+            wait = max(bucket.wait_time(amount) for bucket, amount in buckets)
+            if wait <= 0:
+                for bucket, amount in buckets:
+                    bucket.take(amount)
+            return wait
+
+    async def acquire(self, tokens: int) -> int:
+        """Wait until a request of `tokens` tokens fits the quota and charge it.
+
+        :param tokens: Estimated tokens of the request, prompt plus max_tokens.
+        :return: The tokens charged, capped to the TPM quota, to pass to `settle`.
+        """
+        tokens = self.cap(tokens)
+        buckets = self.buckets(tokens)
+        if not buckets:
+            return tokens
+
+        async with self.lock:
+            while (wait := self.try_take(buckets)) > 0:
+                await asyncio.sleep(wait)
+
+        return tokens
+
+    def acquire_blocking(self, tokens: int) -> int:
+        """Block the thread until a request of `tokens` tokens fits the quota.
+
+        :param tokens: Estimated tokens of the request, prompt plus max_tokens.
+        :return: The tokens charged, capped to the TPM quota, to pass to `settle`.
+        """
+        tokens = self.cap(tokens)
+        buckets = self.buckets(tokens)
+        if not buckets:
+            return tokens
+
+        with self.blocking_lock:
+            while (wait := self.try_take(buckets)) > 0:
+                time.sleep(wait)
+
+        return tokens
+
+    def settle(self, charged: int, used: int):
+        """Credit back the unused part of a charge, or take the overrun.
+
+        :param charged: The tokens charged by `acquire`.
+        :param used: The tokens the request actually used.
+        """
+        if self.tokens is not None:
+            with self.guard:
+                self.tokens.put(charged - used)
+
+
+_limiters: dict[tuple[str, str, int, int], RateLimiter] = {}
+
+
+def get_rate_limiter(
+    endpoint: str,
+    deployment: str,
+    tokens_per_minute: int = 0,
+    requests_per_minute: int = 0,
+) -> RateLimiter:
+    """Get the shared limiter of a deployment and quotas, one per process.
+
+    Callers that configure other quotas for the same deployment get a limiter of
+    their own, with the quotas they asked for.
+
+    :param endpoint: The Azure OpenAI endpoint.
+    :param deployment: The name of the deployment.
+    :param tokens_per_minute: TPM quota of the deployment, 0 for no limit.
+    :param requests_per_minute: RPM quota of the deployment, 0 for no limit.
+    """
+    key = (endpoint, deployment, tokens_per_minute, requests_per_minute)
+    limiter = _limiters.get(key)
+    if limiter is None:
+        limiter = _limiters[key] = RateLimiter(tokens_per_minute, requests_per_minute)
+    return limiter
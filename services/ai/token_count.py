@@ -1,11 +1,46 @@
+from functools import lru_cache
+from typing import Any, Iterable, Mapping
+
 import tiktoken
 
 
+@lru_cache
+def get_encoding(encoding_name: str = "cl100k_base") -> tiktoken.Encoding:
+    """Return a tiktoken encoding, loaded once per process.
+
+    :param encoding_name: The name of the encoding to use.
+    """
+    return tiktoken.get_encoding(encoding_name)
+
+
 def num_tokens_from_string(string: str, encoding_name: str = "cl100k_base") -> int:
     """Return the number of tokens in a string.
 
     :param string: The string to count tokens in.
     :param encoding_name: The name of the encoding to use.
     """
-    encoding = tiktoken.get_encoding(encoding_name)
+    encoding = get_encoding(encoding_name)
     return len(encoding.encode(string))
+
+
+def num_tokens_from_messages(
+    messages: Iterable[Mapping[str, Any]], encoding_name: str = "cl100k_base"
+) -> int:
+    """Return the number of prompt tokens of chat messages.
+
+    Every message costs 3 tokens on top of its fields, a name 1 more, and the
+    reply is primed with 3 tokens.
+
+    :param messages: The chat messages.
+    :param encoding_name: The name of the encoding to use.
+    """
+    encoding = get_encoding(encoding_name)
+    count = 3
+    for message in messages:
+        count += 3
+        for key, value in message.items():
+            if isinstance(value, str):
+                count += len(encoding.encode(value))
+                if key == "name":
+                    count += 1
+    return count
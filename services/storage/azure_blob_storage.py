@@ -1,9 +1,676 @@
+import asyncio
+import base64
 import datetime
+import logging
+import mmap
+import os
+import time
+import zlib
+from collections import deque
+from functools import lru_cache
+from typing import IO, AsyncIterable, AsyncIterator, Iterable
 
-from azure.storage.blob import BlobSasPermissions, generate_blob_sas
+from azure.core import MatchConditions
+from azure.core.exceptions import HttpResponseError
+from azure.storage.blob import BlobSasPermissions, ContentSettings, generate_blob_sas
 from azure.storage.blob.aio import BlobServiceClient
+from pydantic import BaseModel
 
-from common.settings import Settings
+from common.disk_cache import DiskCache
+from common.settings import AzureBlobStorageSettings, Settings
+
+
+class BlobInfo(BaseModel):
+    etag: str
+    size: int
+    last_modified: datetime.datetime
+
+
+class BlobIndex(BaseModel):
+    """Index of the blobs under a container prefix, from a single listing.
+
+    Existence and change queries are answered from memory. The index can be
+    saved with `model_dump_json` and reloaded with `model_validate_json` to
+    compare against the next run.
+    """
+
+    container_name: str
+    prefix: str | None = None
+    blobs: dict[str, BlobInfo] = {}
+
+    def exists(self, blob_name: str) -> bool:
+        return blob_name in self.blobs
+
+    def missing(self, blob_names: Iterable[str]) -> list[str]:
+        """Return the blob names that are not in the index.
+
+        :param blob_names: Blob names to check.
+        """
+        return [name for name in blob_names if name not in self.blobs]
+
+    def modified_since(self, when: datetime.datetime) -> list[str]:
+        """Return the blob names last modified after a point in time.
+
+        :param when: Point in time, timezone aware.
+        """
+        return [name for name, info in self.blobs.items() if info.last_modified > when]
+
+    def changed(self, previous: "BlobIndex") -> list[str]:
+        """Return the blob names that are new or have a new ETag since a previous
+        index.
+
+        :param previous: Index from an earlier run.
+        """
+        return [
+            name
+            for name, info in self.blobs.items()
+            if name not in previous.blobs or previous.blobs[name].etag != info.etag
+        ]
+
+
+class SasGenerator:
+    """Generates blob SAS URLs in-process from a parsed connection string.
+
+    URLs are cached per (container, blob, permission, duration) and reused until
+    `refresh_margin_seconds` before they expire, so generating URLs for a batch
+    costs no I/O and, mostly, no signing.
+    """
+
+    def __init__(
+        self,
+        connection_string: str,
+        refresh_margin_seconds: int = 300,
+        max_entries: int = 100_000,
+    ):
+        """
+        :param connection_string: Connection string to the storage account.
+        :param refresh_margin_seconds: Time before expiry at which a cached URL
+            is no longer handed out.
+        :param max_entries: Number of cached URLs above which expired ones are
+            purged.
+        """
+        parts = dict(
+            part.split("=", 1) for part in connection_string.split(";") if "=" in part
+        )
+        self.account_name = parts["AccountName"]
+        self.account_key = parts["AccountKey"]
+        self.blob_endpoint = parts.get("BlobEndpoint", "").rstrip("/") or (
+            f"https://{self.account_name}.blob."
+            f"{parts.get('EndpointSuffix', 'core.windows.net')}"
+        )
+        self.refresh_margin_seconds = refresh_margin_seconds
+        self.max_entries = max_entries
+        self.cache: dict[tuple[str, str, str, int], tuple[str, datetime.datetime]] = {}
+
+    def create_sas_url(
+        self,
+        container_name: str,
+        blob_name: str,
+        permission: BlobSasPermissions = BlobSasPermissions(read=True),
+        duration_seconds: int = 3600,
+    ) -> str:
+        """creates a sas URL for a blob, or returns a cached one
+
+        :param container_name: Name of the container.
+        :param blob_name: Name of the blob.
+        :param permission: Permission to grant.
+        :param duration_seconds: SAS duration in seconds.
+        :return: SAS URL
+        """
+        now = datetime.datetime.now(datetime.timezone.utc)
+        key = (container_name, blob_name, str(permission), duration_seconds)
+        margin = datetime.timedelta(
+            seconds=min(self.refresh_margin_seconds, duration_seconds // 2)
+        )
+
+        cached = self.cache.get(key)
+        if cached and now < cached[1] - margin:
+            return cached[0]
+
+        expiry_time = now + datetime.timedelta(seconds=duration_seconds)
+        token = generate_blob_sas(
+            account_name=self.account_name,
+            account_key=self.account_key,
+            container_name=container_name,
+            blob_name=blob_name,
+            permission=permission,
+            expiry=expiry_time,
+            start=now,
+        )
+        url = f"{self.blob_endpoint}/{container_name}/{blob_name}?{token}"
+
+        if len(self.cache) >= self.max_entries:
+            self.cache = {k: v for k, v in self.cache.items() if now < v[1] - margin}
+        self.cache[key] = (url, expiry_time)
+        return url
+
+
+@lru_cache
+def get_sas_generator(connection_string: str) -> SasGenerator:
+    """Get the SAS generator of a storage account, one per process.
+
+    :param connection_string: Connection string to the storage account.
+    """
+    return SasGenerator(connection_string)
+
+
+class BlobCache:
+    """Local read-through cache of blob contents, validated by ETag.
+
+    A cached blob is revalidated with a conditional request (If-None-Match), so
+    an unchanged blob costs a 304 instead of a download. Within `max_age_seconds`
+    of its last validation in this process it is served without any request.
+    """
+
+    def __init__(self, directory: str, max_bytes: int, max_age_seconds: int = 0):
+        """
+        :param directory: Folder for the cache files.
+        :param max_bytes: Maximum total size of the cache, least recently used
+            blobs are evicted first.
+        :param max_age_seconds: Time after a validation during which a cached
+            blob is used without revalidating it.
+        """
+        self.disk = DiskCache(directory=directory, max_bytes=max_bytes)
+        self.max_age_seconds = max_age_seconds
+        self.validated: dict[str, float] = {}
+
+    def get(self, key: str) -> tuple[str, bytes] | None:
+        """Return the (etag, content) of a cached blob, None on a miss.
+
+        :param key: container/blob name.
+        """
+        data = self.disk.get(key)
+        if data is None:
+            return None
+
+        etag, content = data.split(b"\n", 1)
+        return etag.decode("utf-8"), content
+
+    def set(self, key: str, etag: str, content: bytes):
+        """Cache the content of a blob.
+
+        :param key: container/blob name.
+        :param etag: ETag of the content.
+        :param content: Blob content.
+        """
+        self.disk.set(key, etag.encode("utf-8") + b"\n" + content)
+        self.validate(key)
+
+    def validate(self, key: str):
+        self.validated[key] = time.monotonic()
+
+    def is_fresh(self, key: str) -> bool:
+        validated = self.validated.get(key)
+        return (
+            validated is not None
+            and time.monotonic() - validated < self.max_age_seconds
+        )
+
+
+@lru_cache
+def get_blob_cache(
+    directory: str, max_bytes: int, max_age_seconds: int = 0
+) -> BlobCache:
+    """Get the blob cache of a folder, one per process.
+
+    :param directory: Folder for the cache files.
+    :param max_bytes: Maximum total size of the cache.
+    :param max_age_seconds: Time during which a validated blob is not
+        revalidated.
+    """
+    return BlobCache(directory, max_bytes, max_age_seconds)
+
+
+class BlobStorage:
+    """Storage session that owns one BlobServiceClient.
+
+    The client, and with it the aiohttp connection pool, is shared by every
+    operation until the session is closed, so repeated calls reuse keep-alive
+    connections instead of setting up a new one each time.
+
+    async with BlobStorage(settings) as storage:
+        if not await storage.is_blob_exists(container_name, blob_name):
+            ...
+    """
+
+    def __init__(
+        self,
+        settings: AzureBlobStorageSettings,
+        chunk_size: int = 4 * 1024 * 1024,
+    ):
+        """
+        :param settings: Azure Blob Storage settings.
+        :param chunk_size: Size of each range request of a parallel download. The
+            first request of a download keeps the SDK's larger single get size,
+            so blobs up to that size still take one round trip.
+        """
+        self.connection_string = settings.azure_storage_connection_string
+        self.chunk_size = chunk_size
+        self.cache = None
+        if settings.azure_storage_cache_dir:
+            self.cache = get_blob_cache(
+                settings.azure_storage_cache_dir,
+                settings.azure_storage_cache_max_bytes,
+                settings.azure_storage_cache_max_age_secs,
+            )
+        self.client = BlobServiceClient.from_connection_string(
+            self.connection_string, max_chunk_get_size=chunk_size
+        )
+
+    async def __aenter__(self) -> "BlobStorage":
+        await self.client.__aenter__()
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def close(self):
+        """Close the client and its connections."""
+        await self.client.close()
+
+    async def index_blobs(
+        self, container_name: str, prefix: str | None = None
+    ) -> BlobIndex:
+        """Lists the blobs under a prefix once and indexes them by name.
+
+        :param container_name: Name of the container.
+        :param prefix: Prefix of the blob names, all blobs if not given.
+        :return: Index of name -> (etag, size, last modified).
+        """
+        container_client = self.client.get_container_client(container_name)
+        index = BlobIndex(container_name=container_name, prefix=prefix)
+
+        async for blob in container_client.list_blobs(
+            name_starts_with=prefix, results_per_page=5000
+        ):
+            index.blobs[blob.name] = BlobInfo(
+                etag=blob.etag, size=blob.size, last_modified=blob.last_modified
+            )
+
+        return index
+
+    async def is_blob_exists(self, container_name: str, blob_name: str) -> bool:
+        """Checks if a blob exists in the storage account.
+
+        :param container_name: Name of the container.
+        :param blob_name: Name of the blob.
+        :return: True if the blob exists, False otherwise.
+        """
+        blob_client = self.client.get_blob_client(
+            container=container_name, blob=blob_name
+        )
+        return await blob_client.exists()
+
+    async def get_blob_etag(self, container_name: str, blob_name: str) -> str:
+        """Get the ETag of a blob, which changes whenever its content does.
+
+        :param container_name: Name of the container.
+        :param blob_name: Name of the blob.
+        :return: The ETag of the blob.
+        """
+        blob_client = self.client.get_blob_client(
+            container=container_name, blob=blob_name
+        )
+        properties = await blob_client.get_blob_properties()
+        return properties.etag
+
+    async def download_blob_as_bytes(
+        self, container_name: str, blob_name: str, max_concurrency: int = 1
+    ) -> bytes:
+        """Downloads a blob from the storage account, through the local cache if
+        `azure_storage_cache_dir` is set.
+
+        :param container_name: Name of the container.
+        :param blob_name: Name of the blob.
+        :param max_concurrency: Number of parallel range requests.
+        :return: Blob contents.
+        """
+        blob_client = self.client.get_blob_client(
+            container=container_name, blob=blob_name
+        )
+
+        if self.cache is None:
+            downloader = await blob_client.download_blob(
+                max_concurrency=max_concurrency
+            )
+            return await downloader.readall()
+
+        key = f"{container_name}/{blob_name}"
+        cached = await asyncio.to_thread(self.cache.get, key)
+        conditions = {}
+
+        if cached is not None:
+            etag, content = cached
+            if self.cache.is_fresh(key):
+                return content
+            conditions = {"etag": etag, "match_condition": MatchConditions.IfModified}
+
+        try:
+            downloader = await blob_client.download_blob(
+                max_concurrency=max_concurrency, **conditions
+            )
+        except HttpResponseError as e:
+            if cached is None or e.status_code != 304:
+                raise
+            self.cache.validate(key)
+            return cached[1]
+
+        content = await downloader.readall()
+        await asyncio.to_thread(
+            self.cache.set, key, downloader.properties.etag, content
+        )
+        return content
+
+    async def download_blob_as_str(
+        self, container_name: str, blob_name: str, max_concurrency: int = 1
+    ):
+        """Downloads a blob from the storage account.
+
+        :param container_name: Name of the container.
+        :param blob_name: Name of the blob.
+        :param max_concurrency: Number of parallel range requests.
+        :return: Blob contents.
+        """
+        content = await self.download_blob_as_bytes(
+            container_name, blob_name, max_concurrency
+        )
+        return content.decode("utf-8")
+
+    async def download_blob_to_file(
+        self,
+        container_name: str,
+        blob_name: str,
+        path: str | os.PathLike,
+        max_concurrency: int = 4,
+    ) -> int:
+        """Downloads a blob straight into a local file with parallel range requests.
+
+        The file is preallocated to the blob size and every range is written at
+        its offset, so memory use is bounded by the ranges in flight.
+
+        :param container_name: Name of the container.
+        :param blob_name: Name of the blob.
+        :param path: Path of the file to write.
+        :param max_concurrency: Number of parallel range requests.
+        :return: Number of bytes downloaded.
+        """
+        blob_client = self.client.get_blob_client(
+            container=container_name, blob=blob_name
+        )
+        downloader = await blob_client.download_blob(max_concurrency=max_concurrency)
+
+        with open(path, "wb") as f:
+            f.truncate(downloader.size)
+            return await downloader.readinto(f)
+
+    async def download_blob_to_mmap(
+        self,
+        container_name: str,
+        blob_name: str,
+        path: str | os.PathLike,
+        max_concurrency: int = 4,
+    ) -> mmap.mmap:
+        """Downloads a blob into a local file and memory-maps it read-only.
+
+        The blob must not be empty, an empty file cannot be memory-mapped.
+
+        :param container_name: Name of the container.
+        :param blob_name: Name of the blob.
+        :param path: Path of the file to write.
+        :param max_concurrency: Number of parallel range requests.
+        :return: Read-only memory map of the file.
+        """
+        await self.download_blob_to_file(
+            container_name, blob_name, path, max_concurrency
+        )
+        with open(path, "rb") as f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    async def iter_blob_chunks(
+        self, container_name: str, blob_name: str, max_concurrency: int = 4
+    ) -> AsyncIterator[bytes]:
+        """Downloads a blob as an async iterator of chunks, in order.
+
+        Up to `max_concurrency` chunks of `chunk_size` are fetched ahead of the
+        consumer. All ranges are pinned to the ETag of the blob when the download
+        started, so a blob changed mid-download fails instead of mixing versions.
+
+        :param container_name: Name of the container.
+        :param blob_name: Name of the blob.
+        :param max_concurrency: Number of parallel range requests.
+        """
+        blob_client = self.client.get_blob_client(
+            container=container_name, blob=blob_name
+        )
+        properties = await blob_client.get_blob_properties()
+        size = properties.size
+
+        async def fetch(offset: int) -> bytes:
+            downloader = await blob_client.download_blob(
+                offset=offset,
+                length=min(self.chunk_size, size - offset),
+                etag=properties.etag,
+                match_condition=MatchConditions.IfNotModified,
+            )
+            return await downloader.readall()
+
+        offsets = iter(range(0, size, self.chunk_size))
+        pending: deque[asyncio.Task[bytes]] = deque()
+        try:
+            for offset in offsets:
+                pending.append(asyncio.create_task(fetch(offset)))
+                if len(pending) >= max_concurrency:
+                    break
+
+            while pending:
+                data = await pending.popleft()
+                offset = next(offsets, None)
+                if offset is not None:
+                    pending.append(asyncio.create_task(fetch(offset)))
+                yield data
+        finally:
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    async def create_sas_url(
+        self,
+        container_name: str,
+        blob_name: str,
+        permission: BlobSasPermissions = BlobSasPermissions(read=True),
+        duration_seconds: int = 3600,
+    ) -> str:
+        """creates a sas URL for a blob, without any I/O
+
+        :param container_name: Name of the container.
+        :param blob_name: Name of the blob.
+        :param permission: Permission to grant.
+        :param duration_seconds: SAS duration in seconds.
+        :return: SAS URL
+        """
+        return get_sas_generator(self.connection_string).create_sas_url(
+            container_name, blob_name, permission, duration_seconds
+        )
+
+    async def upload_blob(
+        self,
+        container_name: str,
+        blob_name: str,
+        data: bytes | str,
+        overwrite: bool = False,
+    ):
+        """
+        Uploads a blob to the storage account.
+
+        :param container_name: Name of the container.
+        :param blob_name: Name of the blob.
+        :param data: Data to upload.
+        :param overwrite: Overwrite the blob if it exists.
+        """
+        blob_client = self.client.get_blob_client(
+            container=container_name, blob=blob_name
+        )
+        await blob_client.upload_blob(data, overwrite=overwrite)
+
+    async def upload_blob_from_stream(
+        self,
+        container_name: str,
+        blob_name: str,
+        data: AsyncIterable[bytes | str] | IO[bytes],
+        overwrite: bool = False,
+        block_size: int = 4 * 1024 * 1024,
+        max_concurrency: int = 4,
+        compress: bool = False,
+    ) -> int:
+        """Uploads a blob from an async iterator or file object, block by block.
+
+        Data is cut into blocks of `block_size` as it arrives, and up to
+        `max_concurrency` blocks are staged in parallel. The producer waits while
+        all slots are busy, so memory stays bounded by the blocks in flight. The
+        block list is committed at the end, the blob does not change until then.
+
+        :param container_name: Name of the container.
+        :param blob_name: Name of the blob.
+        :param data: Async iterator of bytes or str (UTF-8 encoded), or a binary
+            file object.
+        :param overwrite: Overwrite the blob if it exists.
+        :param block_size: Size of each staged block.
+        :param max_concurrency: Number of blocks staged at the same time.
+        :param compress: Gzip the data on the fly, and set the blob's content
+            encoding to gzip.
+        :return: Number of bytes uploaded.
+        """
+        blob_client = self.client.get_blob_client(
+            container=container_name, blob=blob_name
+        )
+        compressor = zlib.compressobj(wbits=31) if compress else None
+        slots = asyncio.Semaphore(max_concurrency)
+        block_ids: list[str] = []
+        tasks: list[asyncio.Task] = []
+        buffer = bytearray()
+        uploaded = 0
+
+        async def stage(block_id: str, block: bytes):
+            try:
+                await blob_client.stage_block(block_id=block_id, data=block)
+            finally:
+                slots.release()
+
+        async def flush(final: bool = False):
+            nonlocal buffer, uploaded
+            while len(buffer) >= block_size or (final and buffer):
+                block = bytes(buffer[:block_size])
+                del buffer[:block_size]
+                block_id = base64.b64encode(f"{len(block_ids):08d}".encode()).decode()
+                block_ids.append(block_id)
+                uploaded += len(block)
+
+                await slots.acquire()
+                tasks.append(asyncio.create_task(stage(block_id, block)))
+                # surface a failed block before reading more data
+                for task in [task for task in tasks if task.done()]:
+                    tasks.remove(task)
+                    task.result()
+
+        async def chunks() -> AsyncIterator[bytes]:
+            if isinstance(data, AsyncIterable):
+                async for chunk in data:
+                    yield chunk.encode("utf-8") if isinstance(chunk, str) else chunk
+            else:
+                while chunk := await asyncio.to_thread(data.read, block_size):
+                    yield chunk
+
+        try:
+            async for chunk in chunks():
+                buffer += compressor.compress(chunk) if compressor else chunk
+                await flush()
+            if compressor:
+                buffer += compressor.flush()
+            await flush(final=True)
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+        await blob_client.commit_block_list(
+            block_ids,
+            content_settings=(
+                ContentSettings(content_encoding="gzip") if compress else None
+            ),
+            **(
+                {}
+                if overwrite
+                else {"etag": "*", "match_condition": MatchConditions.IfMissing}
+            ),
+        )
+        return uploaded
+
+
+_storages: dict[
+    tuple[str, str | None, int, int], tuple[asyncio.AbstractEventLoop, BlobStorage]
+] = {}
+_closing: set[asyncio.Task] = set()
+
+
+def discard(storage: BlobStorage, loop: asyncio.AbstractEventLoop):
+    """Close the storage session of another event loop without waiting.
+
+    The session is closed in its own loop if that loop still runs in another
+    thread, else in the running loop. Errors are logged, the connections of a
+    closed loop can't be shut down cleanly.
+
+    :param storage: The storage session to close.
+    :param loop: The event loop the session was used in.
+    """
+
+    async def close():
+        try:
+            await storage.close()
+        except Exception as e:
+            logging.debug(f"Failed to close the storage of a stale loop: {e}")
+
+    if loop.is_running() and not loop.is_closed():
+        asyncio.run_coroutine_threadsafe(close(), loop)
+        return
+    task = asyncio.get_running_loop().create_task(close())
+    _closing.add(task)
+    task.add_done_callback(_closing.discard)
+
+
+def get_storage(settings: AzureBlobStorageSettings) -> BlobStorage:
+    """Get the shared storage session of the module functions.
+
+    One session per connection string and cache settings is created on first
+    use in an event loop and reused by every call in that loop, so the module
+    functions share keep-alive connections. The session of a previous loop is
+    closed when it is replaced. Call `close_storages` at shutdown.
+
+    :param settings: Azure Blob Storage settings.
+    """
+    key = (
+        settings.azure_storage_connection_string,
+        settings.azure_storage_cache_dir,
+        settings.azure_storage_cache_max_bytes,
+        settings.azure_storage_cache_max_age_secs,
+    )
+    loop = asyncio.get_running_loop()
+    entry = _storages.get(key)
+    if entry is None or entry[0] is not loop:
+        if entry is not None:
+            discard(entry[1], entry[0])
+        entry = _storages[key] = (loop, BlobStorage(settings))
+    return entry[1]
+
+
+async def close_storages():
+    """Close the shared storage sessions of the running event loop."""
+    loop = asyncio.get_running_loop()
+    for key, (storage_loop, storage) in list(_storages.items()):
+        if storage_loop is loop:
+            del _storages[key]
+            await storage.close()
 
 
 async def is_blob_exists(
@@ -16,29 +683,93 @@ async def is_blob_exists(
     :param blob_name: Name of the blob.
     :return: True if the blob exists, False otherwise.
     """
-    async with BlobServiceClient.from_connection_string(
-        settings.azure_storage_connection_string
-    ) as client:
-        blob_client = client.get_blob_client(container=container_name, blob=blob_name)
-        return await blob_client.exists()
+    storage = get_storage(settings)
+    return await storage.is_blob_exists(container_name, blob_name)
+
+
+async def get_blob_etag(settings: Settings, container_name: str, blob_name: str) -> str:
+    """Get the ETag of a blob, which changes whenever its content does.
+
+    :param settings: Settings object.
+    :param container_name: Name of the container.
+    :param blob_name: Name of the blob.
+    :return: The ETag of the blob.
+    """
+    storage = get_storage(settings)
+    return await storage.get_blob_etag(container_name, blob_name)
 
 
-async def download_blob_as_str(settings: Settings, container_name: str, blob_name: str):
+async def index_blobs(
+    settings: Settings, container_name: str, prefix: str | None = None
+) -> BlobIndex:
+    """Lists the blobs under a prefix once and indexes them by name.
+
+    :param settings: Settings object.
+    :param container_name: Name of the container.
+    :param prefix: Prefix of the blob names, all blobs if not given.
+    :return: Index of name -> (etag, size, last modified).
+    """
+    storage = get_storage(settings)
+    return await storage.index_blobs(container_name, prefix)
+
+
+async def download_blob_as_str(
+    settings: Settings, container_name: str, blob_name: str, max_concurrency: int = 1
+):
     """Downloads a blob from the storage account.
 
-    :param conn_str: Connection string to the storage account.
+    :param settings: Settings object.
     :param container_name: Name of the container.
     :param blob_name: Name of the blob.
+    :param max_concurrency: Number of parallel range requests.
     :return: Blob contents.
     """
-    async with BlobServiceClient.from_connection_string(
-        settings.azure_storage_connection_string
-    ) as client:
-        blob_client = client.get_blob_client(container=container_name, blob=blob_name)
-        downloader = await blob_client.download_blob(
-            max_concurrency=1, encoding="UTF-8"
-        )
-        return await downloader.readall()
+    storage = get_storage(settings)
+    return await storage.download_blob_as_str(
+        container_name, blob_name, max_concurrency
+    )
+
+
+async def download_blob_to_file(
+    settings: Settings,
+    container_name: str,
+    blob_name: str,
+    path: str | os.PathLike,
+    max_concurrency: int = 4,
+) -> int:
+    """Downloads a blob straight into a local file with parallel range requests.
+
+    :param settings: Settings object.
+    :param container_name: Name of the container.
+    :param blob_name: Name of the blob.
+    :param path: Path of the file to write.
+    :param max_concurrency: Number of parallel range requests.
+    :return: Number of bytes downloaded.
+    """
+    storage = get_storage(settings)
+    return await storage.download_blob_to_file(
+        container_name, blob_name, path, max_concurrency
+    )
+
+
+async def iter_blob_chunks(
+    settings: Settings,
+    container_name: str,
+    blob_name: str,
+    max_concurrency: int = 4,
+) -> AsyncIterator[bytes]:
+    """Downloads a blob as an async iterator of chunks, in order.
+
+    :param settings: Settings object.
+    :param container_name: Name of the container.
+    :param blob_name: Name of the blob.
+    :param max_concurrency: Number of parallel range requests.
+    """
+    storage = get_storage(settings)
+    async for chunk in storage.iter_blob_chunks(
+        container_name, blob_name, max_concurrency
+    ):
+        yield chunk
 
 
 async def create_sas_url(
@@ -57,25 +788,9 @@ async def create_sas_url(
     :param duration_seconds: SAS duration in seconds.
     :return: SAS URL
     """
-    async with BlobServiceClient.from_connection_string(
-        settings.azure_storage_connection_string
-    ) as client:
-        start_time = datetime.datetime.now(datetime.timezone.utc)
-        expiry_time = start_time + datetime.timedelta(seconds=duration_seconds)
-
-        token = generate_blob_sas(
-            account_name=client.account_name,  # type: ignore
-            account_key=client.credential.account_key,
-            container_name=container_name,
-            blob_name=blob_name,
-            permission=permission,
-            expiry=expiry_time,
-            start=start_time,
-        )
-
-        account = str(client.account_name)
-
-        return f"https://{account}.blob.core.windows.net/{container_name}/{blob_name}?{token}"
+    return get_sas_generator(settings.azure_storage_connection_string).create_sas_url(
+        container_name, blob_name, permission, duration_seconds
+    )
 
 
 async def upload_blob(
@@ -94,8 +809,40 @@ async def upload_blob(
     :param data: Data to upload.
     :param overwrite: Overwrite the blob if it exists.
     """
-    async with BlobServiceClient.from_connection_string(
-        settings.azure_storage_connection_string
-    ) as client:
-        blob_client = client.get_blob_client(container=container_name, blob=blob_name)
-        await blob_client.upload_blob(data, overwrite=overwrite)
+    storage = get_storage(settings)
+    await storage.upload_blob(container_name, blob_name, data, overwrite)
+
+
+async def upload_blob_from_stream(
+    settings: Settings,
+    container_name: str,
+    blob_name: str,
+    data: AsyncIterable[bytes | str] | IO[bytes],
+    overwrite: bool = False,
+    block_size: int = 4 * 1024 * 1024,
+    max_concurrency: int = 4,
+    compress: bool = False,
+) -> int:
+    """Uploads a blob from an async iterator or file object, block by block.
+
+    :param settings: Settings object.
+    :param container_name: Name of the container.
+    :param blob_name: Name of the blob.
+    :param data: Async iterator of bytes or str (UTF-8 encoded), or a binary file
+        object.
+    :param overwrite: Overwrite the blob if it exists.
+    :param block_size: Size of each staged block.
+    :param max_concurrency: Number of blocks staged at the same time.
+    :param compress: Gzip the data on the fly.
+    :return: Number of bytes uploaded.
+    """
+    storage = get_storage(settings)
+    return await storage.upload_blob_from_stream(
+        container_name,
+        blob_name,
+        data,
+        overwrite=overwrite,
+        block_size=block_size,
+        max_concurrency=max_concurrency,
+        compress=compress,
+    )
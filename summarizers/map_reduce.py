@@ -0,0 +1,119 @@
+import asyncio
+import logging
+
+from openai.types.chat import ChatCompletionSystemMessageParam
+
+import services.ai.azure_openai as azure_openai
+from common.settings import AzureOpenAISettings
+from extractors.azure_form_recognizer import DocBlock, DocPage
+from extractors.chunker import SEPARATOR, chunk_pages
+
+# Map-reduce summarization of documents that do not fit one prompt.
+# The document is split into token-budgeted sections on paragraph boundaries,
+# the sections are summarized concurrently, and the joined partial summaries
+# are split and summarized again until they fit in one section.
+
+SECTION_PROMPT = """You are given a section of a longer document. Summarize it.
+
+Instructions:
+- Keep the key facts, figures, findings and conclusions of the section.
+- Do not add information that is not in the section.
+
+Section:
+{{document}}
+"""
+
+
+def split_sections(document: str, max_tokens: int) -> list[str]:
+    """Split a document into sections of up to max_tokens tokens.
+
+    Paragraphs are kept whole unless a paragraph alone is over the budget.
+
+    :param document: The document text, paragraphs separated by blank lines.
+    :param max_tokens: Maximum number of tokens in a section.
+    """
+    page = DocPage(
+        page_number=None,
+        blocks=[DocBlock(content=p) for p in document.split(SEPARATOR) if p.strip()],
+    )
+    return [chunk.content for chunk in chunk_pages([page], max_tokens=max_tokens)]
+
+
+async def summarize_sections(
+    settings: AzureOpenAISettings,
+    sections: list[str],
+    prompt: str = SECTION_PROMPT,
+    concurrency: int = 4,
+) -> list[str] | None:
+    """Summarize sections concurrently, in order.
+
+    Requests also wait for the rate limiter of the deployment, see
+    `OpenAISession`.
+
+    :param settings: The settings to use for the API.
+    :param sections: The sections to summarize.
+    :param prompt: The prompt, "{{document}}" is replaced by a section.
+    :param concurrency: Maximum number of requests in flight.
+    :return: One summary per section, None if a request failed.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def summarize(section: str) -> str | None:
+        async with semaphore:
+            response = await azure_openai.get_completion(
+                settings=settings,
+                messages=[
+                    ChatCompletionSystemMessageParam(
+                        role="system", content=prompt.replace("{{document}}", section)
+                    )
+                ],
+                temperature=0,
+            )
+        if response is None or not response.choices:
+            return None
+        return response.choices[0].message.content
+
+    summaries = await asyncio.gather(*[summarize(section) for section in sections])
+    if any(summary is None for summary in summaries):
+        return None
+    return summaries  # type: ignore
+
+
+async def map_reduce(
+    settings: AzureOpenAISettings,
+    document: str,
+    max_tokens: int,
+    prompt: str = SECTION_PROMPT,
+    concurrency: int = 4,
+) -> str | None:
+    """Condense a document until it fits in max_tokens tokens.
+
+    A document that fits is returned unchanged. Otherwise its sections are
+    summarized, and the summaries are summarized level by level until the
+    joined summaries fit.
+
+    :param settings: The settings to use for the API.
+    :param document: The document text.
+    :param max_tokens: Maximum number of tokens of the result.
+    :param prompt: The prompt to summarize a section with.
+    :param concurrency: Maximum number of requests in flight.
+    :return: The document or the joined summaries, None if a request failed.
+    """
+    sections = split_sections(document, max_tokens)
+    level = 0
+    while len(sections) > 1:
+        level += 1
+        logging.info(f"Summarizing {len(sections)} sections, level {level}")
+        summaries = await summarize_sections(settings, sections, prompt, concurrency)
+        if summaries is None:
+            return None
+
+        document = SEPARATOR.join(summaries)
+        reduced = split_sections(document, max_tokens)
+        if len(reduced) >= len(sections):
+            raise RuntimeError(
+                f"Summaries of {len(sections)} sections do not fit in fewer sections"
+            )
+        sections = reduced
+
+    return document
@@ -0,0 +1,14 @@
+import pytest
+
+from common.async_iterator import to_async_iterator
+
+
+@pytest.mark.unit
+@pytest.mark.asyncio
+async def test_to_async_iterator():
+    async def items():
+        yield "a"
+        yield "b"
+
+    assert [item async for item in to_async_iterator(["a", "b"])] == ["a", "b"]
+    assert [item async for item in to_async_iterator(items())] == ["a", "b"]
@@ -0,0 +1,43 @@
+import os
+
+import pytest
+
+from common.disk_cache import DiskCache
+
+
+@pytest.mark.unit
+def test_get_set(tmp_path):
+    cache = DiskCache(directory=str(tmp_path), max_bytes=100)
+
+    assert cache.get("key") is None
+    cache.set("key", b"value")
+    assert b"value" == cache.get("key")
+
+    cache.delete("key")
+    assert cache.get("key") is None
+
+
+@pytest.mark.unit
+def test_lru_eviction(tmp_path):
+    cache = DiskCache(directory=str(tmp_path), max_bytes=10)
+
+    cache.set("a", b"aaaa")
+    cache.set("b", b"bbbb")
+    os.utime(cache.path("a"), ns=(1, 1))
+    os.utime(cache.path("b"), ns=(2, 2))
+    cache.get("a")  # a is now the most recently used
+
+    cache.set("c", b"cccc")
+
+    assert b"aaaa" == cache.get("a")
+    assert cache.get("b") is None
+    assert b"cccc" == cache.get("c")
+
+
+@pytest.mark.unit
+def test_skip_oversize(tmp_path):
+    cache = DiskCache(directory=str(tmp_path), max_bytes=2)
+
+    cache.set("a", b"aaaa")
+
+    assert cache.get("a") is None
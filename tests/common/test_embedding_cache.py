@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+from pytest_mock import MockerFixture
+
+from common.embedding_cache import EmbeddingCache, get_embedding_cache
+
+
+@pytest.mark.unit
+def test_embedding_cache(tmp_path):
+    cache = EmbeddingCache(str(tmp_path))
+    assert cache.get("a") is None
+
+    cache.put_many(["a", "b", "a"], np.array([[1, 2], [3, 4], [5, 6]]))
+    assert len(cache) == 2
+    assert cache.get("a").tolist() == [1, 2]
+    assert [v.tolist() for v in cache.get_many(["b", "a"])] == [[3, 4], [1, 2]]
+    assert cache.get_many(["c"]) == [None]
+
+    with pytest.raises(ValueError):
+        cache.put_many(["c"], np.array([[1, 2, 3]]))
+
+    # a row written without its index line, as after a crash, is reused
+    with open(cache.vectors_path, "ab") as f:
+        f.write(np.array([9, 9], dtype=np.float32).tobytes())
+    with open(cache.index_path, "a", encoding="utf-8") as f:
+        f.write("partial")
+
+    cache = EmbeddingCache(str(tmp_path))
+    assert len(cache) == 2
+    cache.put_many(["c"], np.array([[7, 8]]))
+
+    cache = EmbeddingCache(str(tmp_path))
+    vector = cache.get("c")
+    assert vector.tolist() == [7, 8]
+    assert vector.dtype == np.float32
+    assert isinstance(vector.base, np.memmap)
+
+
+@pytest.mark.unit
+def test_shared_directory(tmp_path):
+    first = EmbeddingCache(str(tmp_path))
+    second = EmbeddingCache(str(tmp_path))
+
+    first.put_many(["a"], np.array([[1, 2]]))
+    # the header of the first writer is kept, its rows are not overwritten
+    second.put_many(["b", "a"], np.array([[3, 4], [5, 6]]))
+    first.put_many(["c"], np.array([[7, 8]]))
+
+    assert second.get("a").tolist() == [1, 2]
+    assert first.get("b").tolist() == [3, 4]
+    cache = EmbeddingCache(str(tmp_path))
+    assert {text: cache.get(text).tolist() for text in "abc"} == {
+        "a": [1, 2],
+        "b": [3, 4],
+        "c": [7, 8],
+    }
+    with open(cache.index_path, encoding="utf-8") as f:
+        assert f.read().count("\n") == 4
+
+    assert get_embedding_cache(str(tmp_path)) is get_embedding_cache(str(tmp_path))
+
+
+@pytest.mark.unit
+def test_windows_lock(tmp_path, mocker: MockerFixture):
+    msvcrt = mocker.patch("common.embedding_cache.msvcrt", create=True)
+    mocker.patch("common.embedding_cache.fcntl", None)
+
+    cache = EmbeddingCache(str(tmp_path))
+    cache.put_many(["a"], np.array([[1, 2]]))
+
+    assert cache.get("a").tolist() == [1, 2]
+    modes = [call.args[1] for call in msvcrt.locking.call_args_list]
+    assert modes == [msvcrt.LK_LOCK, msvcrt.LK_UNLCK] * 2
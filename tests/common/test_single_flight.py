@@ -0,0 +1,59 @@
+import asyncio
+
+import pytest
+
+from common.single_flight import SingleFlight
+
+
+@pytest.mark.unit
+@pytest.mark.asyncio
+async def test_single_flight():
+    flights = SingleFlight()
+    started = []
+    release = asyncio.Event()
+
+    async def call(value):
+        started.append(value)
+        await release.wait()
+        if value == "error":
+            raise ValueError(value)
+        return value
+
+    waiters = [
+        asyncio.create_task(flights.run(key, lambda key=key: call(key)))
+        for key in ["a", "b", "a", "a", "error", "error"]
+    ]
+    await asyncio.sleep(0)
+    release.set()
+    results = await asyncio.gather(*waiters, return_exceptions=True)
+
+    assert started == ["a", "b", "error"]
+    assert results[:4] == ["a", "b", "a", "a"]
+    assert all(isinstance(result, ValueError) for result in results[4:])
+    assert flights.stats.model_dump() == {"calls": 6, "coalesced": 3}
+    assert flights.flights == {}
+
+    # finished calls are not shared
+    assert await flights.run("a", lambda: call("a")) == "a"
+    assert started == ["a", "b", "error", "a"]
+
+
+@pytest.mark.unit
+@pytest.mark.asyncio
+async def test_single_flight_cancel():
+    flights = SingleFlight()
+    release = asyncio.Event()
+
+    async def call():
+        await release.wait()
+        return 1
+
+    first = asyncio.create_task(flights.run("a", call))
+    second = asyncio.create_task(flights.run("a", call))
+    await asyncio.sleep(0)
+    first.cancel()
+    release.set()
+
+    assert await second == 1
+    with pytest.raises(asyncio.CancelledError):
+        await first
@@ -0,0 +1,58 @@
+from unittest.mock import patch
+
+import pytest
+
+from common.sqlite_cache import SQLiteCache
+
+
+@pytest.mark.unit
+def test_sqlite_cache(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    cache = SQLiteCache(path, max_entries=1, max_bytes=10)
+
+    assert cache.get("a") is None
+    cache.set("a", b"aaaa")
+    cache.set("b", b"bbbb")
+    assert cache.get("b") == b"bbbb"
+    # "a" fell out of the memory tier but is still on disk
+    assert cache.get("a") == b"aaaa"
+    assert cache.stats.model_dump() == {"memory_hits": 1, "disk_hits": 1, "misses": 1}
+
+    # "b" is the least recently read and goes over the disk budget
+    cache.set("c", b"cccc")
+    cache.memory.clear()
+    assert cache.get("b") is None
+    assert cache.get("a") == b"aaaa"
+    cache.close()
+
+    # entries outlive the process
+    cache = SQLiteCache(path)
+    assert cache.get("c") == b"cccc"
+    assert cache.stats.hit_rate == 1.0
+    cache.close()
+
+
+@pytest.mark.unit
+def test_sqlite_cache_ttl(tmp_path):
+    cache = SQLiteCache(str(tmp_path / "cache.sqlite"), ttl_seconds=60)
+
+    with patch("common.sqlite_cache.time.time", return_value=1000.0):
+        cache.set("a", b"aaaa")
+    with patch("common.sqlite_cache.time.time", return_value=1059.0):
+        assert cache.get("a") == b"aaaa"
+    with patch("common.sqlite_cache.time.time", return_value=1061.0):
+        assert cache.get("a") is None
+        cache.memory.clear()
+        assert cache.get("a") is None
+    cache.close()
+
+
+@pytest.mark.unit
+def test_sqlite_cache_creates_folder(tmp_path):
+    path = tmp_path / ".cache" / "completions.sqlite"
+
+    cache = SQLiteCache(str(path))
+    cache.set("a", b"aaaa")
+    cache.close()
+
+    assert path.exists()
@@ -0,0 +1,16 @@
+from unittest.mock import MagicMock
+
+import pytest
+from pytest_mock import MockerFixture
+
+
+@pytest.fixture
+def encoding(mocker: MockerFixture) -> MagicMock:
+    # one token per character
+    encoding = MagicMock()
+    encoding.encode.side_effect = lambda s: [ord(c) for c in s]
+    encoding.decode_tokens_bytes.side_effect = lambda tokens: [
+        chr(t).encode("utf-8") for t in tokens
+    ]
+    mocker.patch("extractors.chunker.get_encoding", return_value=encoding)
+    return encoding
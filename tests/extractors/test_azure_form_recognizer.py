@@ -1,4 +1,4 @@
-from unittest.mock import MagicMock
+from unittest.mock import AsyncMock, MagicMock
 
 import azure.ai.formrecognizer as fr
 import pytest
@@ -14,10 +14,7 @@ TBL_BOUNDING_REGIONS = [
 ]
 
 
-@pytest.mark.unit
-@pytest.mark.asyncio
-async def test_extractor(mocker: MockerFixture):
-    # arrange
+def create_fr_result() -> MagicMock:
     fr_result = MagicMock()
     fr_result.tables = [
         fr.DocumentTable(
@@ -92,7 +89,16 @@ async def test_extractor(mocker: MockerFixture):
             bounding_regions=[],
         ),
     ]
-    mocker.patch("extractors.azure_form_recognizer.analyze", return_value=fr_result)
+    return fr_result
+
+
+@pytest.mark.unit
+@pytest.mark.asyncio
+async def test_extractor(mocker: MockerFixture):
+    # arrange
+    mocker.patch(
+        "extractors.azure_form_recognizer.analyze", return_value=create_fr_result()
+    )
 
     # act
     result = await extractor.extract(
@@ -111,3 +117,127 @@ async def test_extractor(mocker: MockerFixture):
 second page
 
 no bounding regions""" == result
+
+
+@pytest.mark.unit
+def test_lookup_table():
+    # arrange
+    first = extractor.DocTable(
+        cells=[
+            extractor.DocTableCell(
+                page_number=1, row_index=0, column_index=0, text="a", x=1, y=1
+            )
+        ]
+    )
+    second = extractor.DocTable(
+        cells=[
+            extractor.DocTableCell(
+                page_number=1, row_index=0, column_index=0, text="b", x=1, y=1
+            ),
+            extractor.DocTableCell(
+                page_number=1, row_index=0, column_index=1, text="c", x=2, y=1
+            ),
+        ]
+    )
+    index = extractor.index_tables([first, second])
+
+    # act & assert
+    assert extractor.lookup_table(index, [TBL_BOUNDING_REGIONS[0]]) is first
+    assert extractor.lookup_table(index, [TBL_BOUNDING_REGIONS[2]]) is second
+    assert extractor.lookup_table(index, [TBL_BOUNDING_REGIONS[3]]) is None
+    assert (
+        extractor.lookup_table(
+            index, [fr.BoundingRegion(page_number=2, polygon=[fr.Point(x=1, y=1)])]
+        )
+        is None
+    )
+    assert extractor.lookup_table(index, []) is None
+
+
+@pytest.mark.unit
+@pytest.mark.asyncio
+async def test_extract_pages(mocker: MockerFixture):
+    # arrange
+    mocker.patch(
+        "extractors.azure_form_recognizer.analyze", return_value=create_fr_result()
+    )
+
+    # act
+    pages = [
+        page
+        async for page in extractor.extract_pages(
+            settings=MagicMock(),
+            sas_url="sas_url",
+            discard_roles=[extractor.ParagraphRole(role="pageHeader")],
+        )
+    ]
+
+    # assert
+    assert [1, 2] == [page.page_number for page in pages]
+    assert [False, True] == [block.table for block in pages[0].blocks]
+    assert "second page\n\nno bounding regions" == pages[1].content
+
+
+@pytest.mark.unit
+@pytest.mark.asyncio
+async def test_extract_batch(mocker: MockerFixture):
+    # arrange
+    async def analyze(settings, sas_url, cache_key, client):
+        if sas_url == "bad":
+            raise ValueError("bad document")
+        return create_fr_result()
+
+    mocker.patch("extractors.azure_form_recognizer.get_client")
+    mocker.patch("extractors.azure_form_recognizer.analyze", side_effect=analyze)
+
+    # act
+    results = [
+        result
+        async for result in extractor.extract_batch(
+            settings=MagicMock(), documents=["good1", "bad", "good2"], concurrency=2
+        )
+    ]
+
+    # assert
+    results.sort(key=lambda x: x.document)
+    assert ["bad", "good1", "good2"] == [result.document for result in results]
+    assert "bad document" == results[0].error
+    assert results[0].content is None
+    assert results[1].content and results[1].content.startswith("header")
+    assert results[2].error is None
+
+
+@pytest.mark.unit
+@pytest.mark.asyncio
+async def test_extract_batch_blob_cache_key(mocker: MockerFixture):
+    # arrange
+    storage = MagicMock()
+    storage.create_sas_url = AsyncMock(
+        side_effect=lambda container_name, blob_name: f"https://sas/{blob_name}"
+    )
+    storage.get_blob_etag = AsyncMock(return_value="0x1")
+    storage.close = AsyncMock()
+    mocker.patch("extractors.azure_form_recognizer.get_client")
+    mocker.patch(
+        "extractors.azure_form_recognizer.blob_storage.BlobStorage",
+        return_value=storage,
+    )
+    analyze = mocker.patch(
+        "extractors.azure_form_recognizer.analyze", return_value=create_fr_result()
+    )
+
+    # act
+    results = [
+        result
+        async for result in extractor.extract_batch(
+            settings=MagicMock(azure_form_recognizer_cache_dir=".cache"),
+            documents=["a.pdf"],
+            container_name="docs",
+        )
+    ]
+
+    # assert
+    assert results[0].error is None
+    storage.get_blob_etag.assert_awaited_once_with("docs", "a.pdf")
+    assert analyze.call_args.args[1] == "https://sas/a.pdf"
+    assert analyze.call_args.kwargs["cache_key"] == "docs/a.pdf@0x1"
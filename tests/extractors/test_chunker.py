@@ -0,0 +1,75 @@
+from unittest.mock import MagicMock
+
+import pytest
+
+from extractors.azure_form_recognizer import DocBlock, DocPage
+from extractors.chunker import chunk_pages
+
+pytestmark = pytest.mark.usefixtures("encoding")
+
+
+def create_pages() -> list[DocPage]:
+    return [
+        DocPage(
+            page_number=1,
+            blocks=[DocBlock(content="aaaa"), DocBlock(content="bbbb")],
+        ),
+        DocPage(
+            page_number=2,
+            blocks=[
+                DocBlock(content="| tbl |\n|-----|", table=True),
+                DocBlock(content="cccccccccccc"),
+            ],
+        ),
+    ]
+
+
+@pytest.mark.unit
+def test_chunk_pages(encoding: MagicMock):
+    # act
+    chunks = list(chunk_pages(create_pages(), max_tokens=10))
+
+    # assert
+    assert [
+        "aaaa\n\nbbbb",
+        "| tbl |\n|-----|",
+        "cccccccccc",
+        "cc",
+    ] == [chunk.content for chunk in chunks]
+    assert [[1], [2], [2], [2]] == [chunk.page_numbers for chunk in chunks]
+    assert [10, 15, 10, 2] == [chunk.token_count for chunk in chunks]
+    # separator + one call per block
+    assert 5 == encoding.encode.call_count
+
+
+@pytest.mark.unit
+def test_chunk_pages_overlap():
+    # act
+    chunks = list(chunk_pages(create_pages()[:1], max_tokens=6, overlap_tokens=4))
+    pages = [
+        DocPage(page_number=1, blocks=[DocBlock(content="aa"), DocBlock(content="bb")]),
+        DocPage(page_number=2, blocks=[DocBlock(content="cc")]),
+    ]
+    overlapped = list(chunk_pages(pages, max_tokens=6, overlap_tokens=2))
+
+    # assert
+    assert ["aaaa", "bbbb"] == [chunk.content for chunk in chunks]
+    assert ["aa\n\nbb", "bb\n\ncc"] == [chunk.content for chunk in overlapped]
+    assert [[1], [1, 2]] == [chunk.page_numbers for chunk in overlapped]
+
+
+@pytest.mark.unit
+def test_chunk_pages_multibyte(encoding: MagicMock):
+    # arrange, one token per byte, so tokens end inside characters
+    encoding.encode.side_effect = lambda s: list(s.encode("utf-8"))
+    encoding.decode_tokens_bytes.side_effect = lambda tokens: [
+        bytes([t]) for t in tokens
+    ]
+    pages = [DocPage(page_number=1, blocks=[DocBlock(content="aéé€")])]
+
+    # act
+    chunks = list(chunk_pages(pages, max_tokens=4))
+
+    # assert, no replacement characters and counts match the text
+    assert ["aé", "é", "€"] == [chunk.content for chunk in chunks]
+    assert [3, 2, 3] == [chunk.token_count for chunk in chunks]
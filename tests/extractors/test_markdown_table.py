@@ -0,0 +1,29 @@
+import pytest
+from tabulate import tabulate
+
+from extractors.markdown_table import format_fast, format_table
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize(
+    "header, rows",
+    [
+        (["Name", "Amount"], [["Revenue", "$1,200"], ["  Cost ", "(45)"]]),
+        (["", "a long header"], [["x", "y"], ["z"]]),
+        (["Name", "Amount"], [["Revenue", "1,200"], ["Cost", "45"]]),
+        (["Name", "Note"], [["a", "line1\nline2"]]),
+        (["Name"], [["café"]]),
+    ],
+)
+def test_format_table(header: list[str], rows: list[list[str]]):
+    assert tabulate(rows, headers=header, tablefmt="github") == format_table(
+        header, rows
+    )
+
+
+@pytest.mark.unit
+def test_format_fast_fallback():
+    assert format_fast(["Name", "Amount"], [["Revenue", "1,200"]]) is None
+    assert format_fast(["Name"], []) is None
+    assert format_fast(["Name"], [["a", "b"]]) is None
+    assert format_fast(["Name", "Amount"], [["Revenue", "$1,200"]]) is not None
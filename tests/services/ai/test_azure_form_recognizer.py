@@ -0,0 +1,170 @@
+import asyncio
+from pathlib import Path
+from unittest.mock import AsyncMock, MagicMock
+
+import azure.ai.formrecognizer as fr
+import pytest
+
+from services.ai.azure_form_recognizer import (
+    analyze,
+    analyze_document,
+    begin_analyze,
+    merge_results,
+)
+
+
+def create_shard(page_number: int, content: str) -> fr.AnalyzeResult:
+    def region():
+        return fr.BoundingRegion(page_number=page_number, polygon=[fr.Point(x=1, y=1)])
+
+    def span():
+        return fr.DocumentSpan(offset=0, length=len(content))
+
+    return fr.AnalyzeResult(
+        model_id="prebuilt-layout",
+        content=content,
+        pages=[fr.DocumentPage(page_number=page_number, spans=[span()])],
+        paragraphs=[
+            fr.DocumentParagraph(
+                content=content, bounding_regions=[region()], spans=[span()]
+            )
+        ],
+        documents=[
+            fr.AnalyzedDocument(
+                doc_type="doc",
+                bounding_regions=[region()],
+                spans=[span()],
+                fields={
+                    "name": fr.DocumentField(
+                        value_type="string",
+                        value=content,
+                        content=content,
+                        bounding_regions=[region()],
+                        spans=[span()],
+                    )
+                },
+            )
+        ],
+        tables=[
+            fr.DocumentTable(
+                row_count=1,
+                column_count=1,
+                bounding_regions=[region()],
+                cells=[
+                    fr.DocumentTableCell(
+                        row_index=0,
+                        column_index=0,
+                        content=content,
+                        bounding_regions=[region()],
+                        spans=[span()],
+                    )
+                ],
+            )
+        ],
+    )
+
+
+@pytest.mark.unit
+def test_merge_results():
+    # arrange, the second shard is numbered from page 1
+    shards = [(3, create_shard(1, "page3")), (1, create_shard(1, "page1"))]
+
+    # act
+    result = merge_results(shards)
+
+    # assert
+    assert "page1\npage3" == result.content
+    assert [1, 3] == [page.page_number for page in result.pages]
+    assert ["page1", "page3"] == [p.content for p in result.paragraphs]
+    assert [0, 6] == [p.spans[0].offset for p in result.paragraphs]
+    assert [1, 3] == [t.cells[0].bounding_regions[0].page_number for t in result.tables]
+    assert "page3" == result.content[result.paragraphs[1].spans[0].offset :]
+    fields = [d.fields["name"] for d in result.documents]
+    assert [1, 3] == [f.bounding_regions[0].page_number for f in fields]
+    assert [0, 6] == [f.spans[0].offset for f in fields]
+
+
+@pytest.mark.unit
+@pytest.mark.asyncio
+async def test_begin_analyze(tmp_path):
+    # arrange
+    client = MagicMock()
+    client.begin_analyze_document = AsyncMock()
+    client.begin_analyze_document_from_url = AsyncMock()
+    path = tmp_path / "test.pdf"
+    path.write_bytes(b"%PDF")
+
+    # act
+    await begin_analyze(client, "https://sas_url", "prebuilt-layout")
+    await begin_analyze(client, path, "prebuilt-layout", pages="1-2")
+    await begin_analyze(client, str(path), "prebuilt-layout")
+
+    # assert
+    client.begin_analyze_document_from_url.assert_awaited_once_with(
+        model_id="prebuilt-layout", document_url="https://sas_url", pages=None
+    )
+    first, second = client.begin_analyze_document.await_args_list
+    assert "1-2" == first.kwargs["pages"]
+    assert path == Path(first.kwargs["document"].name)
+    assert path == Path(second.kwargs["document"].name)
+
+
+@pytest.mark.unit
+@pytest.mark.asyncio
+async def test_analyze_cache(tmp_path):
+    # arrange
+    settings = MagicMock()
+    settings.azure_form_recognizer_cache_dir = str(tmp_path / "cache")
+    settings.azure_form_recognizer_cache_max_bytes = 1024 * 1024
+    poller = MagicMock()
+    poller.result = AsyncMock(return_value=create_shard(1, "page1"))
+    client = MagicMock()
+    client.begin_analyze_document = AsyncMock(return_value=poller)
+    path = tmp_path / "test.pdf"
+    path.write_bytes(b"%PDF")
+
+    # act
+    results = [
+        await analyze(settings, document, client=client)
+        for document in [b"%PDF", b"%PDF", path, path, b"%PDF-other"]
+    ]
+
+    # assert, the file has the same content as the first bytes document
+    assert 2 == client.begin_analyze_document.await_count
+    assert ["page1"] * 5 == [result.content for result in results]
+
+
+@pytest.mark.unit
+@pytest.mark.asyncio
+async def test_analyze_document_concurrency():
+    # arrange
+    running = 0
+    peak = 0
+
+    async def begin_analyze_document(model_id, document, pages):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0)
+        running -= 1
+        start = int(pages.split("-")[0])
+        poller = MagicMock()
+        poller.result = AsyncMock(return_value=create_shard(start, f"page{start}"))
+        return poller
+
+    client = MagicMock()
+    client.begin_analyze_document = begin_analyze_document
+
+    # act
+    result = await analyze_document(
+        client,
+        b"%PDF",
+        "prebuilt-layout",
+        page_count=10,
+        pages_per_shard=2,
+        max_concurrency=2,
+    )
+
+    # assert
+    assert 2 == peak
+    assert len(result.pages) == 5
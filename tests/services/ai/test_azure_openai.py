@@ -0,0 +1,562 @@
+import asyncio
+import base64
+import time
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import httpx
+import numpy as np
+import pytest
+from openai import APITimeoutError, BadRequestError, RateLimitError
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
+
+from common.settings import AzureOpenAISettings
+from services.ai.azure_openai import (
+    OpenAIRouter,
+    OpenAISession,
+    batch_by_tokens,
+    get_completion,
+    get_embedding,
+    get_router,
+    get_session,
+    rate_limit,
+    rate_limit_blocking,
+)
+from services.ai.rate_limiter import RateLimiter, _limiters
+
+
+@pytest.fixture(autouse=True)
+def limiters():
+    # limiters are shared by the process, don't leak spent quota between tests
+    yield
+    _limiters.clear()
+
+
+def create_session(**kwargs) -> OpenAISession:
+    settings = MagicMock()
+    settings.openai_embedding_max_items = 2
+    settings.openai_embedding_max_tokens = 10
+    settings.openai_embedding_max_concurrency = 2
+    settings.max_retry_time_secs = 1
+    settings.openai_max_tokens = None
+    settings.openai_tokens_per_minute = 0
+    settings.openai_requests_per_minute = 0
+    settings.openai_embedding_tokens_per_minute = 0
+    settings.openai_embedding_requests_per_minute = 0
+    settings.openai_image_requests_per_minute = 0
+    settings.openai_completion_cache_path = None
+    settings.openai_embedding_cache_dir = None
+    settings.openai_http2 = False
+    for name, value in kwargs.items():
+        setattr(settings, name, value)
+    return OpenAISession(settings)
+
+
+def embed(input: list[str], encoding_format: str | None = None, **kwargs):
+    data = []
+    # answer in reverse order, vectors must still land on their input
+    for index in reversed(range(len(input))):
+        vector = [float(len(input[index])), float(index)]
+        if encoding_format == "base64":
+            vector = base64.b64encode(np.array(vector, dtype=np.float32).tobytes())
+        data.append(MagicMock(index=index, embedding=vector))
+    return MagicMock(data=data)
+
+
+@pytest.mark.unit
+def test_batch_by_tokens():
+    assert batch_by_tokens([], max_items=2, max_tokens=10) == []
+    assert batch_by_tokens([1, 1, 1], max_items=2, max_tokens=10) == [(0, 2), (2, 3)]
+    assert batch_by_tokens([6, 5, 4, 20, 1], max_items=4, max_tokens=10) == [
+        (0, 1),
+        (1, 3),
+        (3, 4),
+        (4, 5),
+    ]
+
+
+@pytest.mark.unit
+@pytest.mark.asyncio
+@pytest.mark.parametrize("as_array", [False, True])
+async def test_get_embeddings(as_array):
+    session = create_session()
+    create = AsyncMock(side_effect=embed)
+    session._aclient = MagicMock()
+    session._aclient.embeddings.create = create
+    session._loop = asyncio.get_running_loop()
+
+    texts = ["a", "bb\nb", "cccc", "dddddddd", "e"]
+    with patch("services.ai.azure_openai.num_tokens_from_string", len):
+        result = await session.get_embeddings(texts, as_array=as_array)
+
+    inputs = [call.kwargs["input"] for call in create.call_args_list]
+    assert sorted(inputs) == [["a", "bb b"], ["cccc"], ["dddddddd", "e"]]
+
+    expected = [[1, 0], [4, 1], [4, 0], [8, 0], [1, 1]]
+    if as_array:
+        assert isinstance(result, np.ndarray)
+        assert result.dtype == np.float32
+        assert result.tolist() == expected
+    else:
+        assert result == expected
+
+
+@pytest.mark.unit
+@pytest.mark.asyncio
+async def test_rate_limit():
+    limiter = RateLimiter(tokens_per_minute=1000)
+    throttled = RateLimitError(
+        "throttled",
+        response=httpx.Response(
+            429,
+            headers={"retry-after-ms": "10"},
+            request=httpx.Request("POST", "https://example.com"),
+        ),
+        body=None,
+    )
+    callable = AsyncMock(
+        side_effect=[throttled, MagicMock(usage=MagicMock(total_tokens=30))]
+    )
+
+    with patch("services.ai.azure_openai.asyncio.sleep") as sleep:
+        response = await rate_limit(
+            callable, params={}, max_retry_time=4, limiter=limiter, tokens=100
+        )
+
+    assert response.usage.total_tokens == 30
+    sleep.assert_awaited_once_with(0.01)
+    assert callable.await_count == 2
+    # charged 100 twice, credited back the throttled call and 70 unused tokens
+    assert limiter.tokens.level == pytest.approx(970, abs=1)
+
+
+@pytest.mark.unit
+@pytest.mark.asyncio
+async def test_rate_limit_refunds_failures():
+    limiter = RateLimiter(tokens_per_minute=1000)
+    timeout = APITimeoutError(request=httpx.Request("POST", "https://example.com"))
+    callable = AsyncMock(side_effect=timeout)
+
+    with patch("services.ai.azure_openai.asyncio.sleep") as sleep:
+        response = await rate_limit(
+            callable, params={}, max_retry_time=4, limiter=limiter, tokens=100
+        )
+
+    assert response is None
+    assert [call.args[0] for call in sleep.await_args_list] == [2, 4]
+    assert callable.await_count == 3
+    # every timed out call is refunded
+    assert limiter.tokens.level == pytest.approx(1000, abs=1)
+
+
+@pytest.mark.unit
+def test_rate_limit_blocking():
+    limiter = RateLimiter(tokens_per_minute=1000)
+    timeout = APITimeoutError(request=httpx.Request("POST", "https://example.com"))
+    completion = MagicMock(usage=None)
+    callable = MagicMock(side_effect=[timeout, completion])
+
+    with patch("services.ai.azure_openai.time.sleep") as sleep:
+        response = rate_limit_blocking(
+            callable, params={}, max_retry_time=4, limiter=limiter, tokens=100
+        )
+
+    assert response is completion
+    sleep.assert_called_once_with(2)
+    assert callable.call_count == 2
+    # the timeout is refunded, the response without usage keeps its charge
+    assert limiter.tokens.level == pytest.approx(900, abs=1)
+
+
+@pytest.mark.unit
+def test_sync_get_embedding():
+    session = create_session(openai_embedding_model="ada")
+    create = MagicMock(return_value=MagicMock(usage=None))
+    session._client = MagicMock()
+    session._client.embeddings.create = create
+
+    with (
+        patch("services.ai.azure_openai.get_session", return_value=session),
+        patch("services.ai.azure_openai.num_tokens_from_string", return_value=1),
+        patch.object(
+            session.embedding_limiter, "acquire_blocking", return_value=1
+        ) as acquire,
+    ):
+        response = get_embedding(session.settings, "a\nb")
+
+    create.assert_called_once_with(input="a b", model="ada")
+    acquire.assert_called_once_with(1)
+    assert response is create.return_value
+
+
+@pytest.mark.unit
+@pytest.mark.asyncio
+async def test_completion_cache(tmp_path):
+    session = create_session(
+        deployment_model="gpt",
+        openai_completion_cache_path=str(tmp_path / "cache.sqlite"),
+        openai_completion_cache_max_entries=16,
+        openai_completion_cache_max_bytes=1024 * 1024,
+        openai_completion_cache_ttl_secs=0,
+    )
+    completion = ChatCompletion(
+        id="1",
+        choices=[],
+        created=0,
+        model="gpt",
+        object="chat.completion",
+    )
+    create = AsyncMock(return_value=completion)
+    session._aclient = MagicMock()
+    session._aclient.chat.completions.create = create
+    session._loop = asyncio.get_running_loop()
+
+    messages = [{"role": "user", "content": "hello"}]
+    with patch("services.ai.azure_openai.num_tokens_from_messages", return_value=1):
+        assert await session.get_completion(messages) == completion
+        assert await session.get_completion(messages) == completion
+        assert create.await_count == 1
+
+        # only deterministic completions are cached
+        await session.get_completion(messages, temperature=0.5)
+        await session.get_completion(messages, temperature=0.5)
+    assert create.await_count == 3
+    assert session.completion_cache.stats.memory_hits == 1
+
+
+@pytest.mark.unit
+@pytest.mark.asyncio
+async def test_embedding_cache(tmp_path):
+    session = create_session(
+        openai_embedding_model="ada", openai_embedding_cache_dir=str(tmp_path)
+    )
+    create = AsyncMock(side_effect=embed)
+    session._aclient = MagicMock()
+    session._aclient.embeddings.create = create
+    session._loop = asyncio.get_running_loop()
+
+    with patch("services.ai.azure_openai.num_tokens_from_string", len):
+        first = await session.get_embeddings(["a", "bb", "a"])
+        second = await session.get_embeddings(["bb", "ccc", "a"], as_array=True)
+
+    # only misses are sent, each once
+    inputs = [call.kwargs["input"] for call in create.call_args_list]
+    assert inputs == [["a", "bb"], ["ccc"]]
+    assert first == [[1, 0], [2, 1], [1, 0]]
+    assert second.tolist() == [[2, 1], [3, 0], [1, 0]]
+
+    response = await session.get_embedding("ccc")
+    assert response.data[0].embedding == [3, 0]
+    assert create.await_count == 2
+
+
+class FakeStream:
+    def __init__(self, chunks: list[ChatCompletionChunk]):
+        self.chunks = chunks
+        self.closed = False
+
+    async def __aiter__(self):
+        for chunk in self.chunks:
+            yield chunk
+
+    async def close(self):
+        self.closed = True
+
+
+def create_chunk(content: str | None, finish_reason: str | None = None):
+    return ChatCompletionChunk(
+        id="1",
+        created=0,
+        model="gpt",
+        object="chat.completion.chunk",
+        choices=[
+            {
+                "index": 0,
+                "delta": {"content": content},
+                "finish_reason": finish_reason,
+            }
+        ],
+    )
+
+
+@pytest.mark.unit
+@pytest.mark.asyncio
+async def test_stream_completion():
+    session = create_session(
+        deployment_model="gpt", openai_tokens_per_minute=1000, max_retry_time_secs=4
+    )
+    stream = FakeStream(
+        [create_chunk("Hel"), create_chunk("lo"), create_chunk(None, "stop")]
+    )
+    throttled = RateLimitError(
+        "throttled",
+        response=httpx.Response(
+            429,
+            headers={"retry-after": "1"},
+            request=httpx.Request("POST", "https://example.com"),
+        ),
+        body=None,
+    )
+    create = AsyncMock(side_effect=[throttled, stream])
+    session._aclient = MagicMock()
+    session._aclient.chat.completions.create = create
+    session._loop = asyncio.get_running_loop()
+
+    messages = [{"role": "user", "content": "hello"}]
+    with (
+        patch("services.ai.azure_openai.num_tokens_from_messages", return_value=10),
+        patch("services.ai.azure_openai.num_tokens_from_string", len),
+        patch("services.ai.azure_openai.asyncio.sleep"),
+    ):
+        completion_stream = session.stream_completion(messages, max_tokens=100)
+        deltas = [delta async for delta in completion_stream]
+
+    assert deltas == ["Hel", "lo"]
+    assert create.await_count == 2
+    assert create.call_args.kwargs["stream"] is True
+    assert stream.closed
+    assert completion_stream.output_tokens == 5
+
+    completion = completion_stream.completion
+    assert completion.choices[0].message.content == "Hello"
+    assert completion.choices[0].finish_reason == "stop"
+    assert completion.usage.total_tokens == 15
+    # charged 110 up front, settled to the 15 used
+    assert session.limiter.tokens.level == pytest.approx(985, abs=1)
+
+
+@pytest.mark.unit
+@pytest.mark.asyncio
+async def test_coalescing():
+    session = create_session(deployment_model="gpt")
+    release = asyncio.Event()
+
+    async def complete(**kwargs):
+        await release.wait()
+        return MagicMock(usage=None)
+
+    session._aclient = MagicMock()
+    session._aclient.chat.completions.create = AsyncMock(side_effect=complete)
+    session._aclient.embeddings.create = AsyncMock(return_value=MagicMock())
+    session._loop = asyncio.get_running_loop()
+
+    messages = [{"role": "user", "content": "hello"}]
+    with (
+        patch("services.ai.azure_openai.num_tokens_from_messages", return_value=1),
+        patch("services.ai.azure_openai.num_tokens_from_string", return_value=1),
+    ):
+        calls = [session.get_completion(messages) for _ in range(3)]
+        calls.append(session.get_completion(messages, temperature=0.5))
+        calls += [session.get_embedding("a\nb"), session.get_embedding("a b")]
+        tasks = [asyncio.create_task(call) for call in calls]
+        await asyncio.sleep(0)
+        release.set()
+        results = await asyncio.gather(*tasks)
+
+    assert results[0] is results[1] is results[2]
+    assert results[4] is results[5]
+    assert session._aclient.chat.completions.create.await_count == 2
+    assert session._aclient.embeddings.create.await_count == 1
+    assert session.flights.stats.model_dump() == {"calls": 5, "coalesced": 3}
+
+
+@pytest.mark.unit
+def test_get_session():
+    settings = AzureOpenAISettings(
+        openai_azure_endpoint="https://default",
+        azure_openai_api_key="key",
+        openai_api_version="2023-12-01-preview",
+        deployment_model="gpt",
+        openai_embedding_model="ada",
+        openai_dalle_model="dalle",
+    )
+    session = get_session(settings)
+    assert get_session(settings.model_copy()) is session
+
+    other = get_session(settings.model_copy(update={"deployment_model": "gpt-4"}))
+    assert other is not session
+    assert other.settings.deployment_model == "gpt-4"
+    assert get_session(settings.model_copy(update={"max_retry_time_secs": 5})) not in (
+        session,
+        other,
+    )
+
+
+@pytest.mark.unit
+def test_session_loop_change():
+    session = create_session(
+        azure_openai_api_key="key",
+        openai_azure_endpoint="https://default",
+        openai_api_version="2023-12-01-preview",
+        openai_max_connections=10,
+        openai_max_keepalive_connections=5,
+        request_timeout=10,
+    )
+
+    async def get_client():
+        aclient = session.aclient
+        assert session.aclient is aclient
+        await asyncio.sleep(0)
+        return aclient
+
+    first = asyncio.run(get_client())
+    second = asyncio.run(get_client())
+    assert second is not first
+    assert first.is_closed()
+    assert not second.is_closed()
+
+
+@pytest.mark.unit
+def test_session_http2_requires_h2():
+    with patch("importlib.util.find_spec", return_value=None):
+        with pytest.raises(RuntimeError, match="h2"):
+            create_session(openai_http2=True)
+
+
+def create_router(max_failures: int = 3, **kwargs) -> OpenAIRouter:
+    settings = AzureOpenAISettings(
+        openai_azure_endpoint="https://default",
+        azure_openai_api_key="key",
+        openai_api_version="2023-12-01-preview",
+        deployment_model="gpt",
+        openai_embedding_model="ada",
+        openai_dalle_model="dalle",
+        max_retry_time_secs=4,
+        openai_router_max_failures=max_failures,
+        openai_deployments=[
+            {
+                "openai_azure_endpoint": f"https://{name}",
+                "azure_openai_api_key": name,
+                "deployment_model": "gpt",
+                "openai_tokens_per_minute": 1000,
+            }
+            for name in ("east", "west")
+        ],
+        **kwargs,
+    )
+    return OpenAIRouter(settings)
+
+
+@pytest.mark.unit
+@pytest.mark.asyncio
+async def test_router_failover():
+    router = create_router(max_failures=2)
+    east, west = router.endpoints
+    assert east.session.settings.openai_azure_endpoint == "https://east"
+    assert east.session.settings.max_retry_time_secs == 0
+    assert east.session.limiter.tokens.capacity == 1000
+
+    throttled = RateLimitError(
+        "throttled",
+        response=httpx.Response(
+            429,
+            headers={"retry-after": "10"},
+            request=httpx.Request("POST", "https://east"),
+        ),
+        body=None,
+    )
+    east.session.get_completion = AsyncMock(side_effect=[throttled, None, None])
+    west.session.get_completion = AsyncMock(return_value="west")
+
+    # throttled east is skipped for its retry-after
+    assert await router.get_completion([]) == "west"
+    assert await router.get_completion([]) == "west"
+    assert east.session.get_completion.await_count == 1
+    assert router.ranked() == [west]
+
+    # east failing twice in a row is ejected
+    east.ejected_until = 0
+    west.latencies.append(1.0)
+    assert await router.get_completion([]) == "west"
+    assert await router.get_completion([]) == "west"
+    assert east.session.get_completion.await_count == 3
+    assert router.ranked() == [west]
+
+
+@pytest.mark.unit
+@pytest.mark.asyncio
+async def test_router_ranking():
+    router = create_router()
+    east, west = router.endpoints
+    east.latencies.extend([0.5, 0.5, 3.0])
+    west.latencies.extend([1.0, 1.0])
+    assert router.ranked() == [east, west]
+
+    # spent quota outweighs latency
+    east.session.limiter.tokens.level = 100
+    assert router.ranked() == [west, east]
+
+    # all ejected, the first back is probed
+    east.ejected_until = west.ejected_until = time.monotonic() + 60
+    west.ejected_until += 1
+    assert router.ranked() == [east]
+
+    east.session.get_completion = AsyncMock(return_value=None)
+    west.session.get_completion = AsyncMock(return_value=None)
+    with patch("services.ai.azure_openai.asyncio.sleep") as sleep:
+        assert await router.get_completion([]) is None
+    assert [call.args[0] for call in sleep.await_args_list] == [2, 4]
+
+
+@pytest.mark.unit
+@pytest.mark.asyncio
+async def test_router_bad_request():
+    router = create_router(max_failures=1)
+    east, west = router.endpoints
+    bad_request = BadRequestError(
+        "context_length_exceeded",
+        response=httpx.Response(400, request=httpx.Request("POST", "https://east")),
+        body=None,
+    )
+    east.session.aclient.chat.completions.create = AsyncMock(side_effect=bad_request)
+    west.session.get_completion = AsyncMock(return_value="west")
+
+    # a bad request fails on its own, it is neither retried nor failed over
+    with patch("services.ai.azure_openai.num_tokens_from_messages", return_value=1):
+        with pytest.raises(BadRequestError):
+            await router.get_completion([])
+    assert east.session.aclient.chat.completions.create.await_count == 1
+    west.session.get_completion.assert_not_awaited()
+    assert east.failures == 0
+    assert router.ranked() == [east, west]
+
+    # callers of the module function get None, like for other failures
+    with (
+        patch("services.ai.azure_openai.get_router", return_value=router),
+        patch("services.ai.azure_openai.num_tokens_from_messages", return_value=1),
+    ):
+        assert await get_completion(router.settings, []) is None
+
+
+@pytest.mark.unit
+def test_router_ranks_by_call_limiter():
+    router = create_router()
+    east, west = router.endpoints
+    east.session.embedding_limiter = RateLimiter(tokens_per_minute=1000)
+    east.session.embedding_limiter.tokens.level = 100
+
+    # spent embedding quota doesn't rank completions down
+    assert router.ranked() == [east, west]
+    assert router.ranked(lambda session: session.embedding_limiter) == [west, east]
+
+
+@pytest.mark.unit
+def test_router_shares_caches(tmp_path):
+    router = create_router(
+        openai_completion_cache_path=str(tmp_path / "completions.sqlite"),
+        openai_embedding_cache_dir=str(tmp_path / "embeddings"),
+    )
+    east, west = [endpoint.session for endpoint in router.endpoints]
+
+    assert east.completion_cache is west.completion_cache
+    assert east.embedding_cache is west.embedding_cache
+    assert get_session(router.settings).completion_cache is east.completion_cache
+
+    messages = [{"role": "user", "content": "hello"}]
+    params = east.completion_params(messages, 0.0, None)
+    assert east.cache_key(params) == west.cache_key(params)
+    assert east.cache_key(params) != get_session(router.settings).cache_key(params)
+
+    assert get_router(router.settings) is get_router(router.settings.model_copy())
+    assert get_router(
+        router.settings.model_copy(update={"openai_router_max_failures": 1})
+    ) is not get_router(router.settings)
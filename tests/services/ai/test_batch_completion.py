@@ -0,0 +1,85 @@
+import json
+from unittest.mock import MagicMock
+
+import pytest
+from openai.types.chat import ChatCompletion
+from pytest_mock import MockerFixture
+
+from services.ai.batch_completion import run_batch
+
+
+def create_completion(content: str) -> ChatCompletion:
+    return ChatCompletion.model_validate(
+        {
+            "id": "1",
+            "created": 0,
+            "model": "gpt",
+            "object": "chat.completion",
+            "choices": [
+                {
+                    "index": 0,
+                    "finish_reason": "stop",
+                    "message": {"role": "assistant", "content": content},
+                }
+            ],
+            "usage": {"prompt_tokens": 1, "completion_tokens": 2, "total_tokens": 3},
+        }
+    )
+
+
+@pytest.mark.unit
+@pytest.mark.asyncio
+async def test_run_batch(tmp_path, mocker: MockerFixture):
+    input_path = tmp_path / "input.jsonl"
+    output_path = tmp_path / "output.jsonl"
+    items = [{"id": "a"}, {"id": "b"}, {"id": "fail"}, {}]
+    lines = [
+        json.dumps({**item, "messages": [{"role": "user", "content": "hi"}]})
+        for item in items
+    ]
+    # a malformed line fails on its own
+    lines[3:3] = ['{"id": "broken", ', "[1]"]
+    input_path.write_text("\n".join(lines))
+    # a previous run finished "a" and crashed while writing "b"
+    output_path.write_text(
+        '{"id": "a", "completion": {}, "error": null}\n{"id": "b", "comp'
+    )
+    (tmp_path / "output.jsonl.checkpoint").write_text("a\nb")
+
+    calls = []
+
+    async def get_completion(settings, messages, temperature, max_tokens):
+        calls.append(messages)
+        if len(calls) == 2:
+            return None
+        return create_completion("done")
+
+    mocker.patch(
+        "services.ai.batch_completion.azure_openai.get_completion",
+        side_effect=get_completion,
+    )
+
+    stats = await run_batch(
+        MagicMock(), str(input_path), str(output_path), concurrency=1
+    )
+
+    assert stats.model_dump(exclude={"elapsed"}) == {
+        "total": 6,
+        "skipped": 1,
+        "completed": 2,
+        "failed": 3,
+        "tokens": 6,
+    }
+    lines = [json.loads(line) for line in output_path.read_text().splitlines()]
+    assert [(line["id"], line["error"]) for line in lines] == [
+        ("a", None),
+        ("b", None),
+        ("fail", "Failed to get a completion"),
+        ("4", "Invalid JSON line"),
+        ("5", "Invalid JSON line"),
+        ("6", None),
+    ]
+    assert lines[1]["completion"]["choices"][0]["message"]["content"] == "done"
+    # failed items are retried by the next run
+    checkpoint = (tmp_path / "output.jsonl.checkpoint").read_text()
+    assert checkpoint.splitlines() == ["a", "b", "6"]
@@ -0,0 +1,140 @@
+import asyncio
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+from pytest_mock import MockerFixture
+
+from services.ai.image_generation import download_to_file, generate_images
+
+
+class FakeResponse:
+    def __init__(self, url: str):
+        self.url = url
+        self.content = MagicMock()
+        self.content.iter_chunked = self.iter_chunked
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+    def raise_for_status(self):
+        if "missing" in self.url:
+            raise RuntimeError("404")
+
+    async def iter_chunked(self, size: int):
+        for chunk in (b"png-", self.url.encode()):
+            await asyncio.sleep(0)
+            if "broken" in self.url and chunk != b"png-":
+                raise ConnectionResetError("connection lost")
+            yield chunk
+
+
+class FakeClientSession:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+    def get(self, url: str) -> FakeResponse:
+        return FakeResponse(url)
+
+
+def create_image(prompt: str) -> MagicMock:
+    if prompt == "refused":
+        return None
+    response = MagicMock()
+    response.data = [MagicMock(url=f"https://images/{prompt}", revised_prompt=None)]
+    return response
+
+
+@pytest.mark.unit
+@pytest.mark.asyncio
+async def test_generate_images(tmp_path, mocker: MockerFixture):
+    session = MagicMock()
+    session.create_image = AsyncMock(side_effect=create_image)
+    mocker.patch(
+        "services.ai.image_generation.azure_openai.get_session", return_value=session
+    )
+    mocker.patch(
+        "services.ai.image_generation.aiohttp.ClientSession", FakeClientSession
+    )
+
+    prompts = ["cat", "refused", "missing", "dog"]
+    images = [
+        image
+        async for image in generate_images(
+            MagicMock(), prompts, directory=str(tmp_path), prefix="img-", concurrency=2
+        )
+    ]
+
+    images.sort(key=lambda image: image.index)
+    assert [image.prompt for image in images] == prompts
+    assert [image.error for image in images] == [
+        None,
+        "Failed to generate the image",
+        "404",
+        None,
+    ]
+    assert images[0].location == str(tmp_path / "img-00000.png")
+    assert (tmp_path / "img-00003.png").read_bytes() == b"png-https://images/dog"
+    assert images[3].size == len(b"png-https://images/dog")
+    assert sorted(p.name for p in tmp_path.iterdir()) == [
+        "img-00000.png",
+        "img-00003.png",
+    ]
+
+
+@pytest.mark.unit
+@pytest.mark.asyncio
+async def test_generate_images_to_blob(mocker: MockerFixture):
+    session = MagicMock()
+    session.create_image = AsyncMock(side_effect=create_image)
+    mocker.patch(
+        "services.ai.image_generation.azure_openai.get_session", return_value=session
+    )
+    mocker.patch(
+        "services.ai.image_generation.aiohttp.ClientSession", FakeClientSession
+    )
+    uploaded = {}
+
+    async def upload_blob_from_stream(container_name, blob_name, data, overwrite):
+        uploaded[(container_name, blob_name)] = b"".join([c async for c in data])
+        return len(uploaded[(container_name, blob_name)])
+
+    storage = MagicMock()
+    storage.upload_blob_from_stream = upload_blob_from_stream
+    storage.close = AsyncMock()
+    mocker.patch(
+        "services.ai.image_generation.blob_storage.BlobStorage", return_value=storage
+    )
+
+    images = [
+        image
+        async for image in generate_images(
+            MagicMock(), iter(["cat"]), container_name="images"
+        )
+    ]
+
+    assert images[0].location == "00000.png"
+    assert uploaded == {("images", "00000.png"): b"png-https://images/cat"}
+    storage.close.assert_awaited_once()
+
+
+@pytest.mark.unit
+@pytest.mark.asyncio
+async def test_download_to_file(tmp_path):
+    path = str(tmp_path / "image.png")
+
+    assert await download_to_file(FakeResponse("ok"), path, chunk_size=4) == 6
+    with open(path, "rb") as f:
+        assert f.read() == b"png-ok"
+
+    # a failed download leaves the previous file and no partial one
+    with pytest.raises(ConnectionResetError):
+        await download_to_file(FakeResponse("broken"), path, chunk_size=4)
+    with open(path, "rb") as f:
+        assert f.read() == b"png-ok"
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["image.png"]
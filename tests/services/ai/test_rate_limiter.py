@@ -0,0 +1,112 @@
+from unittest.mock import patch
+
+import pytest
+
+from services.ai.rate_limiter import RateLimiter, get_rate_limiter
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps: list[float] = []
+
+    def monotonic(self) -> float:
+        return self.now
+
+    async def sleep(self, seconds: float):
+        self.blocking_sleep(seconds)
+
+    def blocking_sleep(self, seconds: float):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock():
+    clock = FakeClock()
+    with (
+        patch("services.ai.rate_limiter.time.monotonic", clock.monotonic),
+        patch("services.ai.rate_limiter.asyncio.sleep", clock.sleep),
+        patch("services.ai.rate_limiter.time.sleep", clock.blocking_sleep),
+    ):
+        yield clock
+
+
+@pytest.mark.unit
+@pytest.mark.asyncio
+async def test_tokens_per_minute(clock):
+    limiter = RateLimiter(tokens_per_minute=600)
+
+    assert await limiter.acquire(500) == 500
+    assert clock.sleeps == []
+
+    # 100 tokens left, 300 more refill in 30 seconds
+    await limiter.acquire(400)
+    assert clock.sleeps == [30.0]
+
+    # unused tokens are credited back, overruns are taken
+    limiter.settle(charged=400, used=100)
+    assert limiter.tokens.level == 300
+    limiter.settle(charged=0, used=400)
+    assert limiter.tokens.level == -100
+
+    # a request larger than the quota waits for a full bucket
+    clock.sleeps.clear()
+    await limiter.acquire(1000)
+    assert clock.sleeps == [70.0]
+
+
+@pytest.mark.unit
+@pytest.mark.asyncio
+async def test_requests_per_minute(clock):
+    limiter = RateLimiter(requests_per_minute=2)
+
+    await limiter.acquire(10_000)
+    await limiter.acquire(10_000)
+    assert clock.sleeps == []
+    await limiter.acquire(10_000)
+    assert clock.sleeps == [30.0]
+    assert limiter.tokens is None
+
+
+@pytest.mark.unit
+@pytest.mark.asyncio
+async def test_acquire_blocking(clock):
+    limiter = RateLimiter(tokens_per_minute=600)
+
+    # blocking and async callers draw from the same bucket
+    assert limiter.acquire_blocking(500) == 500
+    await limiter.acquire(400)
+    assert clock.sleeps == [30.0]
+
+    limiter.settle(charged=400, used=0)
+    limiter.acquire_blocking(400)
+    assert clock.sleeps == [30.0]
+    assert limiter.tokens.level == 0
+
+
+@pytest.mark.unit
+def test_get_rate_limiter():
+    limiter = get_rate_limiter("https://endpoint", "gpt")
+    assert get_rate_limiter("https://endpoint", "gpt") is limiter
+    assert limiter.tokens is None
+
+    # other quotas for the same deployment are not dropped
+    limited = get_rate_limiter("https://endpoint", "gpt", tokens_per_minute=1000)
+    assert limited is not limiter
+    assert limited.tokens.capacity == 1000
+
+
+@pytest.mark.unit
+@pytest.mark.asyncio
+async def test_settle_capped_charge(clock):
+    limiter = RateLimiter(tokens_per_minute=1000)
+
+    # a request over the quota is charged a full bucket, not its estimate
+    charged = await limiter.acquire(5000)
+    assert charged == 1000
+    limiter.settle(charged, used=100)
+    assert limiter.tokens.level == 900
+
+    charged = limiter.acquire_blocking(5000)
+    assert charged == 1000
@@ -0,0 +1,298 @@
+import asyncio
+import datetime
+import gzip
+import io
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+from azure.core.exceptions import HttpResponseError
+from azure.storage.blob import BlobSasPermissions
+
+import services.storage.azure_blob_storage as blob_storage
+from services.storage.azure_blob_storage import (
+    BlobIndex,
+    BlobInfo,
+    BlobStorage,
+    SasGenerator,
+)
+
+CONNECTION_STRING = (
+    "DefaultEndpointsProtocol=https;AccountName=account;AccountKey=a2V5;"
+    "EndpointSuffix=core.windows.net"
+)
+
+
+def create_storage(
+    blob_client: MagicMock, cache_dir: str | None = None, chunk_size: int = 1024
+) -> BlobStorage:
+    settings = MagicMock(
+        azure_storage_connection_string=CONNECTION_STRING,
+        azure_storage_cache_dir=cache_dir,
+        azure_storage_cache_max_bytes=1024,
+        azure_storage_cache_max_age_secs=0,
+    )
+    storage = BlobStorage(settings, chunk_size=chunk_size)
+    storage.client = MagicMock()
+    storage.client.get_blob_client.return_value = blob_client
+    return storage
+
+
+@pytest.mark.unit
+def test_create_sas_url():
+    generator = SasGenerator(CONNECTION_STRING)
+
+    url = generator.create_sas_url("container", "blob.pdf")
+
+    assert url.startswith("https://account.blob.core.windows.net/container/blob.pdf?")
+    assert "sp=r" in url
+    assert url == generator.create_sas_url("container", "blob.pdf")
+    assert url != generator.create_sas_url(
+        "container", "blob.pdf", permission=BlobSasPermissions(read=True, write=True)
+    )
+
+
+@pytest.mark.unit
+def test_create_sas_url_refresh():
+    generator = SasGenerator(CONNECTION_STRING, refresh_margin_seconds=300)
+    generator.create_sas_url("container", "blob.pdf")
+    key = next(iter(generator.cache))
+
+    # within the refresh margin of its expiry, a new URL is generated
+    now = datetime.datetime.now(datetime.timezone.utc)
+    generator.cache[key] = ("expiring", now + datetime.timedelta(seconds=200))
+    assert "expiring" != generator.create_sas_url("container", "blob.pdf")
+
+    generator.cache[key] = ("valid", now + datetime.timedelta(seconds=400))
+    assert "valid" == generator.create_sas_url("container", "blob.pdf")
+
+
+@pytest.mark.unit
+@pytest.mark.asyncio
+async def test_iter_blob_chunks():
+    # arrange
+    data = b"0123456789"
+
+    async def download_blob(offset, length, **kwargs):
+        await asyncio.sleep(0.01 if offset == 0 else 0)  # first range is slowest
+        downloader = MagicMock()
+        downloader.readall = AsyncMock(return_value=data[offset : offset + length])
+        return downloader
+
+    blob_client = MagicMock()
+    blob_client.get_blob_properties = AsyncMock(
+        return_value=MagicMock(size=len(data), etag="etag")
+    )
+    blob_client.download_blob = AsyncMock(side_effect=download_blob)
+    storage = create_storage(blob_client, chunk_size=4)
+
+    # act
+    chunks = [
+        chunk
+        async for chunk in storage.iter_blob_chunks(
+            "container", "blob", max_concurrency=2
+        )
+    ]
+
+    # assert
+    assert [b"0123", b"4567", b"89"] == chunks
+    assert "etag" == blob_client.download_blob.await_args.kwargs["etag"]
+
+
+@pytest.mark.unit
+@pytest.mark.asyncio
+async def test_upload_blob_from_stream():
+    # arrange
+    staged = {}
+
+    async def stage_block(block_id, data):
+        staged[block_id] = data
+
+    async def source():
+        for chunk in ["01234", b"56789", "0"]:
+            yield chunk
+
+    blob_client = MagicMock()
+    blob_client.stage_block = AsyncMock(side_effect=stage_block)
+    blob_client.commit_block_list = AsyncMock()
+    storage = create_storage(blob_client)
+
+    # act
+    uploaded = await storage.upload_blob_from_stream(
+        "container", "blob", source(), block_size=4, max_concurrency=2
+    )
+
+    # assert
+    block_ids = blob_client.commit_block_list.await_args.args[0]
+    assert 11 == uploaded
+    assert [b"0123", b"4567", b"890"] == [staged[block_id] for block_id in block_ids]
+    assert "*" == blob_client.commit_block_list.await_args.kwargs["etag"]
+
+
+@pytest.mark.unit
+@pytest.mark.asyncio
+async def test_upload_blob_from_stream_compress():
+    # arrange
+    staged = []
+    blob_client = MagicMock()
+    blob_client.stage_block = AsyncMock(
+        side_effect=lambda block_id, data: staged.append(data)
+    )
+    blob_client.commit_block_list = AsyncMock()
+    storage = create_storage(blob_client)
+
+    # act
+    await storage.upload_blob_from_stream(
+        "container",
+        "blob",
+        io.BytesIO(b"hello world" * 100),
+        overwrite=True,
+        block_size=16,
+        compress=True,
+    )
+
+    # assert
+    assert b"hello world" * 100 == gzip.decompress(b"".join(staged))
+    kwargs = blob_client.commit_block_list.await_args.kwargs
+    assert "gzip" == kwargs["content_settings"].content_encoding
+    assert "etag" not in kwargs
+
+
+@pytest.mark.unit
+def test_blob_index():
+    # arrange
+    def info(etag: str, day: int) -> BlobInfo:
+        return BlobInfo(
+            etag=etag,
+            size=1,
+            last_modified=datetime.datetime(2024, 1, day, tzinfo=datetime.timezone.utc),
+        )
+
+    previous = BlobIndex(
+        container_name="container", blobs={"a": info("1", 1), "b": info("1", 1)}
+    )
+    index = BlobIndex(
+        container_name="container",
+        blobs={"a": info("1", 1), "b": info("2", 3), "c": info("1", 3)},
+    )
+
+    # act & assert
+    assert index.exists("a")
+    assert ["d"] == index.missing(["a", "d"])
+    assert ["b", "c"] == index.modified_since(
+        datetime.datetime(2024, 1, 2, tzinfo=datetime.timezone.utc)
+    )
+    assert ["b", "c"] == index.changed(previous)
+    assert index == BlobIndex.model_validate_json(index.model_dump_json())
+
+
+@pytest.mark.unit
+@pytest.mark.asyncio
+async def test_download_blob_as_bytes_cache(tmp_path):
+    # arrange
+    downloader = MagicMock(properties=MagicMock(etag="etag1"))
+    downloader.readall = AsyncMock(return_value=b"content")
+    blob_client = MagicMock()
+    blob_client.download_blob = AsyncMock(
+        side_effect=[downloader, HttpResponseError(response=MagicMock(status_code=304))]
+    )
+    storage = create_storage(blob_client, cache_dir=str(tmp_path))
+
+    # act
+    first = await storage.download_blob_as_bytes("container", "blob")
+    second = await storage.download_blob_as_bytes("container", "blob")
+
+    # assert
+    assert b"content" == first == second
+    assert "etag1" == blob_client.download_blob.await_args.kwargs["etag"]
+    assert 1 == downloader.readall.await_count
+
+
+@pytest.mark.unit
+@pytest.mark.asyncio
+async def test_wrappers_share_storage(mocker):
+    from_connection_string = mocker.patch(
+        "services.storage.azure_blob_storage.BlobServiceClient.from_connection_string"
+    )
+    client = from_connection_string.return_value
+    client.close = AsyncMock()
+    blob_client = client.get_blob_client.return_value
+    blob_client.exists = AsyncMock(return_value=True)
+    blob_client.upload_blob = AsyncMock()
+    settings = MagicMock(
+        azure_storage_connection_string=CONNECTION_STRING,
+        azure_storage_cache_dir=None,
+        azure_storage_cache_max_bytes=1024,
+        azure_storage_cache_max_age_secs=0,
+    )
+
+    assert await blob_storage.is_blob_exists(settings, "container", "blob")
+    await blob_storage.upload_blob(settings, "container", "blob", b"data")
+
+    from_connection_string.assert_called_once()
+    assert blob_client.upload_blob.await_count == 1
+
+    await blob_storage.close_storages()
+    client.close.assert_awaited_once()
+    assert blob_storage._storages == {}
+
+
+@pytest.mark.unit
+def test_storage_loop_change(mocker):
+    from_connection_string = mocker.patch(
+        "services.storage.azure_blob_storage.BlobServiceClient.from_connection_string"
+    )
+    first_client, second_client = MagicMock(), MagicMock()
+    first_client.close = AsyncMock()
+    second_client.close = AsyncMock()
+    from_connection_string.side_effect = [first_client, second_client]
+    settings = MagicMock(
+        azure_storage_connection_string=CONNECTION_STRING,
+        azure_storage_cache_dir=None,
+        azure_storage_cache_max_bytes=1024,
+        azure_storage_cache_max_age_secs=0,
+    )
+
+    async def get_storage():
+        storage = blob_storage.get_storage(settings)
+        await asyncio.sleep(0)
+        return storage
+
+    first = asyncio.run(get_storage())
+    second = asyncio.run(get_storage())
+
+    # the session of the first loop is closed when it is replaced
+    assert second is not first
+    first_client.close.assert_awaited_once()
+    second_client.close.assert_not_awaited()
+    blob_storage._storages.clear()
+
+
+@pytest.mark.unit
+@pytest.mark.asyncio
+async def test_download_blob_as_str_wrapper(mocker):
+    from_connection_string = mocker.patch(
+        "services.storage.azure_blob_storage.BlobServiceClient.from_connection_string"
+    )
+    client = from_connection_string.return_value
+    client.close = AsyncMock()
+    downloader = MagicMock()
+    downloader.readall = AsyncMock(return_value=b"content")
+    blob_client = client.get_blob_client.return_value
+    blob_client.download_blob = AsyncMock(return_value=downloader)
+    settings = MagicMock(
+        azure_storage_connection_string=CONNECTION_STRING,
+        azure_storage_cache_dir=None,
+        azure_storage_cache_max_bytes=1024,
+        azure_storage_cache_max_age_secs=0,
+    )
+
+    content = await blob_storage.download_blob_as_str(
+        settings, "container", "blob", max_concurrency=4
+    )
+
+    assert "content" == content
+    blob_client.download_blob.assert_awaited_once_with(max_concurrency=4)
+    # only the ranged requests after the first one are small
+    assert "max_single_get_size" not in from_connection_string.call_args.kwargs
+    assert from_connection_string.call_args.kwargs["max_chunk_get_size"] == 4 << 20
+    await blob_storage.close_storages()
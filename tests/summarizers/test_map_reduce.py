@@ -0,0 +1,71 @@
+from unittest.mock import MagicMock
+
+import pytest
+from pytest_mock import MockerFixture
+
+from summarizers.map_reduce import map_reduce, split_sections
+
+pytestmark = pytest.mark.usefixtures("encoding")
+
+
+def create_completion(content: str) -> MagicMock:
+    completion = MagicMock()
+    completion.choices = [MagicMock()]
+    completion.choices[0].message.content = content
+    return completion
+
+
+@pytest.mark.unit
+def test_split_sections():
+    document = "aaaa\n\nbbbb\n\n\n\ncccccccccccc"
+    assert split_sections(document, max_tokens=10) == [
+        "aaaa\n\nbbbb",
+        "cccccccccc",
+        "cc",
+    ]
+    assert split_sections("aaaa", max_tokens=10) == ["aaaa"]
+
+
+@pytest.mark.unit
+@pytest.mark.asyncio
+async def test_map_reduce(mocker: MockerFixture):
+    prompts = []
+
+    async def get_completion(settings, messages, temperature):
+        section = messages[0]["content"]
+        prompts.append(section)
+        # each summary is 3 characters, the first of the section
+        return create_completion(section[0] * 3)
+
+    mocker.patch(
+        "summarizers.map_reduce.azure_openai.get_completion",
+        side_effect=get_completion,
+    )
+    settings = MagicMock()
+
+    # fits, nothing to summarize
+    assert await map_reduce(settings, "aaaa", max_tokens=10, prompt="{{document}}")
+    assert prompts == []
+
+    # 4 sections -> 4 summaries of 3 in 2 sections -> 2 summaries that fit
+    document = "\n\n".join(["aaaaaaaaaa", "bbbbbbbbbb", "cccccccccc", "dddddddddd"])
+    result = await map_reduce(settings, document, max_tokens=10, prompt="{{document}}")
+    assert prompts[:4] == ["aaaaaaaaaa", "bbbbbbbbbb", "cccccccccc", "dddddddddd"]
+    assert prompts[4:] == ["aaa\n\nbbb", "ccc\n\nddd"]
+    assert result == "aaa\n\nccc"
+
+
+@pytest.mark.unit
+@pytest.mark.asyncio
+async def test_map_reduce_no_progress(mocker: MockerFixture):
+    mocker.patch(
+        "summarizers.map_reduce.azure_openai.get_completion",
+        return_value=create_completion("x" * 10),
+    )
+    with pytest.raises(RuntimeError):
+        await map_reduce(MagicMock(), "a" * 30, max_tokens=10)
+
+    mocker.patch(
+        "summarizers.map_reduce.azure_openai.get_completion", return_value=None
+    )
+    assert await map_reduce(MagicMock(), "a" * 30, max_tokens=10) is None